@@ -0,0 +1,210 @@
+"""
+So sánh engine form_parser với các hàm parse cũ của /ns, /rp, /hold, /naptien.
+
+Chạy từ thư mục gốc:
+    python -m benchmarks.form_parser_bench [--messages 2000] [--repeat 5]
+"""
+import argparse
+import random
+import re
+import timeit
+
+from handlers.form_parser import NS_FORM, RP_FORM, HOLD_FORM, NAPTIEN_FORM
+
+
+# =========================
+# Bản sao nguyên văn các hàm parse cũ (để đo và đối chiếu kết quả)
+# =========================
+def legacy_ns(message_text):
+    lines = message_text.split('\n')
+    data = {"tên nhóm": "", "tổ": "", "mã hd": "", "ngân sách": "", "nội dung": ""}
+    field_mapping = {
+        "tên nhóm": "tên nhóm",
+        "nhóm": "tên nhóm",
+        "tổ": "tổ",
+        "mã hd": "mã hd",
+        "mã hậu đài": "mã hd",
+        "ngân sách xin": "ngân sách",
+        "ns": "ngân sách",
+        "ngân sách": "ngân sách",
+        "nội dung": "nội dung"
+    }
+    pattern = re.compile(r'^\+?(.*?)\s*:\s*(.*)$', re.IGNORECASE)
+    for line in lines:
+        line = line.strip()
+        if not line or line.lower().startswith('form ngân sách'):
+            continue
+        match = pattern.match(line)
+        if match:
+            key, value = match.groups()
+            normalized_key = field_mapping.get(key.strip().lower())
+            if normalized_key:
+                data[normalized_key] = value.strip()
+    if data["ngân sách"]:
+        data["ngân sách"] = abs(int(re.sub(r'[^\d]', '', data["ngân sách"])))
+    return data
+
+
+def legacy_rp(text):
+    patterns = {
+        "ad_ids": r"id\s*:\s*([\d, ]+)",
+        "spend": r"chi tiêu\s*:\s*([\d,.]+)",
+        "hold": r"hold\s*:\s*([\d,.]+)",
+        "mess_num": r"số mess\s*:\s*([\d,.]+)",
+        "id_bc": r"ID BC\s*:\s*(\S+)",
+        "note": r"note\s*:\s*(.+)",
+    }
+    data = {"ad_ids": [], "spend": None, "hold": 0, "note": None, "mess_num": None, "id_bc": None}
+    for line in text.split("\n"):
+        line = line.strip()
+        for key, pattern in patterns.items():
+            match = re.search(pattern, line, re.IGNORECASE)
+            if match:
+                value = match.group(1).strip()
+                if key == "ad_ids":
+                    data[key] = [id_.strip() for id_ in value.split(",") if id_.strip().isdigit()]
+                elif key in ["spend", "hold", "mess_num"]:
+                    spend_clean = re.sub(r"[^\d]", "", value)
+                    data[key] = int(spend_clean) if spend_clean.isdigit() else None
+                else:
+                    data[key] = value
+    return data
+
+
+def legacy_hold(text):
+    data = {"id_bc": None, "hold": None}
+    id_match = re.search(r"ID BC\s*:\s*(\S+)", text, re.IGNORECASE)
+    hold_match = re.search(r"Số tiền\s*:\s*([\d,.]+)", text, re.IGNORECASE)
+    if id_match:
+        data["id_bc"] = id_match.group(1).strip()
+    if hold_match:
+        clean = re.sub(r"[^\d]", "", hold_match.group(1))
+        data["hold"] = int(clean) if clean else None
+    return data
+
+
+def legacy_naptien(text):
+    data = {"id_bc": None, "so_tien_nap": None, "ads": None}
+    id_match = re.search(r"ID BC\s*:\s*(\S+)", text, re.IGNORECASE)
+    nap_match = re.search(r"Số tiền nạp\s*:\s*([\d,.]+)", text, re.IGNORECASE)
+    ads_match = re.search(r"ADS\s*:\s*@?(\S+)", text, re.IGNORECASE)
+    if id_match:
+        data["id_bc"] = id_match.group(1).strip()
+    if nap_match:
+        clean = re.sub(r"[^\d]", "", nap_match.group(1))
+        data["so_tien_nap"] = int(clean) if clean else None
+    if ads_match:
+        data["ads"] = ads_match.group(1).strip()
+    return data
+
+
+# =========================
+# Sinh tin nhắn giống thực tế
+# =========================
+def _money(rng):
+    value = rng.randrange(100, 50000) * 1000
+    return rng.choice([str(value), f"{value:,}", f"{value:,}".replace(",", ".")])
+
+
+def _bullet(rng):
+    # Chỉ dùng kiểu đầu dòng mà parser cũ hiểu để cột "lệch" so sánh được
+    return rng.choice(["", "", "+", "+ "])
+
+
+def _sep(rng):
+    return rng.choice([": ", ":", " : "])
+
+
+def make_ns(rng):
+    codes = ",".join(f"FD{rng.randrange(1, 9)}N{rng.randrange(10, 99)}" for _ in range(rng.randrange(1, 6)))
+    lines = [
+        "/ns",
+        "Form ngân sách",
+        f"{_bullet(rng)}Tên nhóm{_sep(rng)}Nhóm {rng.randrange(1, 300)}",
+        f"{_bullet(rng)}Tổ{_sep(rng)}{rng.choice(['t1', 'T2', 'hcm'])}",
+        f"{_bullet(rng)}{rng.choice(['Mã hd', 'mã hậu đài'])}{_sep(rng)}{codes}",
+        f"{_bullet(rng)}{rng.choice(['Ngân sách', 'ngân sách xin', 'ns'])}{_sep(rng)}{_money(rng)}",
+        f"{_bullet(rng)}Nội dung{_sep(rng)}chạy ads tuần {rng.randrange(1, 5)}",
+    ]
+    return "\n".join(lines)
+
+
+def make_rp(rng):
+    ids = ", ".join(str(rng.randrange(10 ** 14, 10 ** 15)) for _ in range(rng.randrange(1, 4)))
+    lines = [
+        "/rp",
+        f"ID{_sep(rng)}{ids}",
+        f"{rng.choice(['Chi tiêu', 'chi tiêu', 'CHI TIÊU'])}{_sep(rng)}{_money(rng)}",
+    ]
+    if rng.random() < 0.5:
+        lines.append(f"Hold{_sep(rng)}{_money(rng)}")
+    if rng.random() < 0.5:
+        lines.append(f"Số mess{_sep(rng)}{rng.randrange(1, 500)}")
+    if rng.random() < 0.3:
+        lines.append(f"ID BC{_sep(rng)}{rng.randrange(10 ** 9, 10 ** 10)}")
+    if rng.random() < 0.5:
+        lines.append(f"Note{_sep(rng)}camp {rng.randrange(1, 99)} ok")
+    return "\n".join(lines)
+
+
+def make_hold(rng):
+    return "\n".join([
+        "/hold",
+        f"ID BC{_sep(rng)}{rng.randrange(10 ** 9, 10 ** 10)}",
+        f"Số tiền{_sep(rng)}{_money(rng)}",
+    ])
+
+
+def make_naptien(rng):
+    lines = [
+        f"Số tiền nạp{_sep(rng)}{_money(rng)}",
+        f"ID BC{_sep(rng)}{rng.randrange(10 ** 9, 10 ** 10)}",
+        f"ADS{_sep(rng)}@user{rng.randrange(1, 50)}",
+    ]
+    rng.shuffle(lines)
+    return "\n".join(["/naptien"] + lines)
+
+
+CASES = [
+    # tên, sinh tin nhắn, hàm cũ, schema mới
+    ("/ns", make_ns, legacy_ns, NS_FORM),
+    ("/rp", make_rp, legacy_rp, RP_FORM),
+    ("/hold", make_hold, legacy_hold, HOLD_FORM),
+    ("/naptien", make_naptien, legacy_naptien, NAPTIEN_FORM),
+]
+
+
+def check_agreement(corpus, legacy, schema):
+    """Số tin nhắn mà engine mới cho kết quả khác hàm cũ (trên các trường hàm cũ trả về)."""
+    mismatches = 0
+    for text in corpus:
+        old = legacy(text)
+        new = schema.parse(text).values
+        if any(old[key] != new.get(key) for key in old):
+            mismatches += 1
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark form_parser so với các hàm parse cũ")
+    parser.add_argument("--messages", type=int, default=2000, help="Số tin nhắn mỗi lệnh")
+    parser.add_argument("--repeat", type=int, default=5, help="Số lần lặp timeit (lấy min)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'Lệnh':<10}{'cũ (µs/tin)':>14}{'mới (µs/tin)':>14}{'nhanh hơn':>12}{'lệch':>8}")
+    for name, make, legacy, schema in CASES:
+        corpus = [make(rng) for _ in range(args.messages)]
+        mismatches = check_agreement(corpus, legacy, schema)
+
+        old_time = min(timeit.repeat(lambda: [legacy(text) for text in corpus], number=1, repeat=args.repeat))
+        new_time = min(timeit.repeat(lambda: [schema.parse(text) for text in corpus], number=1, repeat=args.repeat))
+
+        old_us = old_time / len(corpus) * 1e6
+        new_us = new_time / len(corpus) * 1e6
+        print(f"{name:<10}{old_us:>14.2f}{new_us:>14.2f}{old_us / new_us:>11.2f}x{mismatches:>8}")
+
+
+if __name__ == "__main__":
+    main()
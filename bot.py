@@ -2,6 +2,9 @@
 from dotenv import load_dotenv
 import os
 import logging
+import html
+import importlib.util
+import secrets
 # Lấy ENV_PATH từ biến môi trường ENV_PATH
 env_path = os.getenv("ENV_PATH", ".env.khu_a")  # fallback về .env nếu không có
 
@@ -24,11 +27,17 @@ from telegram.ext import (
     filters
 )
 from decorators import ads_or_troly_rp
-from handlers.ultils import handle_info_command, help_command
-from db.rooms import RoomManager
+from handlers.ultils import handle_info_command, help_command, safe_send_message, safe_reply, notify_admins
+from db.rooms import room_manager
+from db.initdb import mongo_manager
+from db.indexes import index_manager
+from db.budget import budget_manager
+from handlers.db_helpers import pending_store, cleanup_expired, checkpoint_store, vacuum_store
+from handlers.api_client import api_client
+from handlers.send_scheduler import send_scheduler
+from handlers.update_processor import ChatOrderedUpdateProcessor, HANDLER_CLASS_BACKEND
 from telegram.request import HTTPXRequest
 
-room_manager = RoomManager()
 # Thiết lập logging
 # Tạo thư mục logs nếu chưa có
 if not os.path.exists("logs"):
@@ -71,7 +80,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "🔹 **Hướng dẫn sử dụng:**\n"
         "Sử dụng lệnh /h hoặc /help để xem danh sách các lệnh hỗ trợ.\n\n"
     )
-    await update.message.reply_text(introduction_text, parse_mode="Markdown")
+    await safe_reply(context.bot, update.message, introduction_text, parse_mode="Markdown")
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Trường hợp đặc biệt: lỗi ở polling layer, không có update
@@ -101,23 +110,21 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
         admin_message = (
             f"❗ <b>Error occurred</b>:\n"
-            f"• <b>Người dùng:</b> {user_info}\n"
-            f"• <b>Nhóm/Chat:</b> {chat_info}\n"
-            f"• <b>Tin nhắn:</b> <code>{message_text}</code>\n"
-            f"• <b>Lỗi:</b> <code>{str(context.error)}</code>"
+            f"• <b>Người dùng:</b> {html.escape(user_info)}\n"
+            f"• <b>Nhóm/Chat:</b> {html.escape(chat_info)}\n"
+            f"• <b>Tin nhắn:</b> <code>{html.escape(message_text)}</code>\n"
+            f"• <b>Lỗi:</b> <code>{html.escape(str(context.error))}</code>"
         )
 
-        for admin_id in config.ADMIN_IDS:
-            await context.bot.send_message(
-                chat_id=admin_id,
-                text=admin_message,
-                parse_mode="HTML"
-            )
+        # Qua hàng đợi gửi (PRIORITY_ADMIN): nhiều lỗi dồn dập cũng không làm bot bị Telegram giới hạn
+        notify_admins(context.bot, update.effective_chat.id if update.effective_chat else None, admin_message)
 
         if update.effective_message:
-            await update.effective_message.reply_text(
-                "Đã xảy ra lỗi trong quá trình xử lý. Vui lòng thử lại sau.",
-                quote=True
+            await safe_send_message(
+                context.bot,
+                chat_id=update.effective_message.chat_id,
+                text="Đã xảy ra lỗi trong quá trình xử lý. Vui lòng thử lại sau.",
+                reply_to_message_id=update.effective_message.message_id,
             )
     except Exception as e:
         logger.critical(f"Exception in error handler: {e}", exc_info=True)
@@ -129,14 +136,14 @@ async def ns_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Loại bỏ phần lệnh /ns để lấy phần form
     form_text = message_text.partition('/ns')[2].strip()
     if not form_text:
-        await update.message.reply_text("Vui lòng gửi form ngân sách sau lệnh /ns")
+        await safe_reply(context.bot, update.message, "Vui lòng gửi form ngân sách sau lệnh /ns")
         return
     # Gọi hàm xử lý form ngân sách
     await data_h.handle_ngansach(update, context)
 
 async def get_chat_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    await update.message.reply_text(f"Chat ID: {chat_id}")
+    await safe_reply(context.bot, update.message, f"Chat ID: {chat_id}")
 
 async def rp(update: Update, context: CallbackContext):
     """Xử lý lệnh /rp từ văn bản hoặc tin nhắn kèm media (video có caption)"""
@@ -156,7 +163,7 @@ async def rp(update: Update, context: CallbackContext):
 
     # Nếu `handle_rp_command` có phản hồi, gửi lại cho user
     if response:
-        await message.reply_text(response)
+        await safe_reply(context.bot, message, response)
 
     # Ghi log thông tin người gửi
     user = update.effective_user
@@ -166,6 +173,83 @@ async def rp(update: Update, context: CallbackContext):
     logger.info(f"User ID: {user_id}, Tên: {full_name}, Username: {username} đã gửi lệnh /rp")
 
 
+async def sweep_pending(context: ContextTypes.DEFAULT_TYPE):
+    """Job định kỳ: xóa dữ liệu chờ hết hạn, checkpoint WAL và thỉnh thoảng VACUUM bot_data.db."""
+    state = context.job.data
+    state["runs"] += 1
+
+    removed = await cleanup_expired()
+    state["removed"] += removed
+    logger.info(f"🧹 Dọn dữ liệu chờ: xóa {removed} dòng (tổng {state['removed']} sau {state['runs']} lần).")
+
+    if state["runs"] % config.PENDING_VACUUM_EVERY == 0:
+        await vacuum_store()
+    else:
+        await checkpoint_store()
+
+
+async def reconcile_rollup(context: ContextTypes.DEFAULT_TYPE):
+    """Job định kỳ: đối chiếu bảng tổng hợp ngân sách với dữ liệu gốc, sửa phần lệch đã xác nhận."""
+    await budget_manager.reconcile_rollup_async()
+
+
+async def post_init(application):
+    """Mở các kết nối dùng chung trước khi bot nhận update."""
+    await api_client.start()
+
+
+async def post_shutdown(application):
+    """Đóng các kết nối async khi bot tắt."""
+    # Gửi nốt các tin còn trong hàng đợi trước khi đóng kết nối
+    await send_scheduler.stop()
+    await api_client.close()
+    await mongo_manager.close_async()
+    pending_store.close()
+
+
+def _webhook_unavailable_reason():
+    """Lý do không chạy được webhook (None nếu chạy được) → khi đó quay về polling."""
+    if not config.WEBHOOK_URL:
+        return "chưa cấu hình WEBHOOK_URL"
+    if importlib.util.find_spec("tornado") is None:
+        return 'chưa cài python-telegram-bot[webhooks] (tornado)'
+    return None
+
+
+def run_application(application):
+    """
+    Chạy bot theo config.BOT_MODE. Cả hai chế độ đều dừng êm khi nhận SIGINT/SIGTERM:
+    ngừng nhận update mới, xử lý hết update đã nhận trong hàng đợi rồi mới gọi post_shutdown.
+    """
+    if config.BOT_MODE == "webhook":
+        reason = _webhook_unavailable_reason()
+        if reason is None:
+            secret_token = config.WEBHOOK_SECRET_TOKEN
+            if not secret_token:
+                # Telegram gửi kèm header X-Telegram-Bot-Api-Secret-Token; request sai token bị trả 403
+                secret_token = secrets.token_urlsafe(32)
+                logger.warning("⚠️ Chưa cấu hình WEBHOOK_SECRET_TOKEN, dùng token ngẫu nhiên cho lần chạy này.")
+            logger.info(
+                f"🌐 Chạy webhook: nghe {config.WEBHOOK_LISTEN}:{config.WEBHOOK_PORT}/{config.WEBHOOK_PATH}, "
+                f"URL {config.WEBHOOK_URL}/{config.WEBHOOK_PATH}"
+            )
+            return application.run_webhook(
+                listen=config.WEBHOOK_LISTEN,
+                port=config.WEBHOOK_PORT,
+                url_path=config.WEBHOOK_PATH,
+                webhook_url=f"{config.WEBHOOK_URL}/{config.WEBHOOK_PATH}",
+                secret_token=secret_token,
+                max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+            )
+        logger.warning(f"⚠️ Không chạy được webhook ({reason}), chuyển sang polling.")
+    elif config.BOT_MODE != "polling":
+        logger.warning(f"⚠️ BOT_MODE '{config.BOT_MODE}' không hợp lệ, dùng polling.")
+
+    logger.info("🔁 Chạy polling.")
+    # run_polling tự xóa webhook cũ (nếu trước đó chạy webhook) trước khi gọi getUpdates
+    return application.run_polling()
+
+
 def main():
     logger.info(f"🔌 Đang kết nối tới {config.BOT_TOKEN}...")
     request = HTTPXRequest(
@@ -174,12 +258,44 @@ def main():
         write_timeout=10,
         pool_timeout=10
     )
-    application = ApplicationBuilder().token(config.BOT_TOKEN).request(request).build()
+    application = (
+        ApplicationBuilder()
+        .token(config.BOT_TOKEN)
+        .request(request)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        # Các chat chạy song song, update trong một chat vẫn theo thứ tự
+        .concurrent_updates(ChatOrderedUpdateProcessor(
+            config.UPDATE_CONCURRENCY,
+            class_limits={HANDLER_CLASS_BACKEND: config.UPDATE_BACKEND_CONCURRENCY},
+        ))
+        .build()
+    )
 
-    # Tải danh sách các chat_id được phép và lưu vào bot_data
-    allowed_rooms = room_manager.get_all_room_ids()
-    application.bot_data['allowed_rooms'] = allowed_rooms
-    logger.info(f"Loaded allowed_rooms: {allowed_rooms}")
+    # Đảm bảo index cho các collection (idempotent)
+    index_manager.ensure_indexes()
+    budget_manager.ensure_rollup()
+
+    # Nạp registry phòng được duyệt (dùng chung cho decorator và các manager)
+    room_manager.load_registry()
+
+    # Dọn dữ liệu chờ hết hạn định kỳ (cần python-telegram-bot[job-queue])
+    if application.job_queue:
+        application.job_queue.run_repeating(
+            sweep_pending,
+            interval=config.PENDING_SWEEP_INTERVAL,
+            first=10,
+            name="sweep_pending",
+            data={"runs": 0, "removed": 0},
+        )
+        application.job_queue.run_repeating(
+            reconcile_rollup,
+            interval=config.ROLLUP_RECONCILE_INTERVAL,
+            first=config.ROLLUP_RECONCILE_INTERVAL,
+            name="reconcile_rollup",
+        )
+    else:
+        logger.warning("⚠️ JobQueue không khả dụng (thiếu APScheduler), bỏ qua job dọn dữ liệu chờ và đối chiếu bảng tổng hợp.")
 
     # Thêm handler cho lệnh /start
     application.add_handler(CommandHandler("start", start))
@@ -194,12 +310,12 @@ def main():
 
     # Thêm handler cho lệnh /tiktok để xử lý
     application.add_handler(CommandHandler("tiktok", data_h.handle_tiktok_command))
-    application.add_handler(CallbackQueryHandler(data_h.handle_tiktok_bulk_yes, pattern="^tiktok_bulk_yes$"))
-    application.add_handler(CallbackQueryHandler(data_h.handle_tiktok_bulk_no,  pattern="^tiktok_bulk_no$"))
+    application.add_handler(CallbackQueryHandler(data_h.handle_tiktok_bulk_yes, pattern=r"^tiktok_bulk_yes(\|\w+)?$"))
+    application.add_handler(CallbackQueryHandler(data_h.handle_tiktok_bulk_no,  pattern=r"^tiktok_bulk_no(\|\w+)?$"))
 
     application.add_handler(CommandHandler("facebook", data_h.handle_facebook_command))
-    application.add_handler(CallbackQueryHandler(data_h.handle_facebook_bulk_yes, pattern="^facebook_bulk_yes$"))
-    application.add_handler(CallbackQueryHandler(data_h.handle_facebook_bulk_no,  pattern="^facebook_bulk_no$"))
+    application.add_handler(CallbackQueryHandler(data_h.handle_facebook_bulk_yes, pattern=r"^facebook_bulk_yes(\|\w+)?$"))
+    application.add_handler(CallbackQueryHandler(data_h.handle_facebook_bulk_no,  pattern=r"^facebook_bulk_no(\|\w+)?$"))
 
     # Thêm handler cho lệnh /chatid để xác nhận chat ID
     application.add_handler(CommandHandler("gettid", get_chat_id))
@@ -209,6 +325,11 @@ def main():
     application.add_handler(CommandHandler("addtroly", admin_h.add_troly))
     application.add_handler(CommandHandler("removetroly", admin_h.remove_troly))
     application.add_handler(CommandHandler("lstroly", admin_h.list_troly))
+    application.add_handler(CommandHandler("indexes", admin_h.check_indexes))
+    application.add_handler(CommandHandler("rebuildrollup", admin_h.rebuild_rollup))
+    application.add_handler(CommandHandler("reloadref", admin_h.reload_reference))
+    application.add_handler(CommandHandler("checkcache", admin_h.check_cache_stats))
+    application.add_handler(CommandHandler("breaker", admin_h.breaker_status))
     
     # Thêm các lệnh Room management commands trực tiếp vào application
     application.add_handler(CommandHandler("ad", admin_h.add_room))
@@ -230,8 +351,8 @@ def main():
     # Thêm error handler
     application.add_error_handler(error_handler)
 
-    # Chạy bot
-    application.run_polling()
+    # Chạy bot (polling hoặc webhook theo BOT_MODE)
+    run_application(application)
 
 if __name__ == "__main__":
     main()
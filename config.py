@@ -8,15 +8,78 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_IDS = set(map(int, os.getenv("ADMIN_IDS", "").split(',')))
 EXPIRATION_TIME=28800
+# Dọn dữ liệu chờ hết hạn trong bot_data.db (giây); VACUUM sau mỗi N lần dọn
+PENDING_SWEEP_INTERVAL = int(os.getenv("PENDING_SWEEP_INTERVAL", "600"))
+PENDING_VACUUM_EVERY = int(os.getenv("PENDING_VACUUM_EVERY", "144"))
 
 ALLOW_ROOM = 'allow_room'
 HLV = 'hlv'
 BUDGET ='ngan_sach'
+BUDGET_ROLLUP = 'ngan_sach_rollup'
+# Đối chiếu bảng tổng hợp ngân sách (tháng trước + tháng này) với dữ liệu gốc định kỳ (giây)
+ROLLUP_RECONCILE_INTERVAL = int(os.getenv("ROLLUP_RECONCILE_INTERVAL", "1800"))
 ADS = 'ads'
 BUDGET_THRESHOLD='budget_limits'
 IGNORED_CONTRACTS = 'ignored_contracts'
+REFERENCE_CACHE_TTL = int(os.getenv("REFERENCE_CACHE_TTL", "300"))
+ROOM_REGISTRY_TTL = int(os.getenv("ROOM_REGISTRY_TTL", "300"))
+
+# Backend API (một ClientSession dùng chung cho cả bot)
+API_BASE_URL = os.getenv("API_BASE_URL", "http://103.48.84.131")
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", "30"))
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "10"))
+API_LIMIT_PER_HOST = int(os.getenv("API_LIMIT_PER_HOST", "20"))
+API_DNS_TTL = int(os.getenv("API_DNS_TTL", "300"))
+API_KEEPALIVE = float(os.getenv("API_KEEPALIVE", "60"))
+# Retry (có jitter) cho các lệnh gọi chỉ đọc và circuit breaker cho backend
+API_RETRIES = int(os.getenv("API_RETRIES", "2"))
+API_RETRY_BASE = float(os.getenv("API_RETRY_BASE", "0.5"))
+API_BREAKER_WINDOW = float(os.getenv("API_BREAKER_WINDOW", "60"))
+API_BREAKER_MIN_CALLS = int(os.getenv("API_BREAKER_MIN_CALLS", "10"))
+API_BREAKER_FAILURE_RATE = float(os.getenv("API_BREAKER_FAILURE_RATE", "0.5"))
+API_BREAKER_SLOW_CALL = float(os.getenv("API_BREAKER_SLOW_CALL", "10"))
+API_BREAKER_SLOW_RATE = float(os.getenv("API_BREAKER_SLOW_RATE", "0.8"))
+API_BREAKER_OPEN_SECONDS = float(os.getenv("API_BREAKER_OPEN_SECONDS", "30"))
+# /tiktok, /facebook: chia danh sách UID thành lô, kiểm tra song song, sửa tin nhắn tiến độ tối đa mỗi N giây
+BULK_CHECK_BATCH_SIZE = int(os.getenv("BULK_CHECK_BATCH_SIZE", "20"))
+BULK_CHECK_CONCURRENCY = int(os.getenv("BULK_CHECK_CONCURRENCY", "4"))
+BULK_CHECK_RETRIES = int(os.getenv("BULK_CHECK_RETRIES", "2"))
+BULK_CHECK_TIMEOUT = float(os.getenv("BULK_CHECK_TIMEOUT", "20"))
+BULK_CHECK_EDIT_INTERVAL = float(os.getenv("BULK_CHECK_EDIT_INTERVAL", "2"))
+# Cache kết quả kiểm tra user TikTok/Facebook (giây); kết quả không tìm thấy sống ngắn hơn
+USER_CHECK_TTL_FOUND = int(os.getenv("USER_CHECK_TTL_FOUND", "3600"))
+USER_CHECK_TTL_NOT_FOUND = int(os.getenv("USER_CHECK_TTL_NOT_FOUND", "300"))
+USER_CHECK_CACHE_SIZE = int(os.getenv("USER_CHECK_CACHE_SIZE", "5000"))
+# /xn dryRun: thời gian dùng lại kết quả agency KPI (giây)
+KPI_CACHE_TTL = int(os.getenv("KPI_CACHE_TTL", "30"))
+# Xử lý update song song giữa các chat (trong một chat vẫn tuần tự): tổng số update chạy cùng lúc,
+# và số lệnh gọi backend (/xn, /tiktok, /facebook, nút lưu) chạy cùng lúc
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+UPDATE_BACKEND_CONCURRENCY = int(os.getenv("UPDATE_BACKEND_CONCURRENCY", "4"))
+# Hàng đợi gửi tin nhắn Telegram: giới hạn tốc độ toàn cục / theo chat, số tin gửi song song, số lần thử lại
+SEND_GLOBAL_PER_SECOND = float(os.getenv("SEND_GLOBAL_PER_SECOND", "25"))
+SEND_GROUP_PER_MINUTE = float(os.getenv("SEND_GROUP_PER_MINUTE", "20"))
+SEND_CHAT_PER_SECOND = float(os.getenv("SEND_CHAT_PER_SECOND", "1"))
+SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "8"))
+SEND_RETRIES = int(os.getenv("SEND_RETRIES", "3"))
+# Kết quả /tiktok, /facebook chờ bấm nút lưu: số mục, thời gian sống (giây), tổng dung lượng (byte)
+CALLBACK_STORE_SIZE = int(os.getenv("CALLBACK_STORE_SIZE", "500"))
+CALLBACK_STORE_TTL = int(os.getenv("CALLBACK_STORE_TTL", "3600"))
+CALLBACK_STORE_MAX_BYTES = int(os.getenv("CALLBACK_STORE_MAX_BYTES", str(16 * 1024 * 1024)))
 
 AREA_NAME=os.getenv("AREA_NAME")
 MONGO_URI=os.getenv("MONGO_URI")
 DB_NAME=os.getenv("DB_NAME")
-WS_URL=os.getenv("WS_URL")
\ No newline at end of file
+WS_URL=os.getenv("WS_URL")
+# Cách nhận update: "polling" (mặc định) hoặc "webhook"
+# Webhook: bot nghe HTTP nội bộ tại WEBHOOK_LISTEN:WEBHOOK_PORT/WEBHOOK_PATH, reverse proxy (TLS) chuyển tiếp
+# từ WEBHOOK_URL công khai; nhiều bot khu vực dùng chung một cổng vào, phân biệt bằng WEBHOOK_PATH.
+# Thiếu WEBHOOK_URL hoặc chưa cài python-telegram-bot[webhooks] thì tự quay về polling.
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", f"telegram/{(AREA_NAME or 'bot').lower()}").strip("/")
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
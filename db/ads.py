@@ -19,6 +19,10 @@ class ADSManager:
         self.ads_collection = mongo_manager.get_collection(collection_name)
         self.collection_name = collection_name
 
+    @property
+    def async_ads_collection(self):
+        return mongo_manager.get_async_collection(self.collection_name)
+
     def switch_collection(self, new_collection):
         """Chuyển đổi collection trong khi chạy."""
         self.ads_collection = mongo_manager.get_collection(new_collection)
@@ -75,4 +79,46 @@ class ADSManager:
             logger.error(f"❌ Lỗi khi lấy danh sách quảng cáo từ ads: {e}")
             return []
 
+    # ===== API async (dùng trong handler của bot) =====
+
+    async def add_ad_async(self, id_tele, username, name):
+        try:
+            if await self.async_ads_collection.find_one({"id_tele": id_tele}):
+                logger.warning(f"⚠️ Quảng cáo với ID {id_tele} đã tồn tại.")
+                return None
+
+            ad_data = {
+                "id_tele": id_tele,
+                "username": username,
+                "name": name
+            }
+            result = await self.async_ads_collection.insert_one(ad_data)
+            logger.info(f"✅ Thêm quảng cáo mới thành công: {id_tele} - {username} - {name}")
+            return result.inserted_id
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi thêm quảng cáo: {e}")
+            return None
+
+    async def get_all_ads_async(self):
+        try:
+            return await self.async_ads_collection.find({}, {"_id": 0}).to_list(None)
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi lấy danh sách quảng cáo: {e}")
+            return []
+
+    async def get_ad_by_id_async(self, id_tele):
+        try:
+            ad = await self.async_ads_collection.find_one({"id_tele": id_tele}, {"_id": 0})
+            return ad or None
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi lấy thông tin quảng cáo: {e}")
+            return None
+
+    async def load_ad_ids_async(self):
+        try:
+            return list(await self.async_ads_collection.distinct("id_tele"))
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi lấy danh sách quảng cáo từ ads: {e}")
+            return []
+
 ads_manager = ADSManager()
\ No newline at end of file
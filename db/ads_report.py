@@ -21,6 +21,36 @@ class AdsReportManager:
         self.ads_report_collection = mongo_manager.get_collection(collection_name)
         self.status_collection = mongo_manager.get_collection(status_collection)
         self.collection_name = collection_name
+        self.status_collection_name = status_collection
+
+    @property
+    def async_ads_report_collection(self):
+        return mongo_manager.get_async_collection(self.collection_name)
+
+    @property
+    def async_status_collection(self):
+        return mongo_manager.get_async_collection(self.status_collection_name)
+
+    @staticmethod
+    def _build_report_doc(ad_ids, spend, ad_type, note, group_name, group_id, sender, ad_date, hold, mess_num, id_bc, confirmed_by):
+        if not ad_date:
+            raise ValueError("❌ Lỗi: `ad_date` không hợp lệ!")
+
+        return {
+            "ad_ids": ad_ids,
+            "spend": spend,
+            "ad_type": ad_type,
+            "note": note,
+            "timestamp": time.time(),
+            "group_name": group_name,
+            "group_id": group_id,
+            "sender": sender,
+            "ad_date": ad_date,
+            "hold": hold,
+            "mess_num": mess_num,
+            "id_bc": id_bc,
+            "confirmed_by": confirmed_by,
+        }
 
     def update_isChange(self, status=True):
         """Cập nhật trạng thái isChange để thông báo có thay đổi dữ liệu"""
@@ -37,24 +67,9 @@ class AdsReportManager:
     def save_ad_report(self, ad_ids, spend, ad_type, note, group_name, group_id, sender, ad_date, hold, mess_num, id_bc, confirmed_by):
         """Lưu dữ liệu vào MongoDB và cập nhật cờ isChange"""
         try:
-            if not ad_date:
-                raise ValueError("❌ Lỗi: `ad_date` không hợp lệ!")
-
-            data = {
-                "ad_ids": ad_ids,
-                "spend": spend,
-                "ad_type": ad_type,
-                "note": note,
-                "timestamp": time.time(),
-                "group_name": group_name,
-                "group_id": group_id,
-                "sender": sender,
-                "ad_date": ad_date,
-                "hold": hold,
-                "mess_num": mess_num,
-                "id_bc": id_bc,
-                "confirmed_by": confirmed_by,
-            }
+            data = self._build_report_doc(
+                ad_ids, spend, ad_type, note, group_name, group_id, sender, ad_date, hold, mess_num, id_bc, confirmed_by
+            )
             
             result = self.ads_report_collection.insert_one(data)
             # self.update_isChange(True)  # Cập nhật trạng thái
@@ -103,6 +118,66 @@ class AdsReportManager:
             logger.error(f"❌ Lỗi khi xóa báo cáo quảng cáo: {e}")
             return "❌ Lỗi khi xóa báo cáo, vui lòng thử lại!"
 
+    # ===== API async (dùng trong handler của bot) =====
+
+    async def update_isChange_async(self, status=True):
+        try:
+            await self.async_status_collection.update_one(
+                {"_id": "sync_status"},
+                {"$set": {"isChange": status}},
+                upsert=True
+            )
+            logger.info(f"🔄 Đã cập nhật trạng thái isChange thành {status}")
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi cập nhật trạng thái isChange: {e}")
+
+    async def save_ad_report_async(self, ad_ids, spend, ad_type, note, group_name, group_id, sender, ad_date, hold, mess_num, id_bc, confirmed_by):
+        try:
+            data = self._build_report_doc(
+                ad_ids, spend, ad_type, note, group_name, group_id, sender, ad_date, hold, mess_num, id_bc, confirmed_by
+            )
+            result = await self.async_ads_report_collection.insert_one(data)
+            logger.info(f"✅ Đã lưu báo cáo quảng cáo ID: {result.inserted_id}")
+            return str(result.inserted_id)
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi lưu báo cáo quảng cáo: {e}")
+            return None
+
+    async def get_all_reports_async(self):
+        try:
+            return await self.async_ads_report_collection.find({}, {"_id": 0}).to_list(None)
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi lấy danh sách báo cáo quảng cáo: {e}")
+            return []
+
+    async def get_report_by_id_async(self, report_id):
+        try:
+            return await self.async_ads_report_collection.find_one({"_id": ObjectId(report_id)}, {"_id": 0})
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi lấy báo cáo theo ID: {e}")
+            return None
+
+    async def search_reports_by_name_async(self, ad_name):
+        try:
+            return await self.async_ads_report_collection.find(
+                {"ad_name": {"$regex": ad_name, "$options": "i"}}, {"_id": 0}
+            ).to_list(None)
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi tìm kiếm báo cáo quảng cáo: {e}")
+            return []
+
+    async def delete_report_async(self, report_id):
+        try:
+            result = await self.async_ads_report_collection.delete_one({"_id": ObjectId(report_id)})
+            if result.deleted_count:
+                logger.info(f"✅ Đã xóa báo cáo quảng cáo có ID: {report_id}")
+                return f"✅ Đã xóa báo cáo quảng cáo với ID `{report_id}`"
+            logger.warning(f"⚠️ Không tìm thấy báo cáo quảng cáo để xóa: {report_id}")
+            return f"❌ Không tìm thấy báo cáo quảng cáo với ID `{report_id}`"
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi xóa báo cáo quảng cáo: {e}")
+            return "❌ Lỗi khi xóa báo cáo, vui lòng thử lại!"
+
 class HoldManager:
     _instance = None  # Singleton
 
@@ -117,6 +192,10 @@ class HoldManager:
         self.collection = mongo_manager.get_collection(collection_name)
         self.collection_name = collection_name
 
+    @property
+    def async_collection(self):
+        return mongo_manager.get_async_collection(self.collection_name)
+
     def save_hold(self, id_bc, ten_tele, hold, nguoi_hanh_dong):
         try:
             data = {
@@ -132,6 +211,22 @@ class HoldManager:
         except Exception as e:
             logger.error(f"❌ Lỗi khi lưu HOLD: {e}")
             return None
+
+    async def save_hold_async(self, id_bc, ten_tele, hold, nguoi_hanh_dong):
+        try:
+            data = {
+                "id_bc": id_bc,
+                "ten_tele": ten_tele,
+                "hold": hold,
+                "nguoi_hanh_dong": nguoi_hanh_dong,
+                "created_at": time.time()
+            }
+            result = await self.async_collection.insert_one(data)
+            logger.info(f"✅ Đã lưu HOLD với ID: {result.inserted_id}")
+            return str(result.inserted_id)
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi lưu HOLD: {e}")
+            return None
         
 class NapTienManager:
     _instance = None  # Singleton
@@ -147,6 +242,10 @@ class NapTienManager:
         self.collection = mongo_manager.get_collection(collection_name)
         self.collection_name = collection_name
 
+    @property
+    def async_collection(self):
+        return mongo_manager.get_async_collection(self.collection_name)
+
     def save_naptien(self, id_bc, ten_tele, so_tien_nap, nguoi_hanh_dong):
         try:
             data = {
@@ -162,6 +261,22 @@ class NapTienManager:
         except Exception as e:
             logger.error(f"❌ Lỗi khi lưu NẠP TIỀN: {e}")
             return None
+
+    async def save_naptien_async(self, id_bc, ten_tele, so_tien_nap, nguoi_hanh_dong):
+        try:
+            data = {
+                "id_bc": id_bc,
+                "ten_tele": ten_tele,
+                "so_tien_nap": so_tien_nap,
+                "nguoi_hanh_dong": nguoi_hanh_dong,
+                "created_at": time.time()
+            }
+            result = await self.async_collection.insert_one(data)
+            logger.info(f"✅ Đã lưu NẠP TIỀN với ID: {result.inserted_id}")
+            return str(result.inserted_id)
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi lưu NẠP TIỀN: {e}")
+            return None
         
 
 ads_reports_manager = AdsReportManager()
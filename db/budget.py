@@ -1,20 +1,32 @@
 import config 
+import hashlib
 import logging
+import uuid
 import time
 import pytz
 from bson import ObjectId
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError
 from db.initdb import mongo_manager
 from ws_client import ws_client
 import re
 from datetime import datetime, timezone, timedelta
 import calendar
-from db.rooms import RoomManager
+from db.rooms import room_manager
+from db.reference_cache import reference_cache
+from db.contract_codes import contract_normalizer
 
-room_manager = RoomManager()
+VN_TZ = pytz.timezone("Asia/Ho_Chi_Minh")
 
 # Cấu hình logging
 logger = logging.getLogger(__name__)
 
+# Kết quả của add_budgets_bulk(_async)
+BULK_SAVED = "saved"        # đã ghi đủ (kể cả các mã đã ghi ở lần bấm trước)
+BULK_PARTIAL = "partial"    # ghi được một phần, bấm lại sẽ ghi tiếp phần còn thiếu
+BULK_FAILED = "failed"      # chưa ghi được gì
+BULK_UNKNOWN = "unknown"    # lỗi mạng giữa chừng, không biết server đã ghi hay chưa
+
 class QuanLyABCVIP:
     _instance = None
 
@@ -25,9 +37,367 @@ class QuanLyABCVIP:
         return cls._instance
 
     def _init_db(self):
-        """Khởi tạo kết nối với collection 'budget' và 'budget_threshold' từ MongoDBManager."""
+        """
+        Khởi tạo kết nối với collection 'budget' từ MongoDBManager.
+        'budget_limits' và 'ignored_contracts' được đọc qua `reference_cache`.
+        """
         self.budget_collection = mongo_manager.get_collection(config.BUDGET)
-        self.threshold_collection = mongo_manager.get_collection(config.BUDGET_THRESHOLD)
+        self.rollup_collection = mongo_manager.get_collection(config.BUDGET_ROLLUP)
+        self._rollup_suspects = {}  # khóa tổng hợp -> độ lệch thấy ở lần đối chiếu trước
+
+    @property
+    def async_budget_collection(self):
+        return mongo_manager.get_async_collection(config.BUDGET)
+
+    @property
+    def async_rollup_collection(self):
+        return mongo_manager.get_async_collection(config.BUDGET_ROLLUP)
+
+    @staticmethod
+    def _send_ws(record):
+        """Gửi bản ghi budget qua WebSocket (nếu client khả dụng)."""
+        record["key"] = "budget"
+        if ws_client and hasattr(ws_client, 'send_data'):
+            ws_client.send_data(record)
+        else:
+            logger.warning("⚠️ WebSocket client is not available. Data was not sent.")
+
+    @staticmethod
+    def _build_budget_doc(budget_id, team, contract_code, original_contract_code, group_name,
+                          amount, status, timestamp, assistant, note, end_time, area_name):
+        return {
+            "budget_id": budget_id,
+            "team": team.upper(),
+            "contract_code": contract_code,
+            "original_contract_code": original_contract_code,
+            "group_name": group_name,
+            "amount": amount,
+            "status": status,
+            "timestamp": timestamp if timestamp else time.time(),  # Dùng timestamp hiện tại nếu không có truyền vào
+            "assistant": assistant,
+            "note": note,
+            "end_time": end_time if end_time is not None else 0,  # 👈 xử lý end_time
+            "area": area_name  # Chỉ lưu bản ghi với area hiện tại
+        }
+
+    @staticmethod
+    def _send_ws_batch(records):
+        """Gửi nhiều bản ghi budget, mỗi bản ghi một sự kiện "budget" như giao thức WebSocket hiện có."""
+        for record in records:
+            QuanLyABCVIP._send_ws(record)
+
+    # ===== Bảng tổng hợp ngân sách theo tháng (area, team, contract_code, month) =====
+
+    @staticmethod
+    def _month_key(timestamp):
+        """Tháng (theo giờ VN) của một timestamp, dạng 'YYYY-MM'."""
+        if not timestamp:
+            return None
+        return datetime.fromtimestamp(timestamp, tz=VN_TZ).strftime("%Y-%m")
+
+    @staticmethod
+    def _rollup_key(record):
+        return (
+            record.get("area"),
+            record.get("team"),
+            record.get("contract_code"),
+            QuanLyABCVIP._month_key(record.get("timestamp")),
+        )
+
+    @staticmethod
+    def _add_delta(deltas, record, amount):
+        key = QuanLyABCVIP._rollup_key(record)
+        deltas[key] = deltas.get(key, 0) + amount
+
+    @staticmethod
+    def _rollup_change(before, after):
+        """Chênh lệch tổng hợp khi một bản ghi đổi từ `before` sang `after` (số tiền hoặc khóa)."""
+        deltas = {}
+        QuanLyABCVIP._add_delta(deltas, before, -int(before.get("amount") or 0))
+        QuanLyABCVIP._add_delta(deltas, after, int(after.get("amount") or 0))
+        return {key: delta for key, delta in deltas.items() if delta}
+
+    @staticmethod
+    def _rollup_ops(deltas):
+        """Tạo các lệnh `$inc` (upsert) cho bảng tổng hợp từ dict khóa -> số tiền chênh lệch."""
+        ops = []
+        now = time.time()
+        for (area, team, contract_code, month), delta in deltas.items():
+            if month is None:
+                continue
+            ops.append(UpdateOne(
+                {"area": area, "team": team, "contract_code": contract_code, "month": month},
+                {"$inc": {"total_amount": delta}, "$set": {"updated_at": now}},
+                upsert=True
+            ))
+        return ops
+
+    def _apply_rollup(self, deltas):
+        ops = self._rollup_ops(deltas)
+        if not ops:
+            return
+        try:
+            self.rollup_collection.bulk_write(ops, ordered=False)
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi cập nhật bảng tổng hợp ngân sách (cần chạy rebuild): {e}")
+
+    async def _apply_rollup_async(self, deltas):
+        ops = self._rollup_ops(deltas)
+        if not ops:
+            return
+        try:
+            await self.async_rollup_collection.bulk_write(ops, ordered=False)
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi cập nhật bảng tổng hợp ngân sách (cần chạy rebuild): {e}")
+
+    @staticmethod
+    def _rollup_group_stages(since=None):
+        """Tổng số tiền theo (area, team, contract_code, month) tính từ dữ liệu gốc (từ `since` nếu có)."""
+        match = {"$type": "number"}
+        if since is not None:
+            match["$gte"] = since
+        return [
+            {"$match": {"timestamp": match}},
+            {"$group": {
+                "_id": {
+                    "area": "$area",
+                    "team": "$team",
+                    "contract_code": "$contract_code",
+                    "month": {"$dateToString": {
+                        "format": "%Y-%m",
+                        "timezone": "Asia/Ho_Chi_Minh",
+                        "date": {"$toDate": {"$multiply": [{"$toDouble": "$timestamp"}, 1000]}},
+                    }},
+                },
+                "total_amount": {"$sum": "$amount"},
+            }},
+        ]
+
+    @staticmethod
+    def _rollup_rebuild_pipeline():
+        """Tính lại bảng tổng hợp từ dữ liệu gốc và ghi đè collection tổng hợp bằng `$out`."""
+        return QuanLyABCVIP._rollup_group_stages() + [
+            {"$project": {
+                "_id": 0,
+                "area": "$_id.area",
+                "team": "$_id.team",
+                "contract_code": "$_id.contract_code",
+                "month": "$_id.month",
+                "total_amount": 1,
+                "updated_at": {"$literal": time.time()},
+            }},
+            {"$out": config.BUDGET_ROLLUP},
+        ]
+
+    def rebuild_rollup(self):
+        """
+        Tính lại toàn bộ bảng tổng hợp từ dữ liệu gốc `ngan_sach` (lệnh /rebuildrollup — cách sửa khi tổng bị lệch).
+        Nên chạy khi ít giao dịch: các lần cộng `$inc` chạy trong lúc `$out` ghi đè sẽ mất,
+        phần lệch đó (trong tháng trước / tháng này) được `reconcile_rollup` định kỳ sửa lại.
+        :return: số dòng tổng hợp sau khi rebuild, hoặc None nếu lỗi
+        """
+        try:
+            self._rollup_suspects = {}
+            self.budget_collection.aggregate(self._rollup_rebuild_pipeline(), allowDiskUse=True)
+            count = self.rollup_collection.count_documents({})
+            logger.info(f"✅ Đã rebuild bảng tổng hợp ngân sách: {count} dòng.")
+            return count
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi rebuild bảng tổng hợp ngân sách: {e}")
+            return None
+
+    async def rebuild_rollup_async(self):
+        try:
+            self._rollup_suspects = {}
+            await self.async_budget_collection.aggregate(self._rollup_rebuild_pipeline(), allowDiskUse=True)
+            count = await self.async_rollup_collection.count_documents({})
+            logger.info(f"✅ Đã rebuild bảng tổng hợp ngân sách: {count} dòng.")
+            return count
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi rebuild bảng tổng hợp ngân sách: {e}")
+            return None
+
+    def ensure_rollup(self):
+        """
+        Gọi lúc khởi động (trước khi nhận update):
+        - Bảng tổng hợp còn trống nhưng đã có dữ liệu gốc → rebuild toàn bộ.
+        - Ngược lại → đối chiếu và sửa ngay phần lệch của các tháng gần đây (vd bot dừng giữa lúc
+          ghi dữ liệu gốc và cộng vào bảng tổng hợp).
+        """
+        try:
+            if self.rollup_collection.estimated_document_count() == 0:
+                if self.budget_collection.estimated_document_count() > 0:
+                    logger.info("🔄 Bảng tổng hợp ngân sách đang trống, tiến hành rebuild...")
+                    self.rebuild_rollup()
+                return
+            self.reconcile_rollup(require_repeat=False)
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi kiểm tra bảng tổng hợp ngân sách: {e}")
+
+    @staticmethod
+    def _reconcile_since():
+        """Timestamp đầu tháng trước (giờ VN) và tháng đó dạng 'YYYY-MM': phạm vi đối chiếu bảng tổng hợp."""
+        first_of_month = datetime.now(VN_TZ).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        previous = (first_of_month - timedelta(days=1)).replace(day=1)
+        return int(previous.timestamp()), previous.strftime("%Y-%m")
+
+    @staticmethod
+    def _rollup_drift(raw_rows, rollup_rows):
+        """:return: dict khóa tổng hợp -> (giá trị trong bảng tổng hợp hoặc None, giá trị đúng) với các dòng bị lệch"""
+        expected = {}
+        for row in raw_rows:
+            group = row["_id"]
+            key = (group.get("area"), group.get("team"), group.get("contract_code"), group.get("month"))
+            expected[key] = row["total_amount"]
+        current = {
+            (row.get("area"), row.get("team"), row.get("contract_code"), row.get("month")): row.get("total_amount")
+            for row in rollup_rows
+        }
+        drift = {}
+        for key in expected.keys() | current.keys():
+            have, want = current.get(key), expected.get(key, 0)
+            if (have or 0) != want:
+                drift[key] = (have, want)
+        return drift
+
+    def _reconcile_ops(self, drift, require_repeat):
+        """
+        Lệnh sửa bảng tổng hợp cho các dòng lệch. Khi `require_repeat`, chỉ sửa dòng có cùng độ lệch với lần
+        đối chiếu trước (lệch tạm thời do giao dịch đang ghi dở sẽ tự hết ở lần sau).
+        Lệnh sửa có điều kiện `total_amount` chưa đổi, nên không đè lần cộng mới chạy xen vào.
+        """
+        previous = self._rollup_suspects
+        confirmed = {}
+        suspects = {}
+        for key, (have, want) in drift.items():
+            diff = want - (have or 0)
+            if not require_repeat or previous.get(key) == diff:
+                confirmed[key] = (have, want)
+            else:
+                suspects[key] = diff
+        self._rollup_suspects = suspects
+
+        ops = []
+        now = time.time()
+        for (area, team, contract_code, month), (have, want) in confirmed.items():
+            query = {"area": area, "team": team, "contract_code": contract_code, "month": month}
+            if have is None:
+                ops.append(UpdateOne(query, {"$setOnInsert": {"total_amount": want, "updated_at": now}}, upsert=True))
+            else:
+                ops.append(UpdateOne(
+                    {**query, "total_amount": have},
+                    {"$inc": {"total_amount": want - have}, "$set": {"updated_at": now}}
+                ))
+        return ops
+
+    def _log_reconcile(self, drift, ops):
+        if ops:
+            logger.warning(f"⚠️ Bảng tổng hợp ngân sách lệch {len(drift)} dòng, đã sửa {len(ops)} dòng.")
+        elif drift:
+            logger.info(f"🔎 Bảng tổng hợp ngân sách lệch {len(drift)} dòng, chờ lần đối chiếu sau để xác nhận.")
+        return len(drift), len(ops)
+
+    def reconcile_rollup(self, require_repeat=True):
+        """
+        Đối chiếu bảng tổng hợp (từ tháng trước trở đi) với dữ liệu gốc và sửa phần lệch.
+        `$inc` vào bảng tổng hợp là lệnh riêng sau khi ghi dữ liệu gốc, nên có thể lệch khi bot dừng giữa hai lệnh,
+        khi cập nhật bảng tổng hợp lỗi, hoặc khi /rebuildrollup chạy lúc đang có giao dịch.
+        :param require_repeat: True khi đang có giao dịch (job định kỳ), False lúc khởi động
+        :return: (số dòng lệch, số dòng đã sửa), hoặc None nếu lỗi
+        """
+        try:
+            since, month = self._reconcile_since()
+            rollup_rows = list(self.rollup_collection.find({"month": {"$gte": month}}, {"_id": 0}))
+            raw_rows = list(self.budget_collection.aggregate(self._rollup_group_stages(since), allowDiskUse=True))
+            drift = self._rollup_drift(raw_rows, rollup_rows)
+            ops = self._reconcile_ops(drift, require_repeat)
+            if ops:
+                self.rollup_collection.bulk_write(ops, ordered=False)
+            return self._log_reconcile(drift, ops)
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi đối chiếu bảng tổng hợp ngân sách: {e}")
+            return None
+
+    async def reconcile_rollup_async(self, require_repeat=True):
+        try:
+            since, month = self._reconcile_since()
+            rollup_rows = await self.async_rollup_collection.find({"month": {"$gte": month}}, {"_id": 0}).to_list(None)
+            cursor = await self.async_budget_collection.aggregate(self._rollup_group_stages(since), allowDiskUse=True)
+            raw_rows = await cursor.to_list(None)
+            drift = self._rollup_drift(raw_rows, rollup_rows)
+            ops = self._reconcile_ops(drift, require_repeat)
+            if ops:
+                await self.async_rollup_collection.bulk_write(ops, ordered=False)
+            return self._log_reconcile(drift, ops)
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi đối chiếu bảng tổng hợp ngân sách: {e}")
+            return None
+
+    def _build_bulk_docs(self, budget_id, team, allocations, group_name, status, timestamp, assistant, note, end_time, area_name):
+        """
+        Tạo danh sách bản ghi từ `allocations`.
+        Mỗi phần tử là dict gồm `contract_code`, `original_contract_code`, `amount`.
+        """
+        ts = timestamp if timestamp else time.time()
+        docs = []
+        for index, allocation in enumerate(allocations):
+            doc = self._build_budget_doc(
+                budget_id, team,
+                allocation["contract_code"],
+                allocation.get("original_contract_code", allocation["contract_code"]),
+                group_name, int(allocation["amount"]), status, ts, assistant, note, end_time, area_name
+            )
+            # `_id` cố định theo (budget_id, vị trí, mã) → bấm YES lại không ghi trùng
+            doc["_id"] = self._allocation_id(budget_id, index, allocation["contract_code"])
+            docs.append(doc)
+        return docs
+
+    @staticmethod
+    def _allocation_id(budget_id, index, contract_code):
+        digest = hashlib.sha1(f"{budget_id}|{index}|{contract_code}".encode("utf-8")).digest()
+        return ObjectId(digest[:12])
+
+    @staticmethod
+    def _bulk_insert_outcome(docs, error=None):
+        """
+        Phân loại kết quả `insert_many(ordered=False)`.
+        :return: (trạng thái BULK_*, bản ghi vừa ghi ở lần này, `_id` của mọi bản ghi đã có trong DB)
+        """
+        if error is None:
+            return BULK_SAVED, docs, [doc["_id"] for doc in docs]
+        write_errors = error.details.get("writeErrors", [])
+        # 11000: trùng `_id` → bản ghi đã được ghi ở lần bấm trước
+        duplicate = {item["index"] for item in write_errors if item.get("code") == 11000}
+        failed = {item["index"] for item in write_errors} - duplicate
+        new_docs = [doc for index, doc in enumerate(docs) if index not in duplicate and index not in failed]
+        written_ids = [doc["_id"] for index, doc in enumerate(docs) if index not in failed]
+        if not failed:
+            status = BULK_SAVED
+        elif written_ids:
+            status = BULK_PARTIAL
+        else:
+            status = BULK_FAILED
+        return status, new_docs, written_ids
+
+    def _after_bulk_insert(self, budget_id, team, status, new_docs, written_ids):
+        """Gửi WebSocket cho các bản ghi mới; lỗi ở bước này không làm hỏng kết quả đã ghi."""
+        try:
+            if new_docs:
+                self._send_ws_batch([{**doc, "_id": str(doc["_id"])} for doc in new_docs])
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi gửi WebSocket ngân sách {budget_id}: {e}")
+        if status == BULK_SAVED:
+            logger.info(f"✅ Successfully added {len(written_ids)} budgets: {budget_id} - {team.upper()}")
+        else:
+            logger.error(f"❌ Ghi ngân sách {budget_id} chưa đủ ({status}): đã có {len(written_ids)} bản ghi")
+        return {"status": status, "inserted_ids": written_ids}
+
+    @staticmethod
+    def _bulk_deltas(docs):
+        deltas = {}
+        for doc in docs:
+            QuanLyABCVIP._add_delta(deltas, doc, doc["amount"])
+        return deltas
 
     def add_budget(
         self,
@@ -52,42 +422,19 @@ class QuanLyABCVIP:
                 logger.error(f"Invalid amount value: {amount}")
                 return None
             
-            # Dùng timestamp hiện tại nếu không có truyền vào
-            ts = timestamp if timestamp else time.time()
-
             # 🔍 Lấy thông tin phòng để xác định khu vực
-            room_info = room_manager.get_room_by_id(chat_id)
-            if not room_info:
-                logger.warning(f"⚠️ Không tìm thấy phòng với ID {chat_id}. Không thể xác định khu vực.")
-                area_name = "unknown"
-            else:
-                area_name = room_info.get("area", "unknown")
+            area_name = room_manager.get_area_by_room_id(chat_id)
 
-            budget_data = {
-                "budget_id": budget_id,
-                "team": team.upper(),
-                "contract_code": contract_code,
-                "original_contract_code": original_contract_code,
-                "group_name": group_name,
-                "amount": amount,
-                "status": status,
-                "timestamp": ts,
-                "assistant": assistant,
-                "note": note,
-                "end_time": end_time if end_time is not None else 0,  # 👈 xử lý end_time
-                "area": area_name  # Chỉ lưu bản ghi với area hiện tại
-            }
+            budget_data = self._build_budget_doc(
+                budget_id, team, contract_code, original_contract_code, group_name,
+                amount, status, timestamp, assistant, note, end_time, area_name
+            )
 
             # Thêm dữ liệu vào MongoDB và lấy `_id`
             inserted = self.budget_collection.insert_one(budget_data)
+            self._apply_rollup({self._rollup_key(budget_data): amount})
             budget_data["_id"] = str(inserted.inserted_id)  # Chuyển `_id` thành chuỗi để tránh lỗi JSON
-            budget_data["key"] = "budget"
-
-            # Kiểm tra WebSocket trước khi gửi dữ liệu
-            if ws_client and hasattr(ws_client, 'send_data'):
-                ws_client.send_data(budget_data)
-            else:
-                logger.warning("WebSocket client is not available. Data was not sent.")
+            self._send_ws(budget_data)
 
             logger.info(
                 f"✅ Successfully added new budget: {budget_id} - {team.upper()} - {amount}"
@@ -98,67 +445,155 @@ class QuanLyABCVIP:
             logger.error(f"❌ Error adding budget: {e}")
             return None
 
-        
-    def update_budget_status(self, budget_id):
+    def add_budgets_bulk(self, budget_id, team, allocations, group_name, chat_id, status,
+                         timestamp=None, assistant=None, note=None, end_time=None):
         """
-        Cập nhật trạng thái của tất cả bản ghi có `budget_id` trong cùng `area` từ "pending" thành "done".
-        - Nếu timestamp > thời gian hiện tại → dùng timestamp làm end_time.
-        - Ngược lại → dùng thời gian hiện tại (múi giờ VN).
+        Ghi nhiều mã hợp đồng của cùng một ngân sách bằng một lần `insert_many`.
+        Khu vực được xác định một lần cho cả lô; mỗi bản ghi mới được gửi qua WebSocket như `add_budget`.
+        `_id` cố định theo mã nên gọi lại sau khi ghi dở chỉ ghi phần còn thiếu.
+        :return: dict `status` (BULK_SAVED / BULK_PARTIAL / BULK_FAILED / BULK_UNKNOWN) và
+                 `inserted_ids` (các `_id` đã có trong DB)
         """
         try:
-            query = {
-                "budget_id": budget_id,
-                "status": "pending"
-            }
+            if not allocations:
+                return {"status": BULK_FAILED, "inserted_ids": []}
+            area_name = room_manager.get_area_by_room_id(chat_id)
+            docs = self._build_bulk_docs(budget_id, team, allocations, group_name, status,
+                                         timestamp, assistant, note, end_time, area_name)
+        except Exception as e:
+            logger.error(f"❌ Error adding budgets in bulk: {e}")
+            return {"status": BULK_FAILED, "inserted_ids": []}
 
-            pending_records = list(self.budget_collection.find(query))
+        try:
+            self.budget_collection.insert_many(docs, ordered=False)
+            outcome = self._bulk_insert_outcome(docs)
+        except BulkWriteError as e:
+            outcome = self._bulk_insert_outcome(docs, e)
+        except Exception as e:
+            logger.error(f"❌ Không rõ ngân sách {budget_id} đã được ghi hay chưa: {e}")
+            return {"status": BULK_UNKNOWN, "inserted_ids": []}
 
-            if not pending_records:
-                logger.warning(f"⚠️ Không có bản ghi nào cần cập nhật với budget_id: {budget_id}")
-                return 0
-
-            updated_count = 0
-            now_vn = datetime.now(timezone(timedelta(hours=7)))
-            now_ts = int(now_vn.timestamp())
-
-            for record in pending_records:
-                ts = record.get("timestamp")
-                if not ts:
-                    continue
-
-                # 🟢 Nếu thời gian hiện tại nhỏ hơn timestamp → lấy timestamp
-                if now_ts < ts:
-                    end_time = ts
-                else:
-                    end_time = now_ts
-
-                # 🟢 Cập nhật bản ghi
-                result = self.budget_collection.update_one(
-                    {"_id": record["_id"]},
-                    {"$set": {"status": "done", "end_time": end_time}}
-                )
+        status, new_docs, written_ids = outcome
+        self._apply_rollup(self._bulk_deltas(new_docs))
+        return self._after_bulk_insert(budget_id, team, status, new_docs, written_ids)
+
+    @staticmethod
+    def _done_transition_ops(pending_records, amount=None):
+        """
+        Tạo các thao tác cho một lần `bulk_write`, mỗi bản ghi một lệnh có điều kiện:
+        - Chỉ cập nhật nếu bản ghi vẫn `pending` (và số tiền chưa đổi so với lúc đọc khi có `amount`),
+          nên hai lệnh /done chạy đồng thời không cùng ghi đè số tiền / cộng trùng bảng tổng hợp.
+        - Nếu có `amount` → cập nhật số tiền.
+        - Chuyển `pending` → `done`, end_time = max(timestamp, thời gian hiện tại theo giờ VN).
+        - Đánh dấu tạm `done_op` để biết bản ghi nào do chính lần gọi này cập nhật
+          (xóa ngay sau khi đọc lại, xem `_clear_done_marker`).
+        """
+        ids = [record["_id"] for record in pending_records]
+        op_id = uuid.uuid4().hex
+        now_ts = int(datetime.now(timezone(timedelta(hours=7))).timestamp())
 
-                if result.modified_count > 0:
-                    updated_count += 1
+        ops = []
+        for record in pending_records:
+            query = {"_id": record["_id"], "status": "pending"}
+            changes = {"done_op": op_id}
+            if amount is not None:
+                query["amount"] = record.get("amount")
+                changes["amount"] = int(amount)
+            # Bản ghi không có timestamp thì không chốt như trước đây
+            if record.get("timestamp"):
+                changes["status"] = "done"
+                changes["end_time"] = {"$max": ["$timestamp", now_ts]}
+            elif amount is None:
+                continue
+            ops.append(UpdateOne(query, [{"$set": changes}]))
+        return ids, op_id, ops
 
-                    # 🟢 Gửi qua WebSocket
-                    updated_record = self.budget_collection.find_one(
-                        {"_id": record["_id"]},
-                        {"_id": 0}
-                    )
-                    if updated_record:
-                        updated_record["key"] = "budget"
-                        if ws_client and hasattr(ws_client, 'send_data'):
-                            ws_client.send_data(updated_record)
-                        else:
-                            logger.warning("⚠️ WebSocket client is not available. Data was not sent.")
+    @staticmethod
+    def _done_transition_deltas(pending_records, applied_records, amount=None):
+        """Chênh lệch tổng hợp khi `/done` ghi đè số tiền, chỉ tính các bản ghi lần gọi này thực sự cập nhật."""
+        deltas = {}
+        if amount is None:
+            return deltas
+        before = {record["_id"]: record for record in pending_records}
+        for record in applied_records:
+            previous = before[record["_id"]]
+            QuanLyABCVIP._add_delta(deltas, previous, int(amount) - int(previous.get("amount") or 0))
+        return {key: delta for key, delta in deltas.items() if delta}
+
+    @staticmethod
+    def _applied_records(updated_records, op_id):
+        """Các bản ghi do lần gọi này cập nhật (bỏ trường đánh dấu tạm `done_op`)."""
+        return [
+            {k: v for k, v in record.items() if k != "done_op"}
+            for record in updated_records if record.get("done_op") == op_id
+        ]
 
-            logger.info(f"✅ Đã cập nhật {updated_count} bản ghi từ 'pending' thành 'done' với budget_id: {budget_id}")
-            return updated_count
+    def _clear_done_marker(self, ids, op_id):
+        """Xóa `done_op` khỏi dữ liệu gốc; sót lại (khi lỗi) cũng không ảnh hưởng lần /done sau."""
+        try:
+            self.budget_collection.update_many({"_id": {"$in": ids}, "done_op": op_id}, {"$unset": {"done_op": ""}})
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi xóa đánh dấu done_op {op_id}: {e}")
 
+    async def _clear_done_marker_async(self, ids, op_id):
+        try:
+            await self.async_budget_collection.update_many(
+                {"_id": {"$in": ids}, "done_op": op_id}, {"$unset": {"done_op": ""}}
+            )
         except Exception as e:
-            logger.error(f"❌ Lỗi khi cập nhật trạng thái budget: {e}")
-            return 0
+            logger.error(f"❌ Lỗi khi xóa đánh dấu done_op {op_id}: {e}")
+
+    def _finish_done_transition(self, budget_id, pending_records, result, applied_records):
+        done_count = sum(1 for record in applied_records if record.get("status") == "done")
+        ws_records = [{k: v for k, v in record.items() if k != "_id"} for record in applied_records]
+        if ws_records:
+            self._send_ws_batch(ws_records)
+
+        logger.info(f"✅ Đã cập nhật {done_count} bản ghi từ 'pending' thành 'done' với budget_id: {budget_id}")
+        return {
+            "pending": pending_records,
+            "records": applied_records,
+            "matched": result.matched_count if result else 0,
+            "modified": result.modified_count if result else 0,
+            "done": done_count,
+        }
+
+    def complete_budgets(self, budget_id, amount=None):
+        """
+        Chốt (`/done`) toàn bộ bản ghi `pending` của `budget_id` bằng một lần `bulk_write`.
+        :param amount: nếu có → ghi đè số tiền của các bản ghi trước khi chốt
+        :return: dict gồm `pending` (bản ghi trước khi cập nhật), `records` (các bản ghi do lần gọi này cập nhật),
+                 `matched`, `modified`, `done`
+        """
+        try:
+            pending_records = list(self.budget_collection.find({"budget_id": budget_id, "status": "pending"}))
+            if not pending_records:
+                logger.warning(f"⚠️ Không có bản ghi nào cần cập nhật với budget_id: {budget_id}")
+                return self._finish_done_transition(budget_id, [], None, [])
+
+            ids, op_id, ops = self._done_transition_ops(pending_records, amount)
+            result = self.budget_collection.bulk_write(ops, ordered=False) if ops else None
+            try:
+                updated_records = list(self.budget_collection.find({"_id": {"$in": ids}}))
+            finally:
+                if ops:
+                    self._clear_done_marker(ids, op_id)
+            applied_records = self._applied_records(updated_records, op_id)
+            self._apply_rollup(self._done_transition_deltas(pending_records, applied_records, amount))
+            return self._finish_done_transition(budget_id, pending_records, result, applied_records)
+
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi chốt budget {budget_id}: {e}")
+            return None
+
+    def update_budget_status(self, budget_id):
+        """
+        Cập nhật trạng thái của tất cả bản ghi có `budget_id` trong cùng `area` từ "pending" thành "done".
+        - Nếu timestamp > thời gian hiện tại → dùng timestamp làm end_time.
+        - Ngược lại → dùng thời gian hiện tại (múi giờ VN).
+        """
+        result = self.complete_budgets(budget_id)
+        return result["done"] if result else 0
 
         
     def get_pending_budgets_by_id(self, budget_id):
@@ -183,165 +618,194 @@ class QuanLyABCVIP:
             return []
        
         
+    @staticmethod
+    def _validate_update(record_id, new_data):
+        """Kiểm tra dữ liệu cập nhật, trả về (ObjectId, new_data) hoặc None nếu không hợp lệ."""
+        if not isinstance(new_data, dict):
+            logger.error("❌ Dữ liệu cập nhật không hợp lệ, cần là dictionary.")
+            return None
+
+        if "amount" in new_data:
+            try:
+                new_data["amount"] = int(new_data["amount"])
+            except ValueError:
+                logger.error(f"❌ 'amount' không hợp lệ: {new_data['amount']}")
+                return None
+
+        # Kiểm tra nếu record_id chưa phải ObjectId thì convert
+        if not isinstance(record_id, ObjectId):
+            try:
+                record_id = ObjectId(record_id)
+            except Exception as e:
+                logger.error(f"❌ record_id không phải ObjectId hợp lệ: {record_id} - {e}")
+                return None
+        return record_id, new_data
+
     def update_budget(self, record_id, new_data):
         try:
-            if not isinstance(new_data, dict):
-                logger.error("❌ Dữ liệu cập nhật không hợp lệ, cần là dictionary.")
+            validated = self._validate_update(record_id, new_data)
+            if not validated:
                 return False
+            record_id, new_data = validated
     
-            if "amount" in new_data:
-                try:
-                    new_data["amount"] = int(new_data["amount"])
-                except ValueError:
-                    logger.error(f"❌ 'amount' không hợp lệ: {new_data['amount']}")
-                    return False
-    
-            # Kiểm tra nếu record_id chưa phải ObjectId thì convert
-            if not isinstance(record_id, ObjectId):
-                try:
-                    record_id = ObjectId(record_id)
-                except Exception as e:
-                    logger.error(f"❌ record_id không phải ObjectId hợp lệ: {record_id} - {e}")
-                    return False
-    
-            # Cập nhật trong MongoDB
-            result = self.budget_collection.update_one(
+            # Cập nhật trong MongoDB (lấy bản ghi trước khi sửa để cập nhật bảng tổng hợp)
+            before = self.budget_collection.find_one_and_update(
                 {"_id": record_id},
-                {"$set": new_data}
+                {"$set": new_data},
+                return_document=ReturnDocument.BEFORE
             )
-    
-            if result.modified_count:
-                updated_data = self.budget_collection.find_one(
-                    {"_id": record_id},
-                    {"_id": 0}
-                )
-    
-                if updated_data and ws_client and hasattr(ws_client, 'send_data'):
-                    updated_data["key"] = "budget"
-                    ws_client.send_data(updated_data)
-                else:
-                    logger.warning("⚠️ WebSocket không khả dụng, không gửi được dữ liệu.")
-    
-                logger.info(f"✅ Đã cập nhật bản ghi {record_id} thành công")
-                return True
-            else:
-                logger.warning(f"⚠️ Không tìm thấy bản ghi {record_id} hoặc không có thay đổi.")
+            after = self._merge_update(record_id, before, new_data)
+            if after is None:
                 return False
+
+            self._apply_rollup(self._rollup_change(before, after))
+            self._send_ws({k: v for k, v in after.items() if k != "_id"})
+            logger.info(f"✅ Đã cập nhật bản ghi {record_id} thành công")
+            return True
     
         except Exception as e:
             logger.error(f"❌ Lỗi khi cập nhật budget: {e}")
             return False
+
+    @staticmethod
+    def _merge_update(record_id, before, new_data):
+        """Bản ghi sau khi cập nhật, hoặc None nếu không tìm thấy / không có thay đổi."""
+        after = {**before, **new_data} if before else None
+        if not before or after == before:
+            logger.warning(f"⚠️ Không tìm thấy bản ghi {record_id} hoặc không có thay đổi.")
+            return None
+        return after
         
     @staticmethod
     def convert_to_contract_code(hd_code: str) -> str:
         """
-        Chuẩn hóa mã hợp đồng:
-        - Nếu mã KHÔNG nằm trong danh sách ignored_contracts → bỏ 1 ký tự cuối.
+        Chuẩn hóa mã hợp đồng (xem `ContractCodeNormalizer`):
+        - Nếu mã KHÔNG nằm trong danh sách ignored_contracts → cắt còn 5 ký tự.
         - Nếu mã có trong danh sách → giữ nguyên.
         """
         try:
-            if not hd_code:
-                return ""
+            return contract_normalizer.normalize(hd_code)
+        except Exception as e:
+            logging.error(f"❌ Lỗi trong convert_to_contract_code({hd_code}): {e}")
+            return hd_code
+    
+    @staticmethod
+    def _month_window(current_timestamp=None):
+        """
+        Khoảng timestamp (UTC) của tháng cần tính ngân sách theo giờ Việt Nam.
+        Nếu hôm nay là ngày cuối tháng (theo giờ Việt Nam), thì lấy tháng sau.
+        """
+        # 🇻🇳 Giờ Việt Nam
+        vn_tz = pytz.timezone("Asia/Ho_Chi_Minh")
+        if current_timestamp:
+            # Nếu timestamp truyền vào → convert sang datetime theo VN timezone
+            now_vn = datetime.fromtimestamp(current_timestamp, tz=pytz.utc).astimezone(vn_tz)
+        else:
+            # Mặc định lấy thời điểm hiện tại
+            now_vn = datetime.now(vn_tz)
 
-            hd_code = hd_code.strip().upper()
+        # 🟢 Kiểm tra nếu hôm nay là ngày cuối tháng (theo giờ VN)
+        last_day = calendar.monthrange(now_vn.year, now_vn.month)[1]
+        if now_vn.day == last_day:
+            # 👉 Chuyển sang tháng sau
+            if now_vn.month == 12:
+                next_month = datetime(now_vn.year + 1, 1, 1, tzinfo=vn_tz)
+            else:
+                next_month = datetime(now_vn.year, now_vn.month + 1, 1, tzinfo=vn_tz)
+            first_day_of_month_vn = next_month
+        else:
+            first_day_of_month_vn = datetime(now_vn.year, now_vn.month, 1, tzinfo=vn_tz)
 
-            # 🟢 Lấy danh sách mã bị bỏ qua từ DB
-            ignored_codes = QuanLyABCVIP().get_ignored_contracts_by_key("ABCVIP") or []
-            ignored_codes = [c.strip().upper() for c in ignored_codes]
+        # 🟢 Ngày cuối tháng theo giờ VN
+        year = first_day_of_month_vn.year
+        month = first_day_of_month_vn.month
+        last_day_of_target_month = calendar.monthrange(year, month)[1]
+        last_day_of_month_vn = datetime(year, month, last_day_of_target_month, 23, 59, 59, tzinfo=vn_tz)
 
-            # 🔍 Nếu mã không nằm trong danh sách bỏ qua → bỏ ký tự cuối
-            if hd_code not in ignored_codes:
-                new_code = hd_code[:5]
-                return new_code
+        # 👉 Chuyển sang UTC để truy vấn theo timestamp (Mongo lưu UTC)
+        timestamp_start = int(first_day_of_month_vn.astimezone(pytz.utc).timestamp())
+        timestamp_end = int(last_day_of_month_vn.astimezone(pytz.utc).timestamp())
+        return timestamp_start, timestamp_end
 
-            # ✅ Nếu mã nằm trong danh sách bỏ qua → giữ nguyên
-            return hd_code
+    @staticmethod
+    def _current_budget_pipeline(contract_codes, team, area_name, original_contract_code, timestamp_start, timestamp_end):
+        if original_contract_code:
+            query = {
+                "$or": [
+                    {"contract_code": {"$in": contract_codes}},
+                    {"original_contract_code": {"$in": [original_contract_code]}}
+                ],
+                "area": area_name,
+                "team": team,
+                "timestamp": {"$gte": timestamp_start, "$lte": timestamp_end}
+            }
+        else:
+            query = {
+                "contract_code": {"$in": contract_codes},
+                "area": area_name,
+                "team": team,
+                "timestamp": {"$gte": timestamp_start, "$lte": timestamp_end}
+            }
+
+        return [
+            {"$match": query},
+            {"$group": {
+                "_id": "$contract_code",
+                "total_amount": {"$sum": "$amount"}
+            }}
+        ]
+
+    @staticmethod
+    def _rollup_query(contract_codes, team, area_name, timestamp_start):
+        return {
+            "area": area_name,
+            "team": team,
+            "contract_code": {"$in": list(contract_codes)},
+            "month": QuanLyABCVIP._month_key(timestamp_start),
+        }
+
+    @staticmethod
+    def _collect_current_budgets(records, original_contract_code):
+        current_budgets = {}
+        for record in records:
+            if original_contract_code:
+                # Nếu có original_contract_code → dùng luôn làm key
+                key = original_contract_code
+            else:
+                # Nếu không → fallback về _id
+                key = record["_id"] if isinstance(record["_id"], str) else record["_id"].get("contract_code")
+            current_budgets[key] = record["total_amount"]
+        return current_budgets
 
-        except Exception as e:
-            logging.error(f"❌ Lỗi trong convert_to_contract_code({hd_code}): {e}")
-            return hd_code
-    
     def get_current_budget(self, contract_codes, team, chat_id ,original_contract_code=None, current_timestamp=None):
         """
         Lấy tổng ngân sách hiện tại của danh sách contract_code từ MongoDB.
         Nếu hôm nay là ngày cuối tháng (theo giờ Việt Nam), thì lấy ngân sách của tháng sau.
+        - Mặc định đọc thẳng từ bảng tổng hợp theo tháng (mỗi mã một dòng; được đối chiếu định kỳ
+          với dữ liệu gốc bằng `reconcile_rollup`, sửa tay bằng /rebuildrollup).
+        - Nếu có `original_contract_code` (/check) → vẫn tổng hợp từ dữ liệu gốc vì bảng
+          tổng hợp không lưu theo mã gốc.
         """
         try:
-            # 🇻🇳 Giờ Việt Nam
-            vn_tz = pytz.timezone("Asia/Ho_Chi_Minh")
-            if current_timestamp:
-                # Nếu timestamp truyền vào → convert sang datetime theo VN timezone
-                now_vn = datetime.fromtimestamp(current_timestamp, tz=pytz.utc).astimezone(vn_tz)
-            else:
-                # Mặc định lấy thời điểm hiện tại
-                now_vn = datetime.now(vn_tz)
-
-            # 🟢 Kiểm tra nếu hôm nay là ngày cuối tháng (theo giờ VN)
-            last_day = calendar.monthrange(now_vn.year, now_vn.month)[1]
-            if now_vn.day == last_day:
-                # 👉 Chuyển sang tháng sau
-                if now_vn.month == 12:
-                    next_month = datetime(now_vn.year + 1, 1, 1, tzinfo=vn_tz)
-                else:
-                    next_month = datetime(now_vn.year, now_vn.month + 1, 1, tzinfo=vn_tz)
-                first_day_of_month_vn = next_month
-            else:
-                first_day_of_month_vn = datetime(now_vn.year, now_vn.month, 1, tzinfo=vn_tz)
-
-            # 🟢 Ngày cuối tháng theo giờ VN
-            year = first_day_of_month_vn.year
-            month = first_day_of_month_vn.month
-            last_day_of_target_month = calendar.monthrange(year, month)[1]
-            last_day_of_month_vn = datetime(year, month, last_day_of_target_month, 23, 59, 59, tzinfo=vn_tz)
-
-            # 👉 Chuyển sang UTC để truy vấn theo timestamp (Mongo lưu UTC)
-            timestamp_start = int(first_day_of_month_vn.astimezone(pytz.utc).timestamp())
-            timestamp_end = int(last_day_of_month_vn.astimezone(pytz.utc).timestamp())
+            timestamp_start, timestamp_end = self._month_window(current_timestamp)
 
             # 🔍 Lấy thông tin phòng để xác định khu vực
-            room_info = room_manager.get_room_by_id(chat_id)
-            if not room_info:
-                logger.warning(f"⚠️ Không tìm thấy phòng với ID {chat_id}. Không thể xác định khu vực.")
-                area_name = "unknown"
-            else:
-                area_name = room_info.get("area", "unknown")
-                
-            if original_contract_code:
-                query = {
-                    "$or": [
-                        {"contract_code": {"$in": contract_codes}},
-                        {"original_contract_code": {"$in": [original_contract_code]}}
-                    ],
-                    "area": area_name,
-                    "team": team,
-                    "timestamp": {"$gte": timestamp_start, "$lte": timestamp_end}
-                }
-            else:
-                query = {
-                    "contract_code": {"$in": contract_codes},
-                    "area": area_name,
-                    "team": team,
-                    "timestamp": {"$gte": timestamp_start, "$lte": timestamp_end}
-                }
-
-            pipeline = [
-                {"$match": query},
-                {"$group": {
-                    "_id": "$contract_code",
-                    "total_amount": {"$sum": "$amount"}
-                }}
-            ]
+            area_name = room_manager.get_area_by_room_id(chat_id)
+
+            if not original_contract_code:
+                rows = self.rollup_collection.find(
+                    self._rollup_query(contract_codes, team, area_name, timestamp_start),
+                    {"_id": 0, "contract_code": 1, "total_amount": 1}
+                )
+                current_budgets = {row["contract_code"]: row["total_amount"] for row in rows}
+                logger.info(f"📊 Ngân sách tổng hợp: {current_budgets}")
+                return current_budgets
 
+            pipeline = self._current_budget_pipeline(
+                contract_codes, team, area_name, original_contract_code, timestamp_start, timestamp_end
+            )
             records = self.budget_collection.aggregate(pipeline)
-            current_budgets = {}
-            for record in records:
-                if original_contract_code:
-                    # Nếu có original_contract_code → dùng luôn làm key
-                    key = original_contract_code
-                else:
-                    # Nếu không → fallback về _id
-                    key = record["_id"] if isinstance(record["_id"], str) else record["_id"].get("contract_code")
-                current_budgets[key] = record["total_amount"]
+            current_budgets = self._collect_current_budgets(records, original_contract_code)
 
             logger.info(f"📊 Ngân sách tổng hợp: {current_budgets}")
             return current_budgets
@@ -350,61 +814,262 @@ class QuanLyABCVIP:
             logger.error(f"❌ Lỗi khi lấy tổng ngân sách: {e}")
             return {}
 
-        
-    
+    def get_limits(self, keys):
+        """
+        Lấy giới hạn ngân sách cho nhiều key trong một lần (từ cache 'budget_limits').
+        :param keys: danh sách key (ví dụ ['HD1', 'HD9'])
+        :return: dict key -> {"key", "limit", "updated_at"}, key không có limit sẽ bị bỏ qua
+        """
+        try:
+            return reference_cache.get_limits(keys)
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi lấy limit cho {keys}: {e}")
+            return {}
+
     def get_limit_by_key(self, key: str):
         """
-        Lấy thông tin giới hạn ngân sách (limit) theo key từ collection 'budget_limits'.
+        Lấy thông tin giới hạn ngân sách (limit) theo key từ cache 'budget_limits'.
         :param key: tên key (ví dụ 'HD1', 'HD9', ...)
         :return: dict chứa thông tin limit hoặc None nếu không tìm thấy
         """
+        if not key:
+            logger.error("❌ Lỗi khi lấy limit: Key không được để trống")
+            return None
+
+        limit_info = self.get_limits([key]).get(key)
+        if not limit_info:
+            logger.warning(f"⚠️ Không tìm thấy limit cho key: {key}")
+        return limit_info
+
+    def get_ignored_contracts_by_key(self, key: str):
+        """
+        Lấy danh sách contract_codes cần bỏ qua theo key từ cache 'ignored_contracts'.
+        :param key: tên key (ví dụ 'ABCVIP')
+        :return: frozenset mã đã chuẩn hóa (strip + upper), rỗng nếu không có
+        """
         try:
             if not key:
                 raise ValueError("Key không được để trống")
+            return reference_cache.get_ignored(key)
 
-            record = self.threshold_collection.find_one({"key": key})
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi lấy ignored_contracts theo key '{key}': {e}")
+            return frozenset()
 
-            if record:
-                return {
-                    "key": record.get("key"),
-                    "limit": record.get("limit"),
-                    "updated_at": record.get("updated_at"),
-                }
 
-            logger.warning(f"⚠️ Không tìm thấy limit cho key: {key}")
-            return None
+    # ===== API async (dùng trong handler của bot, không chặn event loop) =====
+
+    async def add_budget_async(
+        self,
+        budget_id,
+        team,
+        contract_code,
+        original_contract_code,
+        group_name,
+        chat_id,
+        amount,
+        status,
+        timestamp=None,
+        assistant=None,
+        note=None,
+        end_time=None
+    ):
+        try:
+            try:
+                amount = int(amount)
+            except ValueError:
+                logger.error(f"Invalid amount value: {amount}")
+                return None
+
+            area_name = await room_manager.get_area_by_room_id_async(chat_id)
+
+            budget_data = self._build_budget_doc(
+                budget_id, team, contract_code, original_contract_code, group_name,
+                amount, status, timestamp, assistant, note, end_time, area_name
+            )
+
+            inserted = await self.async_budget_collection.insert_one(budget_data)
+            await self._apply_rollup_async({self._rollup_key(budget_data): amount})
+            budget_data["_id"] = str(inserted.inserted_id)
+            self._send_ws(budget_data)
+
+            logger.info(
+                f"✅ Successfully added new budget: {budget_id} - {team.upper()} - {amount}"
+            )
+            return inserted.inserted_id
 
         except Exception as e:
-            logger.error(f"❌ Lỗi khi lấy limit theo key '{key}': {e}")
+            logger.error(f"❌ Error adding budget: {e}")
             return None
 
-    def get_ignored_contracts_by_key(self, key: str):
-        """
-        Lấy danh sách contract_codes cần bỏ qua theo key từ collection 'ignored_contracts'.
-        :param key: tên key (ví dụ 'ABCVIP')
-        :return: danh sách contract_codes (list[str]) hoặc rỗng nếu không có
-        """
+    async def add_budgets_bulk_async(self, budget_id, team, allocations, group_name, chat_id, status,
+                                     timestamp=None, assistant=None, note=None, end_time=None):
+        """Bản async của `add_budgets_bulk`: 1 lần tra khu vực + 1 lần `insert_many`."""
         try:
-            if not hasattr(self, "ignored_contracts_collection"):
-                self.ignored_contracts_collection = mongo_manager.get_collection(config.IGNORED_CONTRACTS)
+            if not allocations:
+                return {"status": BULK_FAILED, "inserted_ids": []}
+            area_name = await room_manager.get_area_by_room_id_async(chat_id)
+            docs = self._build_bulk_docs(budget_id, team, allocations, group_name, status,
+                                         timestamp, assistant, note, end_time, area_name)
+        except Exception as e:
+            logger.error(f"❌ Error adding budgets in bulk: {e}")
+            return {"status": BULK_FAILED, "inserted_ids": []}
 
-            if not key:
-                raise ValueError("Key không được để trống")
+        try:
+            await self.async_budget_collection.insert_many(docs, ordered=False)
+            outcome = self._bulk_insert_outcome(docs)
+        except BulkWriteError as e:
+            outcome = self._bulk_insert_outcome(docs, e)
+        except Exception as e:
+            logger.error(f"❌ Không rõ ngân sách {budget_id} đã được ghi hay chưa: {e}")
+            return {"status": BULK_UNKNOWN, "inserted_ids": []}
+
+        status, new_docs, written_ids = outcome
+        await self._apply_rollup_async(self._bulk_deltas(new_docs))
+        return self._after_bulk_insert(budget_id, team, status, new_docs, written_ids)
+
+    async def complete_budgets_async(self, budget_id, amount=None):
+        """Bản async của `complete_budgets`: 1 lần đọc pending + 1 `bulk_write` + 1 lần đọc kết quả."""
+        try:
+            pending_records = await self.async_budget_collection.find(
+                {"budget_id": budget_id, "status": "pending"}
+            ).to_list(None)
+            if not pending_records:
+                logger.warning(f"⚠️ Không có bản ghi nào cần cập nhật với budget_id: {budget_id}")
+                return self._finish_done_transition(budget_id, [], None, [])
+
+            ids, op_id, ops = self._done_transition_ops(pending_records, amount)
+            result = await self.async_budget_collection.bulk_write(ops, ordered=False) if ops else None
+            try:
+                updated_records = await self.async_budget_collection.find({"_id": {"$in": ids}}).to_list(None)
+            finally:
+                if ops:
+                    await self._clear_done_marker_async(ids, op_id)
+            applied_records = self._applied_records(updated_records, op_id)
+            await self._apply_rollup_async(self._done_transition_deltas(pending_records, applied_records, amount))
+            return self._finish_done_transition(budget_id, pending_records, result, applied_records)
+
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi chốt budget {budget_id}: {e}")
+            return None
+
+    async def update_budget_status_async(self, budget_id):
+        result = await self.complete_budgets_async(budget_id)
+        return result["done"] if result else 0
 
-            record = self.ignored_contracts_collection.find_one({"key": key})
+    async def get_pending_budgets_by_id_async(self, budget_id):
+        try:
+            pending_records = await self.async_budget_collection.find(
+                {"budget_id": budget_id, "status": "pending"}
+            ).to_list(None)
 
-            if record:
-                contract_codes = record.get("contract_codes", [])
-                logger.info(f"✅ Lấy danh sách bỏ qua ({len(contract_codes)} mã) cho key '{key}' thành công.")
-                return contract_codes
+            if not pending_records:
+                logger.warning(f"⚠️ Không tìm thấy bản ghi `pending` nào với budget_id `{budget_id}`.")
 
-            logger.warning(f"⚠️ Không tìm thấy bản ghi ignored_contracts với key: {key}")
+            return pending_records
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi truy vấn ngân sách pending: {e}")
             return []
 
+    async def update_budget_async(self, record_id, new_data):
+        try:
+            validated = self._validate_update(record_id, new_data)
+            if not validated:
+                return False
+            record_id, new_data = validated
+
+            before = await self.async_budget_collection.find_one_and_update(
+                {"_id": record_id},
+                {"$set": new_data},
+                return_document=ReturnDocument.BEFORE
+            )
+            after = self._merge_update(record_id, before, new_data)
+            if after is None:
+                return False
+
+            await self._apply_rollup_async(self._rollup_change(before, after))
+            self._send_ws({k: v for k, v in after.items() if k != "_id"})
+            logger.info(f"✅ Đã cập nhật bản ghi {record_id} thành công")
+            return True
+
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi cập nhật budget: {e}")
+            return False
+
+    async def convert_to_contract_code_async(self, hd_code: str) -> str:
+        try:
+            return await contract_normalizer.normalize_async(hd_code)
+
+        except Exception as e:
+            logger.error(f"❌ Lỗi trong convert_to_contract_code_async({hd_code}): {e}")
+            return hd_code
+
+    async def get_current_budget_async(self, contract_codes, team, chat_id, original_contract_code=None, current_timestamp=None):
+        try:
+            timestamp_start, timestamp_end = self._month_window(current_timestamp)
+            area_name = await room_manager.get_area_by_room_id_async(chat_id)
+
+            if not original_contract_code:
+                rows = await self.async_rollup_collection.find(
+                    self._rollup_query(contract_codes, team, area_name, timestamp_start),
+                    {"_id": 0, "contract_code": 1, "total_amount": 1}
+                ).to_list(None)
+                current_budgets = {row["contract_code"]: row["total_amount"] for row in rows}
+                logger.info(f"📊 Ngân sách tổng hợp: {current_budgets}")
+                return current_budgets
+
+            pipeline = self._current_budget_pipeline(
+                contract_codes, team, area_name, original_contract_code, timestamp_start, timestamp_end
+            )
+            cursor = await self.async_budget_collection.aggregate(pipeline)
+            records = await cursor.to_list(None)
+            current_budgets = self._collect_current_budgets(records, original_contract_code)
+
+            logger.info(f"📊 Ngân sách tổng hợp: {current_budgets}")
+            return current_budgets
+
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi lấy tổng ngân sách: {e}")
+            return {}
+
+    async def get_limits_async(self, keys):
+        try:
+            return await reference_cache.get_limits_async(keys)
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi lấy limit cho {keys}: {e}")
+            return {}
+
+    async def get_limit_by_key_async(self, key: str):
+        if not key:
+            logger.error("❌ Lỗi khi lấy limit: Key không được để trống")
+            return None
+
+        limit_info = (await self.get_limits_async([key])).get(key)
+        if not limit_info:
+            logger.warning(f"⚠️ Không tìm thấy limit cho key: {key}")
+        return limit_info
+
+    async def get_ignored_contracts_by_key_async(self, key: str):
+        try:
+            if not key:
+                raise ValueError("Key không được để trống")
+            return await reference_cache.get_ignored_async(key)
+
         except Exception as e:
             logger.error(f"❌ Lỗi khi lấy ignored_contracts theo key '{key}': {e}")
-            return []
+            return frozenset()
+
+
+
+budget_manager = QuanLyABCVIP()
+
 
+if __name__ == "__main__":
+    import argparse
 
+    parser = argparse.ArgumentParser(description="Công cụ quản lý ngân sách.")
+    parser.add_argument("--rebuild-rollup", action="store_true", help="Tính lại bảng tổng hợp ngân sách theo tháng")
+    args = parser.parse_args()
 
-budget_manager = QuanLyABCVIP()
\ No newline at end of file
+    if args.rebuild_rollup:
+        print(f"Số dòng tổng hợp: {budget_manager.rebuild_rollup()}")
@@ -0,0 +1,115 @@
+import logging
+import re
+from db.reference_cache import reference_cache
+
+# Cấu hình logging
+logger = logging.getLogger(__name__)
+
+CONTRACT_KEY = "ABCVIP"  # key trong 'ignored_contracts' áp dụng cho mã hợp đồng
+FAMILY_SUFFIX = "11"
+CODE_LENGTH = 5
+_MAX_MEMO = 4096
+_TRAILING_DIGITS = re.compile(r"\d+$")
+
+
+def _clean(code):
+    return str(code).strip().upper()
+
+
+def _siblings(code):
+    """Mã cùng họ theo hậu tố "11": FD3N11 ↔ FD3N."""
+    # Mã chỉ có "11" không có mã gốc (không để chuỗi rỗng vào họ)
+    if code.endswith(FAMILY_SUFFIX) and len(code) > len(FAMILY_SUFFIX):
+        return (code[:-len(FAMILY_SUFFIX)],)
+    if not _TRAILING_DIGITS.search(code):
+        return (code + FAMILY_SUFFIX,)
+    return ()
+
+
+class ContractCodeNormalizer:
+    """
+    Chuẩn hóa mã hợp đồng cho toàn bộ bot (/ns, nút xác nhận, QuanLyABCVIP):
+    - Mã nằm trong 'ignored_contracts' (key ABCVIP) → giữ nguyên, ngược lại cắt còn 5 ký tự.
+    - `family(code)` trả về các mã cùng họ "11" để cộng ngân sách hiện tại.
+    Kết quả được nhớ theo từng mã đầu vào và tự xóa khi danh sách mã bỏ qua thay đổi.
+    """
+    _instance = None  # Singleton instance
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(ContractCodeNormalizer, cls).__new__(cls)
+            cls._instance._init_state()
+        return cls._instance
+
+    def _init_state(self):
+        self._ignored = frozenset()
+        self._memo = {}
+        self._families = {}
+
+    def _sync(self, ignored):
+        """Dựng lại bảng nhớ khi reference_cache trả về danh sách mã bỏ qua khác."""
+        if ignored is self._ignored or ignored == self._ignored:
+            self._ignored = ignored
+            return
+        self._ignored = ignored
+        self._memo = {}
+        # Các họ có sẵn trong danh sách bỏ qua (FD3N11 ↔ FD3N) được tính trước một lần
+        self._families = {}
+        for code in ignored:
+            for sibling in _siblings(code):
+                self._families[code] = (code, sibling)
+                self._families[sibling] = (sibling, code)
+        logger.info(f"♻️ Đã dựng lại bộ chuẩn hóa mã hợp đồng: {len(ignored)} mã bỏ qua, {len(self._families)} mã có họ.")
+
+    def _normalize(self, code):
+        try:
+            return self._memo[code]
+        except KeyError:
+            pass
+        cleaned = _clean(code)
+        normalized = cleaned if cleaned in self._ignored else cleaned[:CODE_LENGTH]
+        if len(self._memo) >= _MAX_MEMO:
+            self._memo.clear()
+        self._memo[code] = normalized
+        return normalized
+
+    def normalize(self, code):
+        """:return: mã hợp đồng đã chuẩn hóa ("" nếu rỗng)."""
+        if not code:
+            return ""
+        self._sync(reference_cache.get_ignored(CONTRACT_KEY))
+        return self._normalize(code)
+
+    async def normalize_async(self, code):
+        if not code:
+            return ""
+        self._sync(await reference_cache.get_ignored_async(CONTRACT_KEY))
+        return self._normalize(code)
+
+    async def normalize_many_async(self, codes):
+        """
+        Chuẩn hóa nhiều mã với một lần đọc cache.
+        :return: list (mã đã chuẩn hóa, mã gốc đã strip + upper), giữ thứ tự đầu vào, bỏ mã rỗng
+        """
+        self._sync(await reference_cache.get_ignored_async(CONTRACT_KEY))
+        return [(self._normalize(code), _clean(code)) for code in codes if _clean(code)]
+
+    def family(self, code):
+        """:return: tuple các mã cùng họ, mã `code` đứng đầu."""
+        family = self._families.get(code)
+        if family is None:
+            family = (code,) + _siblings(code)
+            if len(self._families) < _MAX_MEMO:
+                self._families[code] = family
+        return family
+
+    def family_members(self, codes):
+        """Tập mọi mã cần đọc ngân sách để tính tổng theo họ cho `codes`."""
+        return {member for code in codes for member in self.family(code)}
+
+    def family_totals(self, codes, budgets):
+        """:return: dict mã -> tổng ngân sách của cả họ (theo `budgets`)."""
+        return {code: sum(budgets.get(member, 0) for member in self.family(code)) for code in codes}
+
+
+contract_normalizer = ContractCodeNormalizer()
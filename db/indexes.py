@@ -0,0 +1,177 @@
+import argparse
+import logging
+from pymongo import ASCENDING, IndexModel, errors
+from db.initdb import mongo_manager
+import config
+
+# Cấu hình logging
+logger = logging.getLogger(__name__)
+
+# Khai báo index cho từng collection mà bot truy vấn
+INDEX_SPECS = {
+    config.BUDGET: [
+        # /done: lọc theo budget_id + status
+        IndexModel([("budget_id", ASCENDING), ("status", ASCENDING)], name="budget_id_status"),
+        # get_current_budget: area + team + contract_code + khoảng timestamp
+        IndexModel(
+            [("area", ASCENDING), ("team", ASCENDING), ("contract_code", ASCENDING), ("timestamp", ASCENDING)],
+            name="area_team_contract_timestamp",
+        ),
+        # /check: nhánh $or theo original_contract_code
+        IndexModel(
+            [("area", ASCENDING), ("team", ASCENDING), ("original_contract_code", ASCENDING), ("timestamp", ASCENDING)],
+            name="area_team_original_contract_timestamp",
+        ),
+    ],
+    config.BUDGET_ROLLUP: [
+        # Bảng tổng hợp: mỗi (area, team, contract_code, month) đúng một dòng
+        IndexModel(
+            [("area", ASCENDING), ("team", ASCENDING), ("month", ASCENDING), ("contract_code", ASCENDING)],
+            name="area_team_month_contract_unique",
+            unique=True,
+        ),
+    ],
+    config.ALLOW_ROOM: [
+        IndexModel([("id_room_chat", ASCENDING)], name="id_room_chat_unique", unique=True),
+    ],
+    config.BUDGET_THRESHOLD: [
+        IndexModel([("key", ASCENDING)], name="key_unique", unique=True),
+    ],
+    config.IGNORED_CONTRACTS: [
+        IndexModel([("key", ASCENDING)], name="key_unique", unique=True),
+    ],
+    "tro_ly": [
+        IndexModel([("id_tele", ASCENDING)], name="id_tele_unique", unique=True),
+    ],
+    config.ADS: [
+        IndexModel([("id_tele", ASCENDING)], name="id_tele_unique", unique=True),
+    ],
+}
+
+# Các truy vấn nóng cần kiểm tra bằng explain() (giá trị mẫu chỉ để lấy kế hoạch truy vấn)
+HOT_QUERIES = [
+    ("budget theo budget_id + status", config.BUDGET, {"budget_id": "X-00000000", "status": "pending"}),
+    ("tổng ngân sách theo mã HD", config.BUDGET, {
+        "contract_code": {"$in": ["XXXXX"]},
+        "area": "unknown",
+        "team": "X",
+        "timestamp": {"$gte": 0, "$lte": 1},
+    }),
+    ("tổng ngân sách theo mã gốc (/check)", config.BUDGET, {
+        "$or": [
+            {"contract_code": {"$in": ["XXXXX"]}},
+            {"original_contract_code": {"$in": ["XXXXXX"]}},
+        ],
+        "area": "unknown",
+        "team": "X",
+        "timestamp": {"$gte": 0, "$lte": 1},
+    }),
+    ("tổng hợp ngân sách theo tháng", config.BUDGET_ROLLUP, {
+        "area": "unknown",
+        "team": "X",
+        "contract_code": {"$in": ["XXXXX"]},
+        "month": "1970-01",
+    }),
+    ("phòng theo id_room_chat", config.ALLOW_ROOM, {"id_room_chat": 0}),
+    ("giới hạn ngân sách theo key", config.BUDGET_THRESHOLD, {"key": "X"}),
+    ("mã bỏ qua theo key", config.IGNORED_CONTRACTS, {"key": "ABCVIP"}),
+    ("trợ lý theo id_tele", "tro_ly", {"id_tele": 0}),
+    ("ads theo id_tele", config.ADS, {"id_tele": 0}),
+]
+
+
+def _plan_stages(plan):
+    """Duyệt đệ quy cây kế hoạch truy vấn và trả về danh sách stage."""
+    if not isinstance(plan, dict):
+        return []
+    stages = [plan.get("stage")] if plan.get("stage") else []
+    for key in ("inputStage", "queryPlan"):
+        stages += _plan_stages(plan.get(key))
+    for child in plan.get("inputStages", []) or []:
+        stages += _plan_stages(child)
+    return stages
+
+
+def _summarize_explain(name, collection_name, explain):
+    winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+    stages = [stage for stage in _plan_stages(winning_plan) if stage]
+    return {
+        "name": name,
+        "collection": collection_name,
+        "stages": stages,
+        "collscan": "COLLSCAN" in stages,
+    }
+
+
+class IndexManager:
+    _instance = None  # Singleton instance
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(IndexManager, cls).__new__(cls)
+        return cls._instance
+
+    def ensure_indexes(self):
+        """
+        Tạo (idempotent) toàn bộ index đã khai báo trong INDEX_SPECS.
+        Lỗi ở một collection (ví dụ dữ liệu trùng với index unique) chỉ được ghi log, không dừng bot.
+        :return: dict collection -> danh sách tên index đã đảm bảo
+        """
+        created = {}
+        for collection_name, models in INDEX_SPECS.items():
+            try:
+                collection = mongo_manager.get_collection(collection_name)
+                created[collection_name] = collection.create_indexes(models)
+                logger.info(f"✅ Index cho '{collection_name}': {created[collection_name]}")
+            except errors.OperationFailure as e:
+                logger.error(f"❌ Không thể tạo index cho '{collection_name}': {e}")
+            except Exception as e:
+                logger.error(f"❌ Lỗi khi tạo index cho '{collection_name}': {e}")
+        return created
+
+    def explain_hot_queries(self):
+        """Chạy explain() cho các truy vấn nóng, đánh dấu truy vấn bị COLLSCAN."""
+        reports = []
+        for name, collection_name, query in HOT_QUERIES:
+            try:
+                explain = mongo_manager.get_collection(collection_name).find(query).explain()
+                reports.append(_summarize_explain(name, collection_name, explain))
+            except Exception as e:
+                logger.error(f"❌ Lỗi khi explain truy vấn '{name}': {e}")
+                reports.append({"name": name, "collection": collection_name, "error": str(e)})
+        return reports
+
+    async def explain_hot_queries_async(self):
+        """Bản async của `explain_hot_queries` (dùng cho lệnh admin)."""
+        reports = []
+        for name, collection_name, query in HOT_QUERIES:
+            try:
+                explain = await mongo_manager.get_async_collection(collection_name).find(query).explain()
+                reports.append(_summarize_explain(name, collection_name, explain))
+            except Exception as e:
+                logger.error(f"❌ Lỗi khi explain truy vấn '{name}': {e}")
+                reports.append({"name": name, "collection": collection_name, "error": str(e)})
+        return reports
+
+
+index_manager = IndexManager()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tạo index và kiểm tra truy vấn nóng bằng explain().")
+    parser.add_argument("--explain", action="store_true", help="Chỉ chạy explain(), không tạo index")
+    args = parser.parse_args()
+
+    if not args.explain:
+        index_manager.ensure_indexes()
+
+    has_collscan = False
+    for report in index_manager.explain_hot_queries():
+        if "error" in report:
+            print(f"⚠️  {report['name']} ({report['collection']}): {report['error']}")
+            continue
+        has_collscan = has_collscan or report["collscan"]
+        flag = "❌ COLLSCAN" if report["collscan"] else "✅"
+        print(f"{flag} {report['name']} ({report['collection']}): {' > '.join(report['stages'])}")
+
+    raise SystemExit(1 if has_collscan else 0)
@@ -1,6 +1,6 @@
 import time
 import logging
-from pymongo import MongoClient, errors
+from pymongo import MongoClient, AsyncMongoClient, errors
 import config
 
 # Cấu hình logging
@@ -19,6 +19,8 @@ class MongoDBManager:
 
     def _init_db(self, max_retries=5, retry_delay=3):
         """Tạo một kết nối MongoDB duy nhất với cơ chế thử lại"""
+        self.async_client = None
+        self.async_db = None
         retries = 0
         while retries < max_retries:
             try:
@@ -39,5 +41,22 @@ class MongoDBManager:
         """Lấy collection từ kết nối MongoDB đã mở"""
         return self.db[collection_name]
 
+    def get_async_collection(self, collection_name):
+        """
+        Lấy collection async (pymongo AsyncMongoClient) để các handler `await` mà không chặn event loop.
+        Client async được tạo lười ở lần gọi đầu tiên, dùng chung cho mọi manager.
+        """
+        if self.async_client is None:
+            self.async_client = AsyncMongoClient(config.MONGO_URI, maxPoolSize=50, serverSelectionTimeoutMS=5000)
+            self.async_db = self.async_client[config.DB_NAME]
+        return self.async_db[collection_name]
+
+    async def close_async(self):
+        """Đóng client async (gọi khi bot tắt)."""
+        if self.async_client is not None:
+            await self.async_client.close()
+            self.async_client = None
+            self.async_db = None
+
 # Khởi tạo MongoDB Manager
 mongo_manager = MongoDBManager()
@@ -2,9 +2,8 @@ from db.initdb import mongo_manager
 import config
 import logging
 from datetime import datetime
-from db.rooms import RoomManager
+from db.rooms import room_manager
 
-room_manager = RoomManager()
 # Cấu hình logging
 logger = logging.getLogger(__name__)
 
@@ -21,6 +20,10 @@ class NoteManager:
         """Khởi tạo kết nối với collection 'notes'."""
         self.note_collection = mongo_manager.get_collection('notes')
 
+    @property
+    def async_note_collection(self):
+        return mongo_manager.get_async_collection('notes')
+
     def add_note(self, chat_title, note_type, timestamp, note_content, assistant, chat_id):
         """
         Lưu ghi chú vào MongoDB.
@@ -32,13 +35,7 @@ class NoteManager:
         :return: ID của ghi chú được thêm vào hoặc None nếu thất bại
         """
         
-        room_info = room_manager.get_room_by_id(chat_id)
-
-        if not room_info:
-            logger.warning(f"⚠️ Không tìm thấy phòng với ID {chat_id}. Không thể xác định khu vực.")
-            area_name = "unknown"
-        else:
-            area_name = room_info.get("area", "unknown")
+        area_name = room_manager.get_area_by_room_id(chat_id)
             
         try:
             note_data = {
@@ -71,5 +68,36 @@ class NoteManager:
             logger.error(f"Lỗi khi xóa ghi chú cũ: {e}")
             return 0
 
+    async def add_note_async(self, chat_title, note_type, timestamp, note_content, assistant, chat_id):
+        """Bản async của `add_note`."""
+        area_name = await room_manager.get_area_by_room_id_async(chat_id)
+
+        try:
+            note_data = {
+                "chat_title": chat_title,
+                "note_type": note_type,
+                "timestamp": timestamp,
+                "note_content": note_content,
+                "assistant": assistant,
+                "area": area_name
+            }
+            result = await self.async_note_collection.insert_one(note_data)
+            logger.info(f"Thêm ghi chú thành công vào MongoDB: {note_data}")
+            return result.inserted_id
+        except Exception as e:
+            logger.error(f"Lỗi khi thêm ghi chú vào MongoDB: {e}")
+            return None
+
+    async def delete_old_notes_async(self, days=5):
+        """Bản async của `delete_old_notes`."""
+        try:
+            cutoff_date = datetime.now().timestamp() - (days * 86400)
+            result = await self.async_note_collection.delete_many({"timestamp": {"$lt": cutoff_date}})
+            logger.info(f"Đã xóa {result.deleted_count} ghi chú cũ quá {days} ngày.")
+            return result.deleted_count
+        except Exception as e:
+            logger.error(f"Lỗi khi xóa ghi chú cũ: {e}")
+            return 0
+
 # Khởi tạo NoteManager
 note_manager = NoteManager()
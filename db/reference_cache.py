@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import threading
+import time
+from db.initdb import mongo_manager
+import config
+
+# Cấu hình logging
+logger = logging.getLogger(__name__)
+
+
+def _normalize_code(code):
+    return str(code).strip().upper()
+
+
+def _format_limit(record):
+    return {
+        "key": record.get("key"),
+        "limit": record.get("limit"),
+        "updated_at": record.get("updated_at"),
+    }
+
+
+def _build_limits(records):
+    """budget_limits → dict key -> thông tin limit."""
+    return {record.get("key"): _format_limit(record) for record in records if record.get("key")}
+
+
+def _build_ignored(records):
+    """ignored_contracts → dict key -> frozenset mã đã chuẩn hóa (strip + upper)."""
+    return {
+        record.get("key"): frozenset(_normalize_code(code) for code in record.get("contract_codes", []) or [])
+        for record in records if record.get("key")
+    }
+
+
+class ReferenceCache:
+    """
+    Bộ nhớ đệm trong tiến trình cho hai bảng tham chiếu ít thay đổi: 'budget_limits' và 'ignored_contracts'.
+    - Mỗi bảng được nạp bằng một truy vấn duy nhất (find toàn bộ).
+    - Tự nạp lại khi quá hạn TTL hoặc khi gọi `invalidate()`.
+    """
+    _instance = None  # Singleton instance
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(ReferenceCache, cls).__new__(cls)
+            cls._instance._init_cache()
+        return cls._instance
+
+    def _init_cache(self):
+        self.ttl = config.REFERENCE_CACHE_TTL
+        self._limits = {}
+        self._ignored = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._async_lock = None
+
+    def _is_fresh(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def _store(self, limit_records, ignored_records):
+        self._limits = _build_limits(limit_records)
+        self._ignored = _build_ignored(ignored_records)
+        self._loaded_at = time.monotonic()
+        logger.info(f"✅ Đã nạp cache tham chiếu: {len(self._limits)} limit, {len(self._ignored)} nhóm mã bỏ qua.")
+
+    def invalidate(self):
+        """Đánh dấu cache hết hạn, lần đọc kế tiếp sẽ nạp lại từ MongoDB."""
+        self._loaded_at = None
+        logger.info("♻️ Đã xóa cache tham chiếu (budget_limits, ignored_contracts).")
+
+    def refresh(self):
+        """Nạp lại cả hai bảng từ MongoDB. Lỗi thì giữ nguyên dữ liệu cũ."""
+        try:
+            limit_records = list(mongo_manager.get_collection(config.BUDGET_THRESHOLD).find({}, {"_id": 0}))
+            ignored_records = list(mongo_manager.get_collection(config.IGNORED_CONTRACTS).find({}, {"_id": 0}))
+            self._store(limit_records, ignored_records)
+            return True
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi nạp cache tham chiếu: {e}")
+            return False
+
+    async def refresh_async(self):
+        try:
+            limit_records = await mongo_manager.get_async_collection(config.BUDGET_THRESHOLD).find({}, {"_id": 0}).to_list(None)
+            ignored_records = await mongo_manager.get_async_collection(config.IGNORED_CONTRACTS).find({}, {"_id": 0}).to_list(None)
+            self._store(limit_records, ignored_records)
+            return True
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi nạp cache tham chiếu: {e}")
+            return False
+
+    def _ensure_fresh(self):
+        if self._is_fresh():
+            return
+        with self._lock:
+            if not self._is_fresh():
+                self.refresh()
+
+    async def _ensure_fresh_async(self):
+        if self._is_fresh():
+            return
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        # Chỉ một coroutine nạp lại, các coroutine khác chờ rồi dùng kết quả
+        async with self._async_lock:
+            if not self._is_fresh():
+                await self.refresh_async()
+
+    def _pick_limits(self, keys):
+        return {key: self._limits[key] for key in keys if key in self._limits}
+
+    def get_limits(self, keys):
+        """
+        Tra cứu limit cho nhiều key cùng lúc.
+        :return: dict key -> {"key", "limit", "updated_at"} (key không có limit sẽ không xuất hiện)
+        """
+        self._ensure_fresh()
+        return self._pick_limits(keys)
+
+    async def get_limits_async(self, keys):
+        await self._ensure_fresh_async()
+        return self._pick_limits(keys)
+
+    def get_ignored(self, key):
+        """:return: frozenset mã hợp đồng bỏ qua (đã strip + upper) của key."""
+        self._ensure_fresh()
+        return self._ignored.get(key, frozenset())
+
+    async def get_ignored_async(self, key):
+        await self._ensure_fresh_async()
+        return self._ignored.get(key, frozenset())
+
+
+reference_cache = ReferenceCache()
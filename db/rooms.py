@@ -1,6 +1,9 @@
 from db.initdb import mongo_manager
 import config 
+import asyncio
 import logging
+import threading
+import time
 from bson.int64 import Int64
 
 # Cấu hình logging
@@ -16,8 +19,116 @@ class RoomManager:
         return cls._instance
 
     def _initialize(self):
-        """Khởi tạo kết nối với collection 'rooms'."""
+        """
+        Khởi tạo kết nối với collection 'rooms' và registry phòng trong bộ nhớ.
+        Registry: dict chat_id -> {"room_name", "area"}, dùng chung cho decorator và các manager.
+        """
         self.rooms_collection = mongo_manager.get_collection(config.ALLOW_ROOM)
+        self._registry = {}
+        self._registry_loaded_at = None
+        self._registry_lock = threading.Lock()
+        self._registry_async_lock = None
+
+    @property
+    def async_rooms_collection(self):
+        return mongo_manager.get_async_collection(config.ALLOW_ROOM)
+
+    @staticmethod
+    def _normalize_room_id(id_room_chat):
+        """Ép kiểu ID phòng về Int64 để trùng với MongoDB. Trả về None nếu không hợp lệ."""
+        if isinstance(id_room_chat, str):
+            try:
+                id_room_chat = int(id_room_chat)
+            except ValueError:
+                logger.error(f"❌ ID không hợp lệ (không thể chuyển sang int): {id_room_chat}")
+                return None
+        return Int64(id_room_chat)
+
+    # ===== Registry phòng trong bộ nhớ =====
+
+    def _registry_is_fresh(self):
+        return (
+            self._registry_loaded_at is not None
+            and time.monotonic() - self._registry_loaded_at < config.ROOM_REGISTRY_TTL
+        )
+
+    def _store_registry(self, rooms):
+        self._registry = {
+            int(room["id_room_chat"]): {"room_name": room.get("room_name"), "area": room.get("area", "unknown")}
+            for room in rooms if room.get("id_room_chat") is not None
+        }
+        self._registry_loaded_at = time.monotonic()
+        logger.info(f"✅ Đã nạp registry phòng: {len(self._registry)} phòng.")
+
+    def load_registry(self):
+        """Nạp toàn bộ phòng vào registry (gọi khi bot khởi động). Lỗi thì giữ registry cũ."""
+        try:
+            self._store_registry(self.rooms_collection.find({}, {"_id": 0}))
+            return True
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi nạp registry phòng: {e}")
+            return False
+
+    async def load_registry_async(self):
+        try:
+            self._store_registry(await self.async_rooms_collection.find({}, {"_id": 0}).to_list(None))
+            return True
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi nạp registry phòng: {e}")
+            return False
+
+    def _ensure_registry(self):
+        # Nạp lại theo TTL để thấy thay đổi từ tiến trình khác
+        if self._registry_is_fresh():
+            return
+        with self._registry_lock:
+            if not self._registry_is_fresh():
+                self.load_registry()
+
+    async def _ensure_registry_async(self):
+        if self._registry_is_fresh():
+            return
+        if self._registry_async_lock is None:
+            self._registry_async_lock = asyncio.Lock()
+        async with self._registry_async_lock:
+            if not self._registry_is_fresh():
+                await self.load_registry_async()
+
+    def _register(self, id_room_chat, room_name, area_name):
+        self._registry[int(id_room_chat)] = {"room_name": room_name, "area": area_name}
+
+    def _unregister(self, id_room_chat):
+        self._registry.pop(int(id_room_chat), None)
+
+    def _rename(self, id_room_chat, new_room_name):
+        entry = self._registry.get(int(id_room_chat))
+        if entry:
+            entry["room_name"] = new_room_name
+
+    def _lookup(self, id_room_chat):
+        room_id = self._normalize_room_id(id_room_chat)
+        if room_id is None:
+            return None
+        entry = self._registry.get(int(room_id))
+        if entry is None:
+            return None
+        return {"id_room_chat": room_id, **entry}
+
+    def is_allowed_room(self, id_room_chat):
+        """Kiểm tra phòng có được duyệt hay không (tra registry, không log)."""
+        self._ensure_registry()
+        return self._lookup(id_room_chat) is not None
+
+    async def is_allowed_room_async(self, id_room_chat):
+        await self._ensure_registry_async()
+        return self._lookup(id_room_chat) is not None
+
+    @staticmethod
+    def _area_of(room_info, id_room_chat):
+        if not room_info:
+            logger.warning(f"⚠️ Không tìm thấy phòng với ID {id_room_chat}. Không thể xác định khu vực.")
+            return "unknown"
+        return room_info.get("area", "unknown")
 
     def add_room(self, id_room_chat, room_name, area_name):
         try:
@@ -31,6 +142,7 @@ class RoomManager:
                 "area": area_name  # Chỉ thêm bản ghi trong khu vực hiện tại
             }
             inserted_id = self.rooms_collection.insert_one(room_data).inserted_id
+            self._register(id_room_chat, room_name, area_name)
             logger.info(f"✅ Thêm phòng mới thành công: {id_room_chat} - {room_name}")
             return inserted_id
         except Exception as e:
@@ -46,6 +158,7 @@ class RoomManager:
             )
     
             if result.modified_count:
+                self._rename(id_room_chat, new_room_name)
                 logger.info(f"✅ Cập nhật phòng {id_room_chat} thành công: {new_room_name}")
             else:
                 logger.warning(f"⚠️ Không tìm thấy phòng {id_room_chat} hoặc không có thay đổi.")
@@ -59,6 +172,7 @@ class RoomManager:
         try:
             result = self.rooms_collection.delete_one({"id_room_chat": id_room_chat})
             if result.deleted_count:
+                self._unregister(id_room_chat)
                 logger.info(f"✅ Xoá phòng {id_room_chat} thành công.")
             else:
                 logger.warning(f"⚠️ Không tìm thấy phòng {id_room_chat}.")
@@ -90,28 +204,99 @@ class RoomManager:
     
         
     def get_room_by_id(self, id_room_chat):
+        """Lấy thông tin phòng từ registry trong bộ nhớ (không truy vấn MongoDB mỗi lần)."""
         try:
-            # Ép kiểu để đảm bảo trùng với MongoDB
-            if isinstance(id_room_chat, str):
-                try:
-                    id_room_chat = int(id_room_chat)
-                except ValueError:
-                    logger.error(f"❌ ID không hợp lệ (không thể chuyển sang int): {id_room_chat}")
-                    return None
-
-            query = {"id_room_chat": Int64(id_room_chat)}  # 👈 ép kiểu Int64
-            logger.debug(f"🔍 Truy vấn MongoDB với: {query}")
-
-            room = self.rooms_collection.find_one(query, {"_id": 0})
-            if room:
-                logger.info(f"✅ Tìm thấy phòng: {room}")
-                return room
-            else:
+            self._ensure_registry()
+            room = self._lookup(id_room_chat)
+            if room is None:
                 logger.warning(f"⚠️ Không tìm thấy phòng với ID {id_room_chat}.")
+            return room
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi lấy thông tin phòng: {e}")
+            return None
+
+    def get_area_by_room_id(self, id_room_chat):
+        """Lấy khu vực của phòng, trả về 'unknown' nếu không tìm thấy."""
+        return self._area_of(self.get_room_by_id(id_room_chat), id_room_chat)
+
+    # ===== API async (dùng trong handler của bot) =====
+
+    async def add_room_async(self, id_room_chat, room_name, area_name):
+        try:
+            if await self.async_rooms_collection.find_one({"id_room_chat": id_room_chat}):
+                logger.warning(f"⚠️ Phòng với ID {id_room_chat} đã tồn tại.")
                 return None
+
+            room_data = {
+                "id_room_chat": id_room_chat,
+                "room_name": room_name,
+                "area": area_name
+            }
+            result = await self.async_rooms_collection.insert_one(room_data)
+            self._register(id_room_chat, room_name, area_name)
+            logger.info(f"✅ Thêm phòng mới thành công: {id_room_chat} - {room_name}")
+            return result.inserted_id
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi thêm phòng: {e}")
+            return None
+
+    async def update_room_async(self, id_room_chat, new_room_name):
+        try:
+            result = await self.async_rooms_collection.update_one(
+                {"id_room_chat": id_room_chat},
+                {"$set": {"room_name": new_room_name}}
+            )
+            if result.modified_count:
+                self._rename(id_room_chat, new_room_name)
+                logger.info(f"✅ Cập nhật phòng {id_room_chat} thành công: {new_room_name}")
+            else:
+                logger.warning(f"⚠️ Không tìm thấy phòng {id_room_chat} hoặc không có thay đổi.")
+            return result.modified_count
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi cập nhật phòng: {e}")
+            return 0
+
+    async def delete_room_async(self, id_room_chat):
+        try:
+            result = await self.async_rooms_collection.delete_one({"id_room_chat": id_room_chat})
+            if result.deleted_count:
+                self._unregister(id_room_chat)
+                logger.info(f"✅ Xoá phòng {id_room_chat} thành công.")
+            else:
+                logger.warning(f"⚠️ Không tìm thấy phòng {id_room_chat}.")
+            return result.deleted_count
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi xoá phòng: {e}")
+            return 0
+
+    async def get_all_rooms_async(self):
+        try:
+            return await self.async_rooms_collection.find({}, {"_id": 0}).to_list(None)
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi lấy danh sách phòng: {e}")
+            return []
+
+    async def get_all_room_ids_async(self):
+        try:
+            room_ids = await self.async_rooms_collection.distinct("id_room_chat")
+            return [room_id for room_id in room_ids if room_id is not None]
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi lấy danh sách ID phòng: {e}")
+            return []
+
+    async def get_room_by_id_async(self, id_room_chat):
+        try:
+            await self._ensure_registry_async()
+            room = self._lookup(id_room_chat)
+            if room is None:
+                logger.warning(f"⚠️ Không tìm thấy phòng với ID {id_room_chat}.")
+            return room
         except Exception as e:
             logger.error(f"❌ Lỗi khi lấy thông tin phòng: {e}")
             return None
-    
-        
+
+    async def get_area_by_room_id_async(self, id_room_chat):
+        return self._area_of(await self.get_room_by_id_async(id_room_chat), id_room_chat)
+
+
 room_manager = RoomManager()
\ No newline at end of file
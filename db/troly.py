@@ -20,6 +20,10 @@ class AssistantManager:
         self.assistant_collection = mongo_manager.get_collection(collection_name)
         self.collection_name = collection_name
 
+    @property
+    def async_assistant_collection(self):
+        return mongo_manager.get_async_collection(self.collection_name)
+
     def switch_collection(self, new_collection):
         """Chuyển đổi collection trong khi chạy."""
         self.assistant_collection = self.db.client[config.DB_NAME][new_collection]
@@ -62,6 +66,19 @@ class AssistantManager:
             logger.error(f"❌ Lỗi khi lấy thông tin trợ lý: {e}")
             return None
         
+    def delete_assistant(self, id_tele):
+        """Xóa trợ lý theo ID Telegram."""
+        try:
+            result = self.assistant_collection.delete_one({"id_tele": id_tele})
+            if result.deleted_count:
+                logger.info(f"✅ Đã xóa trợ lý {id_tele}.")
+            else:
+                logger.warning(f"⚠️ Không tìm thấy trợ lý {id_tele}.")
+            return result.deleted_count
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi xóa trợ lý: {e}")
+            return 0
+
     def load_troly_ids(self):
         """
         Lấy danh sách ID của các trợ lý từ collection 'tro_ly'.
@@ -75,4 +92,58 @@ class AssistantManager:
             logger.error(f"❌ Lỗi khi lấy danh sách trợ lý từ tro_ly: {e}")
             return []
 
+    # ===== API async (dùng trong handler của bot) =====
+
+    async def add_assistant_async(self, id_tele, username, name):
+        try:
+            if await self.async_assistant_collection.find_one({"id_tele": id_tele}):
+                logger.warning(f"⚠️ Trợ lý với ID {id_tele} đã tồn tại.")
+                return None
+
+            assistant_data = {
+                "id_tele": id_tele,
+                "username": username,
+                "name": name
+            }
+            result = await self.async_assistant_collection.insert_one(assistant_data)
+            logger.info(f"✅ Thêm trợ lý mới thành công: {id_tele} - {username} - {name}")
+            return result.inserted_id
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi thêm trợ lý: {e}")
+            return None
+
+    async def get_all_assistants_async(self):
+        try:
+            return await self.async_assistant_collection.find({}, {"_id": 0}).to_list(None)
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi lấy danh sách trợ lý: {e}")
+            return []
+
+    async def get_assistant_by_id_async(self, id_tele):
+        try:
+            assistant = await self.async_assistant_collection.find_one({"id_tele": id_tele}, {"_id": 0})
+            return assistant or None
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi lấy thông tin trợ lý: {e}")
+            return None
+
+    async def delete_assistant_async(self, id_tele):
+        try:
+            result = await self.async_assistant_collection.delete_one({"id_tele": id_tele})
+            if result.deleted_count:
+                logger.info(f"✅ Đã xóa trợ lý {id_tele}.")
+            else:
+                logger.warning(f"⚠️ Không tìm thấy trợ lý {id_tele}.")
+            return result.deleted_count
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi xóa trợ lý: {e}")
+            return 0
+
+    async def load_troly_ids_async(self):
+        try:
+            return list(await self.async_assistant_collection.distinct("id_tele"))
+        except Exception as e:
+            logger.error(f"❌ Lỗi khi lấy danh sách trợ lý từ tro_ly: {e}")
+            return []
+
 assistant_manager = AssistantManager()
\ No newline at end of file
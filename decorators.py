@@ -6,12 +6,13 @@ from telegram.ext import CallbackContext
 from config import ADMIN_IDS
 import os
 import logging
-from db.rooms import RoomManager 
+from db.rooms import room_manager
 from db.troly import AssistantManager 
 from db.ads import ADSManager 
+from handlers.circuit_breaker import CircuitOpenError
+from handlers.ultils import safe_reply
 import time
 
-room_manager = RoomManager() 
 assistant_manager= AssistantManager()
 ads_manager= ADSManager()
 # Thiết lập logging
@@ -32,6 +33,20 @@ def cache_data(context: CallbackContext, key: str, load_function):
     return context.bot_data[key]["data"]
 
 
+async def cache_data_async(context: CallbackContext, key: str, load_coroutine):
+    """Giống `cache_data` nhưng nạp dữ liệu bằng hàm async để không chặn event loop."""
+    if key not in context.bot_data or not isinstance(context.bot_data[key], dict) or \
+            time.time() - context.bot_data[key].get("timestamp", 0) > CACHE_EXPIRATION:
+        data = await load_coroutine()
+        if isinstance(data, set):
+            data = list(data)
+        context.bot_data[key] = {"data": data, "timestamp": time.time()}
+        logging.info(f"🔄 Cache làm mới: key={key}, data={data}")
+    else:
+        logging.info(f"✅ Lấy từ cache: key={key}, data={context.bot_data[key]['data']}")
+    return context.bot_data[key]["data"]
+
+
 def troly_only(func):
     """Chỉ cho trợ lý hoặc admin sử dụng."""
     @wraps(func)
@@ -41,7 +56,7 @@ def troly_only(func):
            logger.info("Bỏ qua tin nhắn đã sửa.")
            return
         
-        troly_ids = cache_data(context, 'troly_ids', assistant_manager.load_troly_ids)
+        troly_ids = await cache_data_async(context, 'troly_ids', assistant_manager.load_troly_ids_async)
 
         if user_id not in troly_ids and user_id not in ADMIN_IDS:
             await send_no_permission(update)
@@ -57,7 +72,7 @@ def ads_only(func):
            logger.info("Bỏ qua tin nhắn đã sửa.")
            return
         user_id = update.effective_user.id
-        ads_ids = cache_data(context, 'ads_ids', ads_manager.load_ad_ids)
+        ads_ids = await cache_data_async(context, 'ads_ids', ads_manager.load_ad_ids_async)
 
         if user_id not in ads_ids and user_id not in ADMIN_IDS:
             await send_no_permission(update)
@@ -82,7 +97,7 @@ def ads_only_rp(func):
             return  # Dừng xử lý ngay nếu không có "/rp"
 
         user_id = update.effective_user.id
-        ads_ids = cache_data(context, 'ads_ids', ads_manager.load_ad_ids)
+        ads_ids = await cache_data_async(context, 'ads_ids', ads_manager.load_ad_ids_async)
 
         if user_id not in ads_ids and user_id not in ADMIN_IDS:
             await send_no_permission(update)
@@ -97,15 +112,10 @@ def allowed_room(func):
     @wraps(func)
     async def wrapped(update: Update, context: CallbackContext, *args, **kwargs):
         chat_id = update.effective_chat.id
-        allowed_rooms = cache_data(context, 'allowed_rooms', room_manager.get_all_room_ids)
 
-        # Nếu `allowed_rooms` không phải là danh sách, thì chuyển đổi
-        if not isinstance(allowed_rooms, list):
-            allowed_rooms = list(allowed_rooms) if isinstance(allowed_rooms, set) else [allowed_rooms]
-
-        if chat_id not in allowed_rooms:
-            logging.error(f"❌ Chat ID {chat_id} không có trong allowed_rooms: {allowed_rooms}")
-            await update.message.reply_text("Bot không hoạt động trong nhóm này.")
+        if not await room_manager.is_allowed_room_async(chat_id):
+            logging.error(f"❌ Chat ID {chat_id} không có trong danh sách phòng được duyệt.")
+            await safe_reply(context.bot, update.message, "Bot không hoạt động trong nhóm này.")
             return
 
         return await func(update, context, *args, **kwargs)
@@ -123,13 +133,28 @@ def admin_only(func):
         return await func(update, context, *args, **kwargs)
     return wrapped
 
+def backend_guard(func):
+    """Backend đang bị ngắt (circuit mở) → trả lời ngay thay vì để lỗi rơi vào error handler."""
+    @wraps(func)
+    async def wrapped(update: Update, context: CallbackContext, *args, **kwargs):
+        try:
+            return await func(update, context, *args, **kwargs)
+        except CircuitOpenError as e:
+            logger.warning(f"⛔ {func.__name__}: {e}")
+            try:
+                if update.effective_message:
+                    await safe_reply(context.bot, update.effective_message, e.user_message())
+            except Exception as reply_error:
+                logging.error(f"Lỗi khi báo backend gián đoạn: {reply_error}")
+    return wrapped
+
 async def send_no_permission(update: Update):
     """Gửi thông báo không có quyền."""
     try:
         if update.callback_query:
             await update.callback_query.answer("Bạn không có quyền thực hiện hành động này.", show_alert=True)
         elif update.message:
-            await update.message.reply_text("❌ Bạn không có quyền thực hiện hành động này.")
+            await safe_reply(update.get_bot(), update.message, "❌ Bạn không có quyền thực hiện hành động này.")
     except Exception as e:
         logging.error(f"Lỗi khi gửi phản hồi quyền hạn: {e}")
         
@@ -152,8 +177,8 @@ def ads_or_troly_rp(func):
         user_id = update.effective_user.id
 
         # Lấy danh sách từ cache
-        troly_ids = cache_data(context, 'troly_ids', assistant_manager.load_troly_ids)
-        ads_ids = cache_data(context, 'ads_ids', ads_manager.load_ad_ids)
+        troly_ids = await cache_data_async(context, 'troly_ids', assistant_manager.load_troly_ids_async)
+        ads_ids = await cache_data_async(context, 'ads_ids', ads_manager.load_ad_ids_async)
 
         # Kiểm tra quyền (OR logic)
         if (
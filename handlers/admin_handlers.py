@@ -8,6 +8,15 @@ from telegram.ext import CallbackContext, CommandHandler, CallbackQueryHandler
 from db.rooms import room_manager
 from db.troly import assistant_manager
 from db.ads import ads_manager
+from db.indexes import index_manager
+from db.budget import budget_manager
+from db.reference_cache import reference_cache
+from handlers.user_check_cache import user_check_cache
+from handlers.kpi_lookup import kpi_lookup
+from handlers.callback_store import callback_store
+from handlers.api_client import api_client
+from handlers.send_scheduler import send_scheduler
+from handlers.ultils import safe_reply, safe_edit_message
 
 # Thiết lập logging
 logger = logging.getLogger(__name__)
@@ -22,13 +31,13 @@ async def add_room(update: Update, context: CallbackContext):
     group_name = chat.title
 
     if chat.type not in ['group', 'supergroup']:
-        await update.message.reply_text("⚠️ Lệnh này chỉ dùng được trong nhóm hoặc supergroup.")
+        await safe_reply(context.bot, update.message, "⚠️ Lệnh này chỉ dùng được trong nhóm hoặc supergroup.")
         return
 
     # Kiểm tra nhóm đã tồn tại chưa
-    existing_room = room_manager.get_room_by_id(chat_id)
+    existing_room = await room_manager.get_room_by_id_async(chat_id)
     if existing_room:
-        await update.message.reply_text("❗ Nhóm này đã tồn tại trong danh sách.")
+        await safe_reply(context.bot, update.message, "❗ Nhóm này đã tồn tại trong danh sách.")
         return
 
     # Lưu thông tin nhóm tạm vào context để callback query xử lý
@@ -56,7 +65,7 @@ async def add_room(update: Update, context: CallbackContext):
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await update.message.reply_text("🏗️ Vui lòng chọn khu vực cho nhóm này:", reply_markup=reply_markup)
+    await safe_reply(context.bot, update.message, "🏗️ Vui lòng chọn khu vực cho nhóm này:", reply_markup=reply_markup)
 
 
 # === HÀM XỬ LÝ KHI NGƯỜI DÙNG CHỌN KHU VỰC ===
@@ -66,31 +75,32 @@ async def add_room_area_callback(update: Update, context: CallbackContext):
 
     data = query.data.split("|")
     if len(data) != 2:
-        await query.edit_message_text("❌ Dữ liệu callback không hợp lệ.")
+        await safe_edit_message(context.bot, query.message.chat.id, query.message.message_id, "❌ Dữ liệu callback không hợp lệ.")
         return
 
     area_name = data[1]  # ví dụ: khu_a, khu_b, ...
 
     pending = context.user_data.get("pending_add_room")
     if not pending:
-        await query.edit_message_text("⚠️ Không có nhóm nào đang chờ được thêm.")
+        await safe_edit_message(context.bot, query.message.chat.id, query.message.message_id, "⚠️ Không có nhóm nào đang chờ được thêm.")
         return
 
     chat_id = pending["chat_id"]
     group_name = pending["group_name"]
 
     # Gọi hàm add_room trong room_manager (thêm vào DB)
-    result = room_manager.add_room(chat_id, group_name, area_name)
+    result = await room_manager.add_room_async(chat_id, group_name, area_name)
 
     if result:
-        await query.edit_message_text(
+        await safe_edit_message(
+            context.bot, query.message.chat.id, query.message.message_id,
             f"✅ Đã thêm nhóm **{group_name}** (ID: `{chat_id}`)\n"
             f"📍 Khu vực: *{area_name.replace('_', ' ').title()}*",
             parse_mode="Markdown"
         )
         logger.info(f"Thêm nhóm thành công: {group_name} - {chat_id} - {area_name}")
     else:
-        await query.edit_message_text("❌ Lỗi khi thêm nhóm vào cơ sở dữ liệu.")
+        await safe_edit_message(context.bot, query.message.chat.id, query.message.message_id, "❌ Lỗi khi thêm nhóm vào cơ sở dữ liệu.")
 
     # Dọn dẹp dữ liệu tạm
     context.user_data.pop("pending_add_room", None)
@@ -104,68 +114,36 @@ async def remove_room(update: Update, context: CallbackContext):
     try:
         args = context.args
         if len(args) != 1:
-            await update.message.reply_text("Sử dụng: /removeroom <chat_id>")
+            await safe_reply(context.bot, update.message, "Sử dụng: /removeroom <chat_id>")
             return
 
         chat_id_str = args[0]
         if not (chat_id_str.startswith('-') and chat_id_str[1:].isdigit()):
-            await update.message.reply_text("❌ chat_id không hợp lệ. Đảm bảo rằng nó bắt đầu bằng '-' và chỉ chứa số.")
+            await safe_reply(context.bot, update.message, "❌ chat_id không hợp lệ. Đảm bảo rằng nó bắt đầu bằng '-' và chỉ chứa số.")
             return
 
         chat_id = int(chat_id_str)
 
         # Kiểm tra xem nhóm có tồn tại không
-        existing_room = room_manager.get_room_by_id(chat_id)
+        existing_room = await room_manager.get_room_by_id_async(chat_id)
         if not existing_room:
-            await update.message.reply_text("❌ Không tìm thấy nhóm với chat_id này.")
+            await safe_reply(context.bot, update.message, "❌ Không tìm thấy nhóm với chat_id này.")
             return
 
         group_name = existing_room.get("room_name", "Unknown")
 
         # Xóa nhóm khỏi database
-        delete_result = room_manager.delete_room(chat_id)
+        delete_result = await room_manager.delete_room_async(chat_id)
         if delete_result:
-            await update.message.reply_text(f"✅ Đã xóa nhóm:\nID: {chat_id}\nTên: {group_name}")
+            await safe_reply(context.bot, update.message, f"✅ Đã xóa nhóm:\nID: {chat_id}\nTên: {group_name}")
             logger.info(f"Xóa nhóm thành công: ID={chat_id}, Tên={group_name}")
-
-            # Cập nhật cache nếu có (hỗ trợ list, set, dict)
-            if 'allowed_rooms' in context.bot_data:
-                ar = context.bot_data['allowed_rooms']
-                try:
-                    if isinstance(ar, list):
-                        # giữ an toàn nếu không tồn tại trong list
-                        if chat_id in ar:
-                            ar.remove(chat_id)
-                            logger.debug(f"Đã remove chat_id={chat_id} khỏi allowed_rooms (list).")
-                        else:
-                            logger.debug(f"chat_id={chat_id} không có trong allowed_rooms (list).")
-                    elif isinstance(ar, set):
-                        ar.discard(chat_id)
-                        logger.debug(f"Đã discard chat_id={chat_id} khỏi allowed_rooms (set).")
-                    elif isinstance(ar, dict):
-                        # nếu dict mapping id -> info, xóa key
-                        if chat_id in ar:
-                            del ar[chat_id]
-                            logger.debug(f"Đã xóa key chat_id={chat_id} khỏi allowed_rooms (dict).")
-                        else:
-                            # có thể dict lưu string keys
-                            str_id = str(chat_id)
-                            if str_id in ar:
-                                del ar[str_id]
-                                logger.debug(f"Đã xóa key '{str_id}' khỏi allowed_rooms (dict).")
-                            else:
-                                logger.debug(f"chat_id={chat_id} không tìm thấy trong allowed_rooms (dict).")
-                    else:
-                        logger.warning(f"Không biết kiểu allowed_rooms: {type(ar)}; không cập nhật cache.")
-                except Exception as e:
-                    logger.error(f"Lỗi khi cập nhật cache allowed_rooms: {e}")
         else:
-            await update.message.reply_text("❌ Lỗi khi xóa nhóm khỏi database.")
+            await safe_reply(context.bot, update.message, "❌ Lỗi khi xóa nhóm khỏi database.")
             logger.error(f"Lỗi khi xóa nhóm: ID={chat_id}, Tên={group_name}")
 
     except Exception as e:
         logger.error(f"Lỗi trong hàm remove_room: {e}", exc_info=True)
-        await update.message.reply_text(f"❌ Lỗi: {e}")
+        await safe_reply(context.bot, update.message, f"❌ Lỗi: {e}")
 
 
 
@@ -174,10 +152,10 @@ async def remove_room(update: Update, context: CallbackContext):
 async def list_rooms(update: Update, context: CallbackContext):
     """Handler cho lệnh /listrooms để hiển thị danh sách các nhóm được phép"""
     try:
-        rooms = room_manager.get_all_rooms()  # Lấy danh sách từ database
+        rooms = await room_manager.get_all_rooms_async()  # Lấy danh sách từ database
         
         if not rooms:
-            await update.message.reply_text("❌ Hiện không có nhóm nào được phép.")
+            await safe_reply(context.bot, update.message, "❌ Hiện không có nhóm nào được phép.")
             return
 
         # Tạo danh sách hiển thị
@@ -187,12 +165,12 @@ async def list_rooms(update: Update, context: CallbackContext):
             group_name = room.get("room_name", "Không xác định")
             message += f"- *ID:* `{chat_id}`  |  *Tên:* {group_name}\n"
 
-        await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+        await safe_reply(context.bot, update.message, message, parse_mode=ParseMode.MARKDOWN)
         logger.info("Đã liệt kê danh sách rooms.")
         
     except Exception as e:
         logger.error(f"Lỗi trong hàm list_rooms: {e}")
-        await update.message.reply_text(f"❌ Lỗi: {e}")
+        await safe_reply(context.bot, update.message, f"❌ Lỗi: {e}")
 
 @decorators.admin_only
 async def add_troly(update: Update, context: CallbackContext):
@@ -200,12 +178,12 @@ async def add_troly(update: Update, context: CallbackContext):
     try:
         args = context.args
         if len(args) < 2:
-            await update.message.reply_text("Sử dụng: /addtroly <ID> [@username] <Tên Tele>")
+            await safe_reply(context.bot, update.message, "Sử dụng: /addtroly <ID> [@username] <Tên Tele>")
             return
 
         troly_id = args[0]
         if not troly_id.isdigit():
-            await update.message.reply_text("❌ ID phải là số.")
+            await safe_reply(context.bot, update.message, "❌ ID phải là số.")
             return
         troly_id = int(troly_id)
 
@@ -217,23 +195,23 @@ async def add_troly(update: Update, context: CallbackContext):
             tele_name = ' '.join(args[1:]) if len(args) > 1 else ''
 
         # Kiểm tra xem trợ lý đã tồn tại chưa
-        existing_troly = assistant_manager.get_assistant_by_id(troly_id)
+        existing_troly = await assistant_manager.get_assistant_by_id_async(troly_id)
         if existing_troly:
-            await update.message.reply_text("❌ Trợ lý với ID này đã tồn tại.")
+            await safe_reply(context.bot, update.message, "❌ Trợ lý với ID này đã tồn tại.")
             return
 
         # Thêm trợ lý vào database
-        result = assistant_manager.add_assistant(troly_id, username, tele_name)
+        result = await assistant_manager.add_assistant_async(troly_id, username, tele_name)
         if result:
-            await update.message.reply_text("✅ Thêm trợ lý thành công.")
+            await safe_reply(context.bot, update.message, "✅ Thêm trợ lý thành công.")
             logger.info(f"Thêm trợ lý mới: ID={troly_id}, Username={username}, Tên Tele={tele_name}")
         else:
-            await update.message.reply_text("❌ Lỗi khi thêm trợ lý vào database.")
+            await safe_reply(context.bot, update.message, "❌ Lỗi khi thêm trợ lý vào database.")
             logger.error(f"Lỗi khi thêm trợ lý: ID={troly_id}, Username={username}, Tên Tele={tele_name}")
 
     except Exception as e:
         logger.error(f"❌ Lỗi trong hàm add_troly: {e}")
-        await update.message.reply_text(f"❌ Lỗi: {e}")
+        await safe_reply(context.bot, update.message, f"❌ Lỗi: {e}")
 
 @decorators.admin_only
 async def remove_troly(update: Update, context: CallbackContext):
@@ -241,41 +219,176 @@ async def remove_troly(update: Update, context: CallbackContext):
     try:
         args = context.args
         if len(args) != 1:
-            await update.message.reply_text("Sử dụng: /removetroly <ID>")
+            await safe_reply(context.bot, update.message, "Sử dụng: /removetroly <ID>")
             return
 
         troly_id = args[0]
         if not troly_id.isdigit():
-            await update.message.reply_text("❌ ID phải là số.")
+            await safe_reply(context.bot, update.message, "❌ ID phải là số.")
             return
         troly_id = int(troly_id)
 
         # Kiểm tra xem trợ lý có tồn tại không
-        existing_troly = assistant_manager.get_assistant_by_id(troly_id)
+        existing_troly = await assistant_manager.get_assistant_by_id_async(troly_id)
         if not existing_troly:
-            await update.message.reply_text("❌ Trợ lý với ID này không tồn tại.")
+            await safe_reply(context.bot, update.message, "❌ Trợ lý với ID này không tồn tại.")
             return
 
         # Xóa trợ lý khỏi database
-        delete_result = assistant_manager.delete_assistant(troly_id)
+        delete_result = await assistant_manager.delete_assistant_async(troly_id)
         if delete_result:
-            await update.message.reply_text("✅ Xóa trợ lý thành công.")
+            await safe_reply(context.bot, update.message, "✅ Xóa trợ lý thành công.")
             logger.info(f"Xóa trợ lý: ID={troly_id}")
         else:
-            await update.message.reply_text("❌ Lỗi khi xóa trợ lý khỏi database.")
+            await safe_reply(context.bot, update.message, "❌ Lỗi khi xóa trợ lý khỏi database.")
             logger.error(f"Lỗi khi xóa trợ lý: ID={troly_id}")
 
     except Exception as e:
         logger.error(f"❌ Lỗi trong hàm remove_troly: {e}")
-        await update.message.reply_text(f"❌ Lỗi: {e}")
+        await safe_reply(context.bot, update.message, f"❌ Lỗi: {e}")
+
+@decorators.admin_only
+async def check_indexes(update: Update, context: CallbackContext):
+    """Chạy explain() cho các truy vấn nóng và báo các truy vấn bị COLLSCAN"""
+    try:
+        reports = await index_manager.explain_hot_queries_async()
+
+        message = "<b>📌 Kiểm tra index (explain):</b>\n"
+        for report in reports:
+            if "error" in report:
+                message += f"⚠️ {report['name']} (<code>{report['collection']}</code>): {report['error']}\n"
+                continue
+            flag = "❌ COLLSCAN" if report["collscan"] else "✅"
+            message += f"{flag} {report['name']} (<code>{report['collection']}</code>): {' &gt; '.join(report['stages'])}\n"
+
+        await safe_reply(context.bot, update.message, message, parse_mode=ParseMode.HTML)
+        logger.info("Đã kiểm tra index các truy vấn nóng.")
+
+    except Exception as e:
+        logger.error(f"❌ Lỗi trong hàm check_indexes: {e}")
+        await safe_reply(context.bot, update.message, f"❌ Lỗi: {e}")
+
+@decorators.admin_only
+async def rebuild_rollup(update: Update, context: CallbackContext):
+    """
+    Tính lại bảng tổng hợp ngân sách theo tháng từ dữ liệu gốc — cách sửa khi tổng ngân sách bị lệch.
+    Nên chạy lúc ít giao dịch; phần cộng bị `$out` ghi đè trong lúc chạy được job đối chiếu định kỳ sửa lại.
+    """
+    try:
+        count = await budget_manager.rebuild_rollup_async()
+        if count is None:
+            await safe_reply(context.bot, update.message, "❌ Không thể tính lại bảng tổng hợp ngân sách.")
+            return
+
+        await safe_reply(
+            context.bot, update.message,
+            f"✅ Đã tính lại bảng tổng hợp ngân sách: {count} dòng.\n"
+            f"Giao dịch ghi trong lúc tính lại sẽ được đối chiếu lại tự động."
+        )
+        logger.info(f"Đã tính lại bảng tổng hợp ngân sách ({count} dòng).")
+
+    except Exception as e:
+        logger.error(f"❌ Lỗi trong hàm rebuild_rollup: {e}")
+        await safe_reply(context.bot, update.message, f"❌ Lỗi: {e}")
+
+@decorators.admin_only
+async def reload_reference(update: Update, context: CallbackContext):
+    """Nạp lại cache budget_limits và ignored_contracts sau khi sửa trực tiếp trên MongoDB"""
+    try:
+        reference_cache.invalidate()
+        if not await reference_cache.refresh_async():
+            await safe_reply(context.bot, update.message, "❌ Không thể nạp lại dữ liệu tham chiếu.")
+            return
+
+        await safe_reply(context.bot, update.message, "✅ Đã nạp lại giới hạn ngân sách và danh sách mã bỏ qua.")
+        logger.info("Đã nạp lại cache tham chiếu.")
+
+    except Exception as e:
+        logger.error(f"❌ Lỗi trong hàm reload_reference: {e}")
+        await safe_reply(context.bot, update.message, f"❌ Lỗi: {e}")
+
+@decorators.admin_only
+async def check_cache_stats(update: Update, context: CallbackContext):
+    """Thống kê cache kiểm tra user TikTok/Facebook; `/checkcache clear` để xóa cache"""
+    try:
+        if context.args and context.args[0].lower() == "clear":
+            user_check_cache.clear()
+            await safe_reply(context.bot, update.message, "✅ Đã xóa cache kiểm tra TikTok/Facebook.")
+            return
+
+        stats = user_check_cache.stats()
+        message = "<b>📊 Cache kiểm tra user:</b>\n"
+        if not stats:
+            message += "- Chưa có dữ liệu.\n"
+        for platform, item in stats.items():
+            message += (
+                f"- <b>{platform}</b>: {item['size']} UID | hit {item['hits']} / miss {item['misses']} "
+                f"({item['hit_rate']:.0%}) | đã xóa {item['invalidated']}\n"
+            )
+
+        kpi = kpi_lookup.stats()
+        message += (
+            f"\n<b>📊 /xn (agency KPI):</b>\n"
+            f"- request {kpi['requests']} | cache hit {kpi['hits']} | dùng chung {kpi['coalesced']} "
+            f"| ghi DB {kpi['writes']} | đang cache {kpi['cached']}\n"
+        )
+
+        pending = callback_store.stats()
+        message += (
+            f"\n<b>📊 Kết quả chờ bấm lưu (/tiktok, /facebook):</b>\n"
+            f"- đang giữ {pending['size']} ({pending['bytes'] / 1024:.0f} KB) | đã lưu {pending['stored']} "
+            f"| đã xử lý {pending['claimed']} | hết hạn {pending['expired']} | bị đẩy ra {pending['evicted']} "
+            f"| không tìm thấy {pending['missing']}\n"
+        )
+
+        await safe_reply(context.bot, update.message, message, parse_mode=ParseMode.HTML)
+
+    except Exception as e:
+        logger.error(f"❌ Lỗi trong hàm check_cache_stats: {e}")
+        await safe_reply(context.bot, update.message, f"❌ Lỗi: {e}")
+
+@decorators.admin_only
+async def breaker_status(update: Update, context: CallbackContext):
+    """Trạng thái circuit breaker của backend API; `/breaker reset` để đóng lại ngay"""
+    try:
+        breaker = api_client.breaker
+        if context.args and context.args[0].lower() == "reset":
+            breaker.reset()
+            logger.info("Admin đã reset circuit breaker backend.")
+
+        item = breaker.snapshot()
+        icon = {"closed": "🟢", "half_open": "🟡", "open": "🔴"}.get(item["state"], "⚪")
+        message = (
+            f"<b>{icon} Circuit breaker '{item['name']}': {item['state']}</b>\n"
+            f"- Lần gọi trong cửa sổ: {item['calls']}\n"
+            f"- Tỷ lệ lỗi: {item['failure_rate']:.0%} | chậm: {item['slow_rate']:.0%}\n"
+            f"- Độ trễ p50: {item['p50']:.2f}s | p95: {item['p95']:.2f}s\n"
+            f"- Số lần mở: {item['times_opened']}\n"
+        )
+        if item["state"] == "open":
+            message += f"- Thử lại sau: {item['retry_after']:.0f}s\n"
+
+        sends = send_scheduler.stats()
+        message += (
+            f"\n<b>📤 Hàng đợi gửi Telegram:</b>\n"
+            f"- Đã gửi {sends['sent']} | đang chờ {sends['queued']} | đang gửi {sends['inflight']}\n"
+            f"- RetryAfter {sends['retry_after']} | thử lại {sends['retried']} | lỗi {sends['failed']} "
+            f"| chat đang bị chặn {sends['blocked_chats']}\n"
+        )
+
+        await safe_reply(context.bot, update.message, message, parse_mode=ParseMode.HTML)
+
+    except Exception as e:
+        logger.error(f"❌ Lỗi trong hàm breaker_status: {e}")
+        await safe_reply(context.bot, update.message, f"❌ Lỗi: {e}")
 
 @decorators.admin_only
 async def list_troly(update: Update, context: CallbackContext):
     """Liệt kê danh sách trợ lý"""
     try:
-        troly_list = assistant_manager.get_all_assistants()
+        troly_list = await assistant_manager.get_all_assistants_async()
         if not troly_list:
-            await update.message.reply_text("❌ Chưa có trợ lý nào.")
+            await safe_reply(context.bot, update.message, "❌ Chưa có trợ lý nào.")
             return
 
         message = "*📌 Danh sách trợ lý:*\n"
@@ -287,17 +400,17 @@ async def list_troly(update: Update, context: CallbackContext):
                 msg += f"  |  *Tên Tele:* {t['name']}"
             message += msg + "\n"
 
-        await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+        await safe_reply(context.bot, update.message, message, parse_mode=ParseMode.MARKDOWN)
         logger.info("Đã liệt kê danh sách trợ lý.")
 
     except Exception as e:
         logger.error(f"❌ Lỗi trong hàm list_troly: {e}")
-        await update.message.reply_text(f"❌ Lỗi: {e}")
+        await safe_reply(context.bot, update.message, f"❌ Lỗi: {e}")
     """Liệt kê danh sách quảng cáo (dùng HTML)"""
     try:
-        ad_list = ads_manager.get_all_ads()
+        ad_list = await ads_manager.get_all_ads_async()
         if not ad_list:
-            await update.message.reply_text("❌ Chưa có quảng cáo nào.")
+            await safe_reply(context.bot, update.message, "❌ Chưa có quảng cáo nào.")
             return
 
         # Thay vì Markdown, ta sử dụng thẻ HTML
@@ -320,7 +433,8 @@ async def list_troly(update: Update, context: CallbackContext):
             message += msg + "\n"
 
         # Gửi tin nhắn với parse_mode=ParseMode.HTML
-        await update.message.reply_text(
+        await safe_reply(
+            context.bot, update.message,
             text=message,
             parse_mode=ParseMode.HTML
         )
@@ -328,4 +442,4 @@ async def list_troly(update: Update, context: CallbackContext):
 
     except Exception as e:
         logger.error(f"❌ Lỗi trong hàm list_ads: {e}")
-        await update.message.reply_text(f"❌ Lỗi: {e}")
\ No newline at end of file
+        await safe_reply(context.bot, update.message, f"❌ Lỗi: {e}")
\ No newline at end of file
@@ -1,4 +1,3 @@
-import re
 import decorators
 import logging
 from db.ads_report import ads_reports_manager, hold_manager, nap_tien_manager
@@ -10,15 +9,17 @@ from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import CallbackQueryHandler
 from decorators import troly_only
 import uuid
-from handlers.db_helpers import add_pending_rp, get_pending_rp, delete_pending_rp, add_pending_hold, get_pending_hold, delete_pending_hold, add_pending_naptien, get_pending_naptien, delete_pending_naptien
+from dataclasses import asdict
+from handlers.pending_codec import RpRecord, HoldRecord, NaptienRecord
+from handlers.form_parser import RP_FORM, HOLD_FORM, NAPTIEN_FORM
+from handlers.ultils import safe_reply, safe_edit_message
+from handlers.db_helpers import add_pending_rp, claim_pending_rp, delete_pending_rp, add_pending_hold, claim_pending_hold, delete_pending_hold, add_pending_naptien, get_pending_naptien, claim_pending_naptien
 
 logger = logging.getLogger(__name__)
 # pending_rp_data = {}
 # pending_hold_data = {}
 # pending_naptien_data = {}
 
-import re
-
 def format_tele(user) -> str:
     """Ưu tiên fullname, rơi về id nếu không có."""
     if user.first_name or user.last_name:
@@ -27,79 +28,6 @@ def format_tele(user) -> str:
     return f"id_{user.id}"
 
 
-def clean_and_parse_text(text):
-    """Làm sạch dữ liệu và trích xuất thông tin"""
-    patterns = {
-        # Bỏ date và ad_type ra khỏi patterns vì không còn lấy từ input
-        "ad_ids": r"id\s*:\s*([\d, ]+)",  
-        "spend": r"chi tiêu\s*:\s*([\d,.]+)",  
-        "hold": r"hold\s*:\s*([\d,.]+)",  
-        "mess_num": r"số mess\s*:\s*([\d,.]+)",  
-        "id_bc": r"ID BC\s*:\s*(\S+)",
-        "note": r"note\s*:\s*(.+)",  # Nếu có ghi chú
-    }
-
-    data = {
-        "ad_ids": [],
-        "spend": None,
-        "hold": 0,
-        "note": None,
-        "mess_num": None,
-        "id_bc": None
-    }
-    lines = text.split("\n")
-
-    for line in lines:
-        line = line.strip()
-        for key, pattern in patterns.items():
-            match = re.search(pattern, line, re.IGNORECASE)
-            if match:
-                value = match.group(1).strip()
-                if key == "ad_ids":
-                    data[key] = [id_.strip() for id_ in value.split(",") if id_.strip().isdigit()]
-                elif key in ["spend", "hold", "mess_num"]:
-                    spend_clean = re.sub(r"[^\d]", "", value)
-                    data[key] = int(spend_clean) if spend_clean.isdigit() else None
-                else:
-                    data[key] = value
-    return data
-
-
-def parse_hold_text(text: str):
-    """Parse dữ liệu từ /hold"""
-    data = {"id_bc": None, "hold": None}
-
-    id_match = re.search(r"ID BC\s*:\s*(\S+)", text, re.IGNORECASE)
-    hold_match = re.search(r"Số tiền\s*:\s*([\d,.]+)", text, re.IGNORECASE)
-
-    if id_match:
-        data["id_bc"] = id_match.group(1).strip()
-    if hold_match:
-        clean = re.sub(r"[^\d]", "", hold_match.group(1))
-        data["hold"] = int(clean) if clean else None
-
-    return data
-
-
-def parse_naptien_text(text: str):
-    """Parse dữ liệu từ /naptien"""
-    data = {"id_bc": None, "so_tien_nap": None, "ads": None}
-
-    id_match = re.search(r"ID BC\s*:\s*(\S+)", text, re.IGNORECASE)
-    nap_match = re.search(r"Số tiền nạp\s*:\s*([\d,.]+)", text, re.IGNORECASE)
-    ads_match = re.search(r"ADS\s*:\s*@?(\S+)", text, re.IGNORECASE)
-
-    if id_match:
-        data["id_bc"] = id_match.group(1).strip()
-    if nap_match:
-        clean = re.sub(r"[^\d]", "", nap_match.group(1))
-        data["so_tien_nap"] = int(clean) if clean else None
-    if ads_match:
-        data["ads"] = ads_match.group(1).strip()
-
-    return data
-
-
 async def handle_rp_command(message):
     """Xử lý lệnh /rp và yêu cầu xác nhận trước khi lưu"""
     user = message.from_user
@@ -107,10 +35,11 @@ async def handle_rp_command(message):
     text = message.caption if (message.video or message.photo or message.document) else message.text
 
     if not text:
-        await message.reply_text("⚠ Vui lòng nhập nội dung báo cáo kèm theo lệnh /rp!")
+        await safe_reply(message.get_bot(), message, "⚠ Vui lòng nhập nội dung báo cáo kèm theo lệnh /rp!")
         return
 
-    parsed_data = clean_and_parse_text(text)
+    result = RP_FORM.parse(text)
+    parsed_data = result.values
 
     # Tạo ad_date = hôm nay - 1 ngày (dd/mm)
     yesterday = datetime.now() - timedelta(days=1)
@@ -120,16 +49,17 @@ async def handle_rp_command(message):
     ad_type = "Tiktok" if parsed_data["id_bc"] else "Facebook"
 
     # Kiểm tra trường bắt buộc (trừ date, ad_type)
-    missing_fields = []
-    if not parsed_data["ad_ids"]:
-        missing_fields.append("ID Quảng Cáo")
-    if not parsed_data["spend"]:
-        missing_fields.append("Chi Tiêu")
-
-    if missing_fields:
-        error_message = "❌ Lỗi: Các trường sau đang bị thiếu:\n"
-        error_message += "\n".join([f"- {field}" for field in missing_fields])
-        await message.reply_text(error_message)
+    if not result.ok:
+        error_message = ""
+        if result.missing:
+            error_message += "❌ Lỗi: Các trường sau đang bị thiếu:\n"
+            error_message += "\n".join([f"- {field}" for field in result.missing])
+        if result.invalid:
+            if error_message:
+                error_message += "\n"
+            error_message += "❌ Lỗi: Các trường sau không hợp lệ:\n"
+            error_message += "\n".join([f"- {label}: {raw}" for label, raw, _ in result.invalid])
+        await safe_reply(message.get_bot(), message, error_message)
         return
 
     # Lưu tạm dữ liệu
@@ -148,21 +78,19 @@ async def handle_rp_command(message):
     #     "id_bc": parsed_data["id_bc"],
     # }
     
-    add_pending_rp(temp_id, {
-        "ad_ids": parsed_data["ad_ids"],
-        "spend": parsed_data["spend"],
-        "ad_type": ad_type,
-        "note": parsed_data["note"],
-        "group_name": chat.title if chat.title else "Private",
-        "group_id": chat.id,
-        "sender": f"{user.full_name} (@{user.username})" if user.username else user.full_name,
-        "ad_date": ad_date,
-        "hold": parsed_data["hold"],
-        "mess_num": parsed_data["mess_num"],
-        "id_bc": parsed_data["id_bc"],
-        },
-        datetime.now(timezone.utc).timestamp() 
-    )
+    await add_pending_rp(temp_id, RpRecord(
+        ad_ids=parsed_data["ad_ids"],
+        spend=parsed_data["spend"],
+        ad_type=ad_type,
+        note=parsed_data["note"],
+        group_name=chat.title if chat.title else "Private",
+        group_id=chat.id,
+        sender=f"{user.full_name} (@{user.username})" if user.username else user.full_name,
+        ad_date=ad_date,
+        hold=parsed_data["hold"],
+        mess_num=parsed_data["mess_num"],
+        id_bc=parsed_data["id_bc"],
+    ))
 
     # Tạo tin nhắn xác nhận
     lines = [
@@ -191,28 +119,29 @@ async def handle_rp_command(message):
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await message.reply_text(confirm_text, parse_mode="Markdown", reply_markup=reply_markup)
+    await safe_reply(message.get_bot(), message, confirm_text, parse_mode="Markdown", reply_markup=reply_markup)
 
 
 @decorators.troly_only
 async def check_record(update: Update, context: CallbackContext):
     """Lệnh /check để kiểm tra bản ghi theo ID"""
     if len(context.args) == 0:
-        await update.message.reply_text("⚠ Vui lòng nhập ID bản ghi để kiểm tra!", parse_mode="Markdown")
+        await safe_reply(context.bot, update.message, "⚠ Vui lòng nhập ID bản ghi để kiểm tra!", parse_mode="Markdown")
         return
 
     record_id = context.args[0]
-    record = ads_reports_manager.get_report_by_id(record_id)
+    record = await ads_reports_manager.get_report_by_id_async(record_id)
 
     if not record:
-        await update.message.reply_text("❌ Không tìm thấy bản ghi với ID này!")
+        await safe_reply(context.bot, update.message, "❌ Không tìm thấy bản ghi với ID này!")
         return
 
     dt_vn = datetime.fromtimestamp(record["timestamp"], tz=timezone(timedelta(hours=7)))
     formatted_time = dt_vn.strftime("%H:%M %d/%m/%Y")
 
     formatted_spend = f"{record['spend']:,}".replace(",", ".")
-    await update.message.reply_text(
+    await safe_reply(
+        context.bot, update.message,
         f"📌 **Chi tiết bản ghi:**\n🆔 **ID Quảng Cáo:** {', '.join(record['ad_ids'])}\n"
         f"💰 **Chi tiêu:** {formatted_spend}\n📅 **Thời gian:** {formatted_time}\n",
         parse_mode="Markdown"
@@ -226,7 +155,8 @@ async def delete_record(update: Update, context: CallbackContext):
     admin_name = f"{user.full_name} (@{user.username})" if user.username else user.full_name
 
     if len(context.args) == 0:
-        await update.message.reply_text(
+        await safe_reply(
+            context.bot, update.message,
             "⚠ Vui lòng nhập ID bản ghi để xóa! Ví dụ: `/delete 65dc7f9a2c9c1a00124a63b5`",
             parse_mode="Markdown"
         )
@@ -238,22 +168,22 @@ async def delete_record(update: Update, context: CallbackContext):
     try:
         object_id = ObjectId(record_id)
     except Exception:
-        await update.message.reply_text("❌ ID bản ghi không hợp lệ! Vui lòng kiểm tra lại.")
+        await safe_reply(context.bot, update.message, "❌ ID bản ghi không hợp lệ! Vui lòng kiểm tra lại.")
         return
 
     # Gọi hàm xóa bản ghi
-    response = ads_reports_manager.delete_report(object_id)
+    response = await ads_reports_manager.delete_report_async(object_id)
 
     # Nếu không tìm thấy bản ghi để xóa
     if "Không tìm thấy" in response:
-        await update.message.reply_text(response, parse_mode="Markdown")
+        await safe_reply(context.bot, update.message, response, parse_mode="Markdown")
         return
 
     # Ghi log vào MongoDB
     logger.info(f"🗑 ADMIN đã xóa bản ghi:\n👤 Người xóa: {admin_name}\n🆔 ID bản ghi: {record_id}")
 
     # Gửi phản hồi về Telegram
-    await update.message.reply_text(response, parse_mode="Markdown")
+    await safe_reply(context.bot, update.message, response, parse_mode="Markdown")
 
 @troly_only 
 async def handle_rp_callback(update, context):
@@ -264,40 +194,42 @@ async def handle_rp_callback(update, context):
 
     if action == "rp_yes":
         # data = pending_rp_data.pop(temp_id, None)
-        data = get_pending_rp(temp_id)
+        data = await claim_pending_rp(temp_id)
         if not data:
-            await query.edit_message_text("❌ Dữ liệu xác nhận đã hết hạn.")
+            await safe_edit_message(context.bot, query.message.chat.id, query.message.message_id, "❌ Dữ liệu xác nhận đã hết hạn.")
             return
 
         # Lấy username người bấm YES
         username = query.from_user.username or f"id_{query.from_user.id}"
         full_name = update.effective_user.full_name
-        data["confirmed_by"] = username  # thêm vào dữ liệu
-        record_id = ads_reports_manager.save_ad_report(**data)
+        record_id = await ads_reports_manager.save_ad_report_async(**asdict(data), confirmed_by=username)
         if record_id:
-            delete_pending_rp(temp_id)
-            await query.edit_message_text(
+            await safe_edit_message(
+                context.bot, query.message.chat.id, query.message.message_id,
                 f"✅ <b>Dữ liệu đã được lưu vào hệ thống!</b>\n"
                 f"🆔 <b>ID bản ghi:</b> <code>{record_id}</code>\n"
                 f"👤 <b>Người xác nhận:</b> <code>{full_name}</code>",
                 parse_mode="HTML"
             )
         else:
-            await query.edit_message_text("❌ Lỗi: Không thể lưu báo cáo vào hệ thống.")
+            # ↩️ Trả lại dữ liệu chờ để có thể bấm lại
+            await add_pending_rp(temp_id, data)
+            await safe_edit_message(context.bot, query.message.chat.id, query.message.message_id, "❌ Lỗi: Không thể lưu báo cáo vào hệ thống.")
 
     elif action == "rp_no":
         # pending_rp_data.pop(temp_id, None)
-        delete_pending_rp(temp_id)
-        await query.edit_message_text("🚫 Đã hủy lưu báo cáo.")
+        await delete_pending_rp(temp_id)
+        await safe_edit_message(context.bot, query.message.chat.id, query.message.message_id, "🚫 Đã hủy lưu báo cáo.")
         
 async def hold_command(update: Update, context: CallbackContext):
     """Xử lý lệnh /hold để lưu dữ liệu hold"""
     message = update.message
     text = message.text
 
-    parsed = parse_hold_text(text)
-    if not parsed["id_bc"] or not parsed["hold"]:
-        await message.reply_text("⚠ Vui lòng nhập đúng cú pháp:\n/hold\nID BC: ...\nSố tiền: ...")
+    result = HOLD_FORM.parse(text)
+    parsed = result.values
+    if not result.ok:
+        await safe_reply(context.bot, message, "⚠ Vui lòng nhập đúng cú pháp:\n/hold\nID BC: ...\nSố tiền: ...")
         return
 
     ten_tele = format_tele(message.from_user)  # 👈 người chat lệnh
@@ -310,11 +242,11 @@ async def hold_command(update: Update, context: CallbackContext):
     #     # KHÔNG set nguoi_hanh_dong ở đây
     # }
     
-    add_pending_hold(temp_id, {
-        "id_bc": parsed["id_bc"],
-        "hold": parsed["hold"],
-        "ten_tele": ten_tele,  # chỉ lưu tên tele ở đây
-    }, datetime.now(timezone.utc).timestamp() )
+    await add_pending_hold(temp_id, HoldRecord(
+        id_bc=parsed["id_bc"],
+        hold=parsed["hold"],
+        ten_tele=ten_tele,  # chỉ lưu tên tele ở đây
+    ))
 
     confirm_text = (
         f"<b>Xác nhận lưu HOLD?</b>\n"
@@ -328,7 +260,8 @@ async def hold_command(update: Update, context: CallbackContext):
         InlineKeyboardButton("❌ No",  callback_data=f"hold_no|{temp_id}")
     ]]
     
-    await message.reply_text(
+    await safe_reply(
+        context.bot, message,
         confirm_text,
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup(keyboard)
@@ -344,9 +277,9 @@ async def handle_hold_callback(update: Update, context: CallbackContext):
 
     if action == "hold_yes":
         # data = pending_hold_data.pop(temp_id, None)
-        data = get_pending_hold(temp_id)
+        data = await claim_pending_hold(temp_id)
         if not data:
-            await query.edit_message_text("❌ Dữ liệu xác nhận đã hết hạn.")
+            await safe_edit_message(context.bot, query.message.chat.id, query.message.message_id, "❌ Dữ liệu xác nhận đã hết hạn.")
             return
 
         # 👇 người hành động là người bấm YES
@@ -354,31 +287,32 @@ async def handle_hold_callback(update: Update, context: CallbackContext):
         nguoi_hanh_dong = full_name
 
         # Lưu đủ 4 trường vào MongoDB thông qua hold_manager
-        record_id = hold_manager.save_hold(
-            id_bc=data["id_bc"],
-            ten_tele=data["ten_tele"],     # người chat lệnh
-            hold=data["hold"],
+        record_id = await hold_manager.save_hold_async(
+            id_bc=data.id_bc,
+            ten_tele=data.ten_tele,     # người chat lệnh
+            hold=data.hold,
             nguoi_hanh_dong=nguoi_hanh_dong  # người bấm YES
         )
 
         if record_id:
-            delete_pending_hold(temp_id)
-            await query.edit_message_text(
+            await safe_edit_message(
+                context.bot, query.message.chat.id, query.message.message_id,
                 f"✅ <b>Đã lưu HOLD thành công!</b>\n"
                 f"🪪 ID bản ghi: <code>{record_id}</code>\n"
-                f"🆔 ID BC: <code>{data['id_bc']}</code>\n"
-                f"👤 Tên tele: <code>{data['ten_tele']}</code>\n"
-                f"💰 Hold: <code>{data['hold']:,}</code>\n"
+                f"🆔 ID BC: <code>{data.id_bc}</code>\n"
+                f"👤 Tên tele: <code>{data.ten_tele}</code>\n"
+                f"💰 Hold: <code>{data.hold:,}</code>\n"
                 f"✍️ Người hành động: <code>{nguoi_hanh_dong}</code>",
                 parse_mode="HTML"
             )
         else:
-            await query.edit_message_text("❌ Lỗi khi lưu HOLD vào hệ thống.")
+            await add_pending_hold(temp_id, data)
+            await safe_edit_message(context.bot, query.message.chat.id, query.message.message_id, "❌ Lỗi khi lưu HOLD vào hệ thống.")
 
     elif action == "hold_no":
-        delete_pending_hold(temp_id)
+        await delete_pending_hold(temp_id)
         # pending_hold_data.pop(temp_id, None)
-        await query.edit_message_text("🚫 Đã hủy lưu HOLD.")
+        await safe_edit_message(context.bot, query.message.chat.id, query.message.message_id, "🚫 Đã hủy lưu HOLD.")
         
 async def naptien_command(update: Update, context: CallbackContext):
     """Xử lý lệnh /naptien để lưu dữ liệu nạp tiền"""
@@ -388,11 +322,13 @@ async def naptien_command(update: Update, context: CallbackContext):
 
         logging.info(f"[NAPTIEN] Nhận lệnh: {text} từ {message.from_user.username}")
 
-        parsed = parse_naptien_text(text)
+        result = NAPTIEN_FORM.parse(text)
+        parsed = result.values
         logging.info(f"[NAPTIEN] Parsed data: {parsed}")
 
-        if not parsed["id_bc"] or not parsed["so_tien_nap"] or not parsed["ads"]:
-            await message.reply_text(
+        if not result.ok:
+            await safe_reply(
+                context.bot, message,
                 "⚠ Vui lòng nhập đúng cú pháp:\n"
                 "/naptien\nSố tiền nạp: ...\nID BC: ...\nADS: @username"
             )
@@ -408,12 +344,12 @@ async def naptien_command(update: Update, context: CallbackContext):
         #     "ads": parsed["ads"],  # để kiểm tra người confirm
         # }
         
-        add_pending_naptien(temp_id, {
-            "id_bc": parsed["id_bc"],
-            "so_tien_nap": parsed["so_tien_nap"],
-            "ten_tele": ten_tele,
-            "ads": parsed["ads"],
-        }, datetime.now(timezone.utc).timestamp() )
+        await add_pending_naptien(temp_id, NaptienRecord(
+            id_bc=parsed["id_bc"],
+            so_tien_nap=parsed["so_tien_nap"],
+            ten_tele=ten_tele,
+            ads=parsed["ads"],
+        ))
 
         # ✅ Dùng HTML thay vì Markdown
         confirm_text = (
@@ -432,59 +368,69 @@ async def naptien_command(update: Update, context: CallbackContext):
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
-        await message.reply_text(confirm_text, parse_mode="HTML", reply_markup=reply_markup)
+        await safe_reply(context.bot, message, confirm_text, parse_mode="HTML", reply_markup=reply_markup)
 
     except Exception as e:
         logging.exception("[NAPTIEN] Lỗi khi xử lý lệnh /naptien")
-        await update.message.reply_text(f"❌ Lỗi khi xử lý lệnh /naptien: {e}")
+        await safe_reply(context.bot, update.message, f"❌ Lỗi khi xử lý lệnh /naptien: {e}")
 
 
 async def handle_naptien_callback(update: Update, context: CallbackContext):
-    """Xử lý callback xác nhận NẠP TIỀN"""
+    """Xử lý callback xác nhận NẠP TIỀN (chỉ người ADS trong lệnh được bấm Yes / No)"""
     query = update.callback_query
-    await query.answer()
-
     action, temp_id = query.data.split("|", 1)
 
-    # data = pending_naptien_data.get(temp_id)
-    data = get_pending_naptien(temp_id)
+    # Chỉ đọc (chưa xóa) để kiểm tra quyền: người khác bấm không làm mất / gia hạn dữ liệu chờ
+    data = await get_pending_naptien(temp_id)
     if not data:
-        await query.edit_message_text("❌ Dữ liệu xác nhận đã hết hạn.")
+        await query.answer()
+        await safe_edit_message(context.bot, query.message.chat.id, query.message.message_id, "❌ Dữ liệu xác nhận đã hết hạn.")
         return
 
     user = query.from_user
-    
+    if (user.username or "").lower() != (data.ads or "").lower():
+        await query.answer("🚫 Bạn không có quyền xác nhận lệnh này!", show_alert=True)
+        return
+
+    # Đúng người xác nhận → nhận (và xóa) dữ liệu; bấm 2 lần thì lần sau nhận None, giữ nguyên tin nhắn kết quả
+    claimed = await claim_pending_naptien(temp_id)
+    if not claimed:
+        await query.answer("⏳ Lệnh này đang được xử lý hoặc đã xử lý xong.", show_alert=True)
+        return
+    await query.answer()
+    data, created_at = claimed
 
     if action == "naptien_yes":
-        if (user.username or "").lower() != data["ads"].lower():
-            await query.answer("🚫 Bạn không có quyền xác nhận lệnh này!", show_alert=True)
-            return
         # Lưu vào MongoDB qua manager
-        record_id = nap_tien_manager.save_naptien(
-            id_bc=data["id_bc"],
-            ten_tele=data["ten_tele"],
-            so_tien_nap=data["so_tien_nap"],
+        record_id = await nap_tien_manager.save_naptien_async(
+            id_bc=data.id_bc,
+            ten_tele=data.ten_tele,
+            so_tien_nap=data.so_tien_nap,
             nguoi_hanh_dong=user.full_name or user.username,
         )
 
         # pending_naptien_data.pop(temp_id, None)
         
         if record_id:
-            delete_pending_naptien(temp_id)
-            await query.edit_message_text(
+            await safe_edit_message(
+                context.bot, query.message.chat.id, query.message.message_id,
                 f"✅ <b>ĐÃ LƯU NẠP TIỀN thành công!</b>\n"
                 f"🪪 ID bản ghi: <code>{record_id}</code>\n"
-                f"🆔 ID BC: <code>{data['id_bc']}</code>\n"
-                f"👤 Người nạp: <code>{data['ten_tele']}</code>\n"
-                f"💰 Số tiền: <code>{data['so_tien_nap']:,} VNĐ</code>\n"
+                f"🆔 ID BC: <code>{data.id_bc}</code>\n"
+                f"👤 Người nạp: <code>{data.ten_tele}</code>\n"
+                f"💰 Số tiền: <code>{data.so_tien_nap:,} VNĐ</code>\n"
                 f"✍️ Người xác nhận: <code>{user.full_name or user.username}</code>",
                 parse_mode="HTML"
             )
+        else:
+            # ↩️ Trả lại dữ liệu chờ (giữ hạn cũ) để có thể bấm lại
+            await add_pending_naptien(temp_id, data, created_at=created_at)
+            await safe_edit_message(context.bot, query.message.chat.id, query.message.message_id, "❌ Lỗi khi lưu NẠP TIỀN vào hệ thống.")
 
     elif action == "naptien_no":
-        # pending_naptien_data.pop(temp_id, None)
-        delete_pending_naptien(temp_id)
-        await query.edit_message_text(
+        # Dữ liệu đã được nhận (xóa) ở trên, sau khi kiểm tra quyền
+        await safe_edit_message(
+            context.bot, query.message.chat.id, query.message.message_id,
             f"🚫 Lệnh nạp tiền đã bị <b>@{user.username or user.full_name}</b> hủy.",
             parse_mode="HTML"
         )
\ No newline at end of file
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+import aiohttp
+import config
+from handlers.circuit_breaker import CircuitBreaker, CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = config.API_BASE_URL
+
+API_URL = f"{BASE_URL}api/v1/tiktok-user/create"
+API_BULK_URL = f"{BASE_URL}api/v1/tiktok-user/bulk-create"
+API_CHECK_URL = f"{BASE_URL}api/v1/tiktok-user/check-exists-username"
+API_BULK_CHECK = f"{BASE_URL}api/v1/tiktok-user/bulk-check"
+API_BULK_SAVE  = f"{BASE_URL}api/v1/tiktok-user/bulk-save"
+API_FACEBOOK_BULK_CHECK  = f"{BASE_URL}api/v1/facebook-user/bulk-check"
+API_FACEBOOK_BULK_SAVE   = f"{BASE_URL}api/v1/facebook-user/bulk-save"
+API_AGENCY_KPI = f"{BASE_URL}api/v1/agency-kpi"
+
+logger.info(f"   - agency_kpi: {API_AGENCY_KPI}")
+
+
+@dataclass(frozen=True)
+class ApiResponse:
+    status: int
+    data: Any
+
+    @property
+    def ok(self):
+        return 200 <= self.status < 300
+
+
+class BackendClient:
+    """
+    Client dùng chung cho mọi lệnh gọi backend (TikTok, Facebook, agency KPI).
+    - Một ClientSession cho cả bot: giữ kết nối keep-alive, giới hạn kết nối mỗi host, cache DNS.
+    - Tạo trong `post_init` (`start`) và đóng trong `post_shutdown` (`close`).
+    - Lỗi mạng vẫn raise `aiohttp.ClientError` để handler xử lý như trước.
+    - Circuit breaker theo dõi tỷ lệ lỗi và độ trễ; khi mở, mọi lệnh gọi raise `CircuitOpenError` ngay.
+    - Lệnh gọi chỉ đọc (idempotent) được thử lại với backoff có jitter.
+    """
+    _instance = None  # Singleton instance
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(BackendClient, cls).__new__(cls)
+            cls._instance._session = None
+            cls._instance.breaker = CircuitBreaker(
+                "backend",
+                window=config.API_BREAKER_WINDOW,
+                min_calls=config.API_BREAKER_MIN_CALLS,
+                failure_rate=config.API_BREAKER_FAILURE_RATE,
+                slow_call=config.API_BREAKER_SLOW_CALL,
+                slow_rate=config.API_BREAKER_SLOW_RATE,
+                open_seconds=config.API_BREAKER_OPEN_SECONDS,
+            )
+        return cls._instance
+
+    async def start(self):
+        """Tạo ClientSession dùng chung (gọi trong post_init)."""
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit_per_host=config.API_LIMIT_PER_HOST,
+            ttl_dns_cache=config.API_DNS_TTL,
+            keepalive_timeout=config.API_KEEPALIVE,
+        )
+        timeout = aiohttp.ClientTimeout(total=config.API_TIMEOUT, connect=config.API_CONNECT_TIMEOUT)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        logger.info(f"✅ Đã tạo kết nối dùng chung tới backend {BASE_URL} (tối đa {config.API_LIMIT_PER_HOST} kết nối).")
+
+    async def close(self):
+        """Đóng ClientSession (gọi trong post_shutdown)."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("✅ Đã đóng kết nối tới backend.")
+        self._session = None
+
+    async def _call(self, url, payload, timeout: Optional[float] = None) -> ApiResponse:
+        if self._session is None or self._session.closed:
+            # Chạy ngoài Application (script, test tay) → tự tạo session
+            await self.start()
+        probe = self.breaker.before_call()
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+        started = time.monotonic()
+        try:
+            async with self._session.post(url, json=payload, timeout=request_timeout) as resp:
+                data = await resp.json()
+                status = resp.status
+        except Exception:
+            self.breaker.record(False, time.monotonic() - started, probe)
+            raise
+        except BaseException:
+            # Bị hủy giữa chừng: không tính là lỗi của backend
+            self.breaker.release(probe)
+            raise
+        # 5xx là lỗi phía backend; 4xx là request sai, backend vẫn khỏe
+        self.breaker.record(status < 500, time.monotonic() - started, probe)
+        return ApiResponse(status=status, data=data)
+
+    async def _post(self, url, payload, timeout: Optional[float] = None, idempotent=False) -> ApiResponse:
+        attempts = config.API_RETRIES + 1 if idempotent else 1
+        for attempt in range(attempts):
+            last_attempt = attempt + 1 >= attempts
+            try:
+                resp = await self._call(url, payload, timeout)
+                if resp.status < 500 or last_attempt:
+                    return resp
+                reason = f"HTTP {resp.status}"
+            except CircuitOpenError:
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if last_attempt:
+                    raise
+                reason = repr(e)
+            # Full jitter: tránh các handler cùng thử lại một lúc
+            delay = random.uniform(0, config.API_RETRY_BASE * 2 ** attempt)
+            logger.warning(f"⚠️ Gọi {url} lỗi ({reason}), thử lại lần {attempt + 1}/{attempts - 1} sau {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    # ===== TikTok =====
+
+    async def tiktok_create(self, user: dict) -> ApiResponse:
+        return await self._post(API_URL, user)
+
+    async def tiktok_bulk_create(self, usernames: list, group_name: str, assistant: str) -> ApiResponse:
+        return await self._post(API_BULK_URL, {
+            "usernames": usernames,
+            "groupName": group_name,
+            "assistant": assistant,
+        })
+
+    async def tiktok_check_username(self, username: str) -> ApiResponse:
+        return await self._post(API_CHECK_URL, {"username": username}, idempotent=True)
+
+    async def tiktok_bulk_check(self, uids: list, timeout: Optional[float] = config.BULK_CHECK_TIMEOUT) -> ApiResponse:
+        return await self._post(API_BULK_CHECK, {"uids": uids}, timeout=timeout)
+
+    async def tiktok_bulk_save(self, users: list) -> ApiResponse:
+        return await self._post(API_BULK_SAVE, users)
+
+    # ===== Facebook =====
+
+    async def facebook_bulk_check(self, uids: list, timeout: Optional[float] = config.BULK_CHECK_TIMEOUT) -> ApiResponse:
+        return await self._post(API_FACEBOOK_BULK_CHECK, {"uids": uids}, timeout=timeout)
+
+    async def facebook_bulk_save(self, users: list) -> ApiResponse:
+        return await self._post(API_FACEBOOK_BULK_SAVE, users)
+
+    # ===== Agency KPI =====
+
+    async def agency_kpi(self, agent: str, input_budgets: list, dry_run: bool, created_by: str) -> ApiResponse:
+        # dryRun chỉ đọc nên được thử lại; ghi DB thì không
+        return await self._post(API_AGENCY_KPI, {
+            "agent": agent,
+            "employeeType": "nhân viên offline",
+            "inputBudgets": input_budgets,
+            "ratioBudgetToKpi": 0,
+            "ratioDepositToBudget": 0,
+            "ratioWagerToDeposit": 0,
+            "dryRun": dry_run,
+            "createdBy": created_by,
+        }, idempotent=dry_run)
+
+
+api_client = BackendClient()
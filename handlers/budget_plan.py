@@ -0,0 +1,38 @@
+import logging
+from handlers.pending_codec import Allocation, BudgetPlan
+
+logger = logging.getLogger(__name__)
+
+
+def build_plan(team, group_name, note, total, hd_counts, original_codes, current_budgets):
+    """
+    Tạo kế hoạch phân bổ ngân sách ở bước xem trước /ns, lưu kèm confirmation để YES áp dụng lại.
+    :param hd_counts: dict mã đã chuẩn hóa -> số lần xuất hiện
+    :param original_codes: dict mã đã chuẩn hóa -> mã gốc người dùng nhập
+    :param current_budgets: ngân sách hiện tại theo mã, đã cộng cả họ "11" (tại thời điểm xem trước)
+    """
+    total_occurrences = sum(hd_counts.values())
+    allocations = [
+        Allocation(
+            contract_code=code,
+            original_contract_code=original_codes.get(code, code),
+            count=count,
+            amount=round(total * count / total_occurrences),
+            current=current_budgets.get(code, 0),
+        )
+        for code, count in hd_counts.items()
+    ]
+
+    return BudgetPlan(team=team, group_name=group_name, note=note, total=total, allocations=allocations)
+
+
+def plan_allocations(plan):
+    """Danh sách phân bổ theo định dạng của `add_budgets_bulk_async`."""
+    return [
+        {
+            "contract_code": allocation.contract_code,
+            "original_contract_code": allocation.original_contract_code,
+            "amount": allocation.amount,
+        }
+        for allocation in plan.allocations
+    ]
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import random
+import time
+import config
+from handlers.ultils import safe_edit_message
+from handlers.circuit_breaker import CircuitOpenError
+from handlers.send_scheduler import PRIORITY_STATUS, PRIORITY_CONFIRM
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096
+
+
+class BatchCheckError(Exception):
+    """Một lô kiểm tra thất bại (lỗi mạng, timeout hoặc backend trả lỗi)."""
+
+
+def response_items(resp, batch):
+    """
+    Lấy danh sách kết quả từ ApiResponse của bulk-check, khớp thứ tự với `batch`.
+    Raise BatchCheckError nếu backend trả lỗi để lô được thử lại.
+    """
+    if not resp.ok or not isinstance(resp.data, dict):
+        raise BatchCheckError(f"HTTP {resp.status}")
+    # None trong kết quả chỉ dùng để đánh dấu UID chưa kiểm tra xong
+    items = [item or {} for item in resp.data.get("data") or []]
+    if len(items) < len(batch):
+        items += [{}] * (len(batch) - len(items))
+    return items[:len(batch)]
+
+
+def failed_item(message="⚠️ Lỗi kiểm tra, vui lòng thử lại sau"):
+    return {"message": message, "error": True}
+
+
+async def check_in_batches(check, uids, on_progress=None, batch_size=None, concurrency=None, retries=None):
+    """
+    Kiểm tra danh sách UID theo lô, chạy song song có giới hạn.
+    - `check(batch)` là coroutine trả về list kết quả cùng thứ tự với batch (raise nếu lỗi).
+    - Lô lỗi được thử lại riêng (backoff có jitter); vẫn lỗi thì chia đôi để một UID chậm không kéo theo cả lô.
+    - Backend bị ngắt (CircuitOpenError) → lô thất bại ngay, không thử lại, không chia đôi.
+    - `on_progress(results, done)` được gọi sau mỗi lô xong; ô chưa có kết quả là None.
+    :return: list kết quả cùng thứ tự với `uids` (UID lỗi nhận `failed_item()`)
+    """
+    batch_size = batch_size or config.BULK_CHECK_BATCH_SIZE
+    retries = config.BULK_CHECK_RETRIES if retries is None else retries
+    semaphore = asyncio.Semaphore(concurrency or config.BULK_CHECK_CONCURRENCY)
+    results = [None] * len(uids)
+    done = 0
+
+    async def attempt(start, batch, attempts):
+        for attempt_no in range(attempts):
+            try:
+                async with semaphore:
+                    return await check(batch)
+            except CircuitOpenError as e:
+                return [failed_item(e.user_message())] * len(batch)
+            except Exception as e:
+                logger.warning(f"⚠️ Lô {start}-{start + len(batch) - 1} lỗi lần {attempt_no + 1}/{attempts}: {e!r}")
+                if attempt_no + 1 < attempts:
+                    await asyncio.sleep(random.uniform(0, 0.5 * 2 ** attempt_no))
+        return None
+
+    async def run(start, batch, attempts):
+        nonlocal done
+        items = await attempt(start, batch, attempts)
+        if items is None and len(batch) > 1:
+            # Chia đôi lô lỗi, mỗi nửa thử một lần rồi tiếp tục chia nếu vẫn lỗi
+            middle = len(batch) // 2
+            await asyncio.gather(
+                run(start, batch[:middle], 1),
+                run(start + middle, batch[middle:], 1),
+            )
+            return
+        if items is None:
+            items = [failed_item()]
+        results[start:start + len(batch)] = items
+        done += len(batch)
+        if on_progress:
+            await on_progress(results, done)
+
+    await asyncio.gather(*(
+        run(start, uids[start:start + batch_size], retries + 1)
+        for start in range(0, len(uids), batch_size)
+    ))
+    return results
+
+
+class ThrottledProgress:
+    """
+    Sửa một tin nhắn tiến độ, tối đa một lần mỗi `interval` giây (tránh flood limit của Telegram).
+    Lần sửa cuối cùng dùng `finish`.
+    """
+
+    def __init__(self, bot, chat_id, message_id, interval=None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.interval = config.BULK_CHECK_EDIT_INTERVAL if interval is None else interval
+        self._last_edit = 0.0
+        self._last_key = None
+        self._lock = asyncio.Lock()
+
+    async def _edit(self, text, priority, **kwargs):
+        key = (text, kwargs.get("reply_markup") is not None)
+        if key == self._last_key:
+            return  # Telegram báo lỗi "message is not modified"
+        self._last_key = key
+        self._last_edit = time.monotonic()
+        await safe_edit_message(self.bot, self.chat_id, self.message_id, text, priority=priority, **kwargs)
+
+    async def update(self, text, **kwargs):
+        if time.monotonic() - self._last_edit < self.interval or self._lock.locked():
+            return
+        async with self._lock:
+            await self._edit(fit_message(text), PRIORITY_STATUS, **kwargs)
+
+    async def finish(self, text, **kwargs):
+        async with self._lock:
+            await self._edit(text, PRIORITY_CONFIRM, **kwargs)
+
+
+def fit_message(text, limit=MAX_MESSAGE_LENGTH):
+    """Cắt bớt dòng cuối để vừa một tin nhắn Telegram."""
+    if len(text) <= limit:
+        return text
+    lines = text.split("\n")
+    kept = []
+    length = 0
+    for line in lines:
+        if length + len(line) + 1 > limit - 40:
+            break
+        kept.append(line)
+        length += len(line) + 1
+    return "\n".join(kept) + f"\n… (+{len(lines) - len(kept)} dòng)"
@@ -0,0 +1,99 @@
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def _payload_size(payload):
+    """Ước lượng dung lượng payload (byte) theo JSON."""
+    try:
+        return len(json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8"))
+    except (TypeError, ValueError):
+        return 0
+
+
+class CallbackStore:
+    """
+    Lưu tạm dữ liệu cho nút bấm inline (kết quả /tiktok, /facebook chờ lưu), khóa là token ngắn
+    nằm trong callback_data của chính tin nhắn đó — mỗi tin nhắn có dữ liệu riêng, không ghi đè nhau.
+    - Mỗi mục sống CALLBACK_STORE_TTL giây.
+    - Giới hạn CALLBACK_STORE_SIZE mục và CALLBACK_STORE_MAX_BYTES byte; đầy thì bỏ mục cũ nhất.
+    """
+    _instance = None  # Singleton instance
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(CallbackStore, cls).__new__(cls)
+            cls._instance._init_store()
+        return cls._instance
+
+    def _init_store(self):
+        self.max_size = config.CALLBACK_STORE_SIZE
+        self.max_bytes = config.CALLBACK_STORE_MAX_BYTES
+        self.ttl = config.CALLBACK_STORE_TTL
+        self._entries = OrderedDict()  # token -> (expires_at, kind, size, payload), theo thứ tự thêm vào
+        self._bytes = 0
+        self._stats = {"stored": 0, "claimed": 0, "expired": 0, "evicted": 0, "missing": 0}
+
+    def _drop(self, token, reason):
+        _, _, size, _ = self._entries.pop(token)
+        self._bytes -= size
+        self._stats[reason] += 1
+
+    def _evict(self):
+        # Mục thêm trước hết hạn trước nên chỉ cần dọn từ đầu
+        now = time.monotonic()
+        while self._entries:
+            token, (expires_at, _, _, _) = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            self._drop(token, "expired")
+        while len(self._entries) > self.max_size or (self._bytes > self.max_bytes and len(self._entries) > 1):
+            self._drop(next(iter(self._entries)), "evicted")
+
+    def put(self, kind, payload, token=None):
+        """
+        :param kind: loại dữ liệu (vd "tiktok_bulk") — token chỉ dùng được cho đúng loại này
+        :param token: truyền lại token cũ để trả dữ liệu về (khi lưu thất bại)
+        :return: token dùng trong callback_data
+        """
+        token = token or uuid.uuid4().hex[:12]
+        if token in self._entries:
+            self._drop(token, "claimed")
+        size = _payload_size(payload)
+        self._entries[token] = (time.monotonic() + self.ttl, kind, size, payload)
+        self._bytes += size
+        self._stats["stored"] += 1
+        self._evict()
+        return token
+
+    def claim(self, kind, token):
+        """Lấy và xóa dữ liệu của token (mỗi token chỉ xử lý một lần). :return: payload hoặc None"""
+        self._evict()
+        entry = self._entries.get(token)
+        if not entry or entry[1] != kind:
+            self._stats["missing"] += 1
+            return None
+        self._drop(token, "claimed")
+        return entry[3]
+
+    def discard(self, token):
+        if token in self._entries:
+            self._drop(token, "claimed")
+
+    def stats(self):
+        self._evict()
+        return {**self._stats, "size": len(self._entries), "bytes": self._bytes}
+
+
+callback_store = CallbackStore()
+
+
+def callback_token(query_data):
+    """Token trong callback_data dạng "<hành động>|<token>" (None nếu tin nhắn cũ không có token)."""
+    _, _, token = (query_data or "").partition("|")
+    return token or None
@@ -0,0 +1,134 @@
+import logging
+import time
+from collections import deque
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(aiohttp.ClientError):
+    """Backend đang bị ngắt (circuit mở): từ chối ngay, không chờ timeout."""
+
+    def __init__(self, name, retry_after):
+        self.name = name
+        self.retry_after = max(0, int(retry_after + 0.999))
+        super().__init__(f"Circuit '{name}' đang mở, thử lại sau {self.retry_after} giây")
+
+    def user_message(self):
+        return f"⛔ Hệ thống backend đang gián đoạn, vui lòng thử lại sau {self.retry_after} giây."
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker theo cửa sổ thời gian trượt:
+    - closed: ghi nhận kết quả và độ trễ của các lần gọi trong `window` giây gần nhất.
+      Đủ `min_calls` mà tỷ lệ lỗi ≥ `failure_rate` hoặc tỷ lệ gọi chậm (≥ `slow_call` giây) ≥ `slow_rate` → open.
+    - open: từ chối ngay bằng CircuitOpenError trong `open_seconds` giây.
+    - half_open: cho tối đa `half_open_calls` lần gọi thăm dò; thành công → closed, lỗi → open lại.
+    """
+
+    def __init__(self, name, window, min_calls, failure_rate, slow_call, slow_rate, open_seconds, half_open_calls=1):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.reset()
+
+    def reset(self):
+        self._state = STATE_CLOSED
+        self._calls = deque()  # (thời điểm, thành công?, độ trễ)
+        self._opened_at = 0.0
+        self._probes = 0
+        self._times_opened = getattr(self, "_times_opened", 0)
+
+    @property
+    def state(self):
+        if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = STATE_HALF_OPEN
+            self._probes = 0
+            logger.info(f"🟡 Circuit '{self.name}' chuyển sang half-open, cho phép gọi thăm dò.")
+        return self._state
+
+    def _trim(self, now):
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+    def _open(self, reason):
+        self._state = STATE_OPEN
+        self._opened_at = time.monotonic()
+        self._times_opened += 1
+        logger.error(f"🔴 Circuit '{self.name}' mở trong {self.open_seconds}s: {reason}")
+
+    def before_call(self):
+        """
+        Gọi trước mỗi request. Raise CircuitOpenError nếu không được phép gọi.
+        :return: True nếu đây là lần gọi thăm dò (half-open) — phải kết thúc bằng `record` hoặc `release`.
+        """
+        state = self.state
+        if state == STATE_OPEN:
+            raise CircuitOpenError(self.name, self.open_seconds - (time.monotonic() - self._opened_at))
+        if state == STATE_HALF_OPEN:
+            if self._probes >= self.half_open_calls:
+                raise CircuitOpenError(self.name, 1)
+            self._probes += 1
+            return True
+        return False
+
+    def release(self, probe):
+        """Lần gọi thăm dò bị hủy giữa chừng (không có kết quả)."""
+        if probe and self._state == STATE_HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
+
+    def record(self, success, duration, probe=False):
+        now = time.monotonic()
+        if probe and self._state == STATE_HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
+            if success and duration < self.slow_call:
+                logger.info(f"🟢 Circuit '{self.name}' đóng lại sau lần gọi thăm dò thành công.")
+                self._state = STATE_CLOSED
+                self._calls.clear()
+            else:
+                self._open("lần gọi thăm dò thất bại" if not success else f"lần gọi thăm dò chậm ({duration:.1f}s)")
+            return
+
+        self._calls.append((now, success, duration))
+        self._trim(now)
+        if self._state != STATE_CLOSED or len(self._calls) < self.min_calls:
+            return
+        failures = sum(1 for _, ok, _ in self._calls if not ok)
+        slow = sum(1 for _, _, elapsed in self._calls if elapsed >= self.slow_call)
+        if failures / len(self._calls) >= self.failure_rate:
+            self._open(f"{failures}/{len(self._calls)} lần gọi lỗi trong {self.window}s")
+        elif slow / len(self._calls) >= self.slow_rate:
+            self._open(f"{slow}/{len(self._calls)} lần gọi chậm hơn {self.slow_call}s")
+
+    def snapshot(self):
+        """Trạng thái hiện tại để hiển thị cho admin."""
+        state = self.state
+        now = time.monotonic()
+        self._trim(now)
+        durations = sorted(elapsed for _, _, elapsed in self._calls)
+        total = len(self._calls)
+
+        def percentile(p):
+            return durations[min(total - 1, int(p * total))] if total else 0.0
+
+        return {
+            "name": self.name,
+            "state": state,
+            "calls": total,
+            "failure_rate": sum(1 for _, ok, _ in self._calls if not ok) / total if total else 0.0,
+            "slow_rate": sum(1 for elapsed in durations if elapsed >= self.slow_call) / total if total else 0.0,
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "retry_after": max(0.0, self.open_seconds - (now - self._opened_at)) if state == STATE_OPEN else 0.0,
+            "times_opened": self._times_opened,
+        }
@@ -1,24 +1,33 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.error import TelegramError
-from handlers.ultils import generate_random_code, process_budget , format_number , safe_send_message , safe_edit_message , normalize_text , get_custom_today_epoch
-from handlers.db_helpers import init_db, add_confirmation, get_confirmation, delete_confirmation
-from decorators import cache_data
+from handlers.ultils import generate_random_code, process_budget , format_number , safe_send_message , safe_edit_message , notify_admins , normalize_text , get_custom_today_epoch
+from handlers.db_helpers import add_confirmation, claim_confirmation
+from handlers.budget_plan import build_plan, plan_allocations
+from handlers.form_parser import NS_FORM
+from db.contract_codes import contract_normalizer
+from handlers.api_client import api_client
+from handlers.circuit_breaker import CircuitOpenError, STATE_CLOSED
+from handlers.kpi_lookup import kpi_lookup
+from handlers.bulk_check import check_in_batches, response_items, ThrottledProgress, MAX_MESSAGE_LENGTH
+from handlers.user_check_cache import user_check_cache, normalize_uid, PLATFORM_TIKTOK, PLATFORM_FACEBOOK
+from handlers.callback_store import callback_store, callback_token
+from handlers.send_scheduler import PRIORITY_STATUS
+from decorators import cache_data_async
 from datetime import datetime, timezone, timedelta
-from decorators import troly_only, allowed_room , troly_only
-from db.budget import QuanLyABCVIP
+from decorators import troly_only, allowed_room , troly_only, backend_guard
+from db.budget import QuanLyABCVIP, BULK_FAILED, BULK_PARTIAL, BULK_UNKNOWN
 from config import ADMIN_IDS ,EXPIRATION_TIME
 from db.note import note_manager
 from telegram.ext import CallbackContext, CallbackQueryHandler
 import calendar
 import html
+from collections import Counter
 import time
 import uuid
 import logging
 import re
-import json
 import aiohttp
-import os
 import unicodedata
 from db.troly import AssistantManager
 
@@ -28,19 +37,6 @@ logger = logging.getLogger(__name__)
 
 budget_manager = QuanLyABCVIP()
 
-init_db()
-BASE_URL = os.getenv("API_BASE_URL", "http://103.48.84.131")
-
-API_URL = f"{BASE_URL}api/v1/tiktok-user/create"
-API_BULK_URL = f"{BASE_URL}api/v1/tiktok-user/bulk-create"
-API_CHECK_URL = f"{BASE_URL}api/v1/tiktok-user/check-exists-username"
-API_BULK_CHECK = f"{BASE_URL}api/v1/tiktok-user/bulk-check"
-API_BULK_SAVE  = f"{BASE_URL}api/v1/tiktok-user/bulk-save"
-API_FACEBOOK_BULK_CHECK  = f"{BASE_URL}api/v1/facebook-user/bulk-check"
-API_FACEBOOK_BULK_SAVE   = f"{BASE_URL}api/v1/facebook-user/bulk-save"
-API_AGENCY_KPI = f"{BASE_URL}api/v1/agency-kpi"
-
-logger.info(f"   - mhd_list: {API_AGENCY_KPI}")
 
 def escape_html(text):
     """Escape các ký tự đặc biệt trong HTML."""
@@ -64,86 +60,20 @@ async def handle_ngansach(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.bot,
             chat_id=update.effective_chat.id,
             text="⚙️ <b>Đang xử lý yêu cầu của bạn. Vui lòng chờ...</b>",
-            parse_mode="HTML"
+            parse_mode="HTML",
+            priority=PRIORITY_STATUS
         )
 
         message_text = update.message.text.strip()
         logger.info(f"Nội dung tin nhắn nhận được: {message_text}")
 
-        lines = message_text.split('\n')
-
-        data = {
-            "tên nhóm": "",
-            "tổ": "",
-            "mã hd": "",
-            "ngân sách": "",
-            "nội dung": ""
-        }
-
-        field_mapping = {
-            "tên nhóm": "tên nhóm",
-            "nhóm": "tên nhóm",
-            "tổ": "tổ",
-            "mã hd": "mã hd",
-            "mã hậu đài": "mã hd",
-            "ngân sách xin": "ngân sách",
-            "ns": "ngân sách",
-            "ngân sách": "ngân sách",
-            "nội dung": "nội dung"
-        }
-
-        pattern = re.compile(r'^\+?(.*?)\s*:\s*(.*)$', re.IGNORECASE)
-
-        for line in lines:
-            line = line.strip()
-            if not line or line.lower().startswith('form ngân sách'):
-                continue
-            match = pattern.match(line)
-            if match:
-                key, value = match.groups()
-                key = key.strip().lower()
-                value = value.strip()
-                normalized_key = field_mapping.get(key)
-                if normalized_key:
-                    data[normalized_key] = value
-                else:
-                    logger.warning(f"Trường không xác định: {key}")
-            else:
-                logger.warning(f"Dòng không khớp với regex: {line}")
-
-        hd_codes = data["mã hd"].split(',')
-
-        # 🟢 Lấy danh sách hợp đồng bị bỏ qua
-        ignored_codes = QuanLyABCVIP().get_ignored_contracts_by_key("ABCVIP") or []
-        ignored_codes = [code.strip().upper() for code in ignored_codes]
+        result = NS_FORM.parse(message_text)
+        data = result.values
+        if result.unknown:
+            logger.warning(f"Trường không xác định: {result.unknown}")
 
-        processed_hd_codes = []
-
-        for code in hd_codes:
-            code = code.strip().upper()
-
-            # Nếu code nằm trong danh sách bỏ qua → giữ nguyên
-            if code in ignored_codes:
-                processed_hd_codes.append(code)
-                logger.debug(f"✅ Giữ nguyên mã bị bỏ qua: {code}")
-                continue
-
-            # Nếu không → bỏ 1 ký tự cuối (nếu đủ dài)
-            new_code = code[:5]
-            processed_hd_codes.append(new_code)
-            logger.debug(f"✂️ Cắt bớt 1 ký tự cuối: {code} ➝ {new_code}")
-
-        logger.info(f"📄 Ignored contracts cho ABCVIP: {processed_hd_codes}")
-
-        hd_codes = processed_hd_codes
-        hd_counts = {code: hd_codes.count(code) for code in set(hd_codes)}
-        total_occurrences = sum(hd_counts.values())
-
-        mandatory_fields = ["tổ", "mã hd", "ngân sách"]
-        missing_fields = [field for field in mandatory_fields if not data.get(field)]
-
-        if missing_fields:
-            missing_fields_formatted = ", ".join([f"<b>'{field.capitalize()}'</b>" for field in missing_fields])
+        if result.missing:
+            missing_fields_formatted = ", ".join([f"<b>'{label}'</b>" for label in result.missing])
             error_message_text = f"❗ <b>Lỗi:</b> Các trường sau đây không được để trống: {missing_fields_formatted}."
             await safe_send_message(
                 context.bot,
@@ -153,10 +83,7 @@ async def handle_ngansach(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
 
-        try:
-            budget_value = abs(int(re.sub(r'[^\d]', '', data["ngân sách"])))
-            data["ngân sách"] = budget_value
-        except ValueError:
+        if result.invalid:
             await safe_send_message(
                 context.bot,
                 chat_id=update.effective_chat.id,
@@ -165,21 +92,38 @@ async def handle_ngansach(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
 
+        budget_value = data["ngân sách"]
+        # 🟢 Chuẩn hóa mã hợp đồng (giữ nguyên mã bị bỏ qua, còn lại cắt 5 ký tự)
+        normalized = await contract_normalizer.normalize_many_async(data["mã hd"].split(','))
+        hd_codes = [code for code, _ in normalized]
+        original_codes = {code: original for code, original in normalized}
+
+        logger.info(f"📄 Mã hợp đồng sau chuẩn hóa: {hd_codes}")
+
+        if not hd_codes:
+            await safe_send_message(
+                context.bot,
+                chat_id=update.effective_chat.id,
+                text="❗ <b>Lỗi:</b> Các trường sau đây không được để trống: <b>'Mã hd'</b>.",
+                parse_mode='HTML'
+            )
+            return
+
+        hd_counts = dict(Counter(hd_codes))
+
         data["tên nhóm"] = data["tên nhóm"] if data["tên nhóm"] else update.effective_chat.title
         data["tổ"] = data["tổ"].upper() if data["tổ"] else "DEFAULT"
 
-        all_contract_codes = set(hd_counts.keys())
+        # Đọc ngân sách cho cả họ "11" (FD3N ↔ FD3N11) dù người dùng chỉ nhập một mã
+        all_contract_codes = contract_normalizer.family_members(hd_counts)
 
         try:
             # 🟢 Lấy ngân sách hiện tại từ MongoDB
             chat_id = update.effective_chat.id
-            current_budgets = budget_manager.get_current_budget(list(all_contract_codes),data["tổ"], chat_id)
+            current_budgets = await budget_manager.get_current_budget_async(list(all_contract_codes), data["tổ"], chat_id)
 
-            # 🟢 Tính toán ngân sách dự kiến trực tiếp từ current_budgets (KHÔNG gọi lại DB)
-            projected_budgets = {
-                code: current_budgets.get(code, 0) + round(budget_value * count / total_occurrences)
-                for code, count in hd_counts.items()
-            }
+            # 🟢 Ngân sách hiện tại theo họ, dùng chung cho xem trước và nút YES
+            family_budgets = contract_normalizer.family_totals(hd_counts, current_budgets)
 
             logger.info(f"Ngân sách hiện tại: {current_budgets} {hd_counts} {hd_codes} {all_contract_codes}")
         except Exception as e:
@@ -195,11 +139,21 @@ async def handle_ngansach(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # ✅ Sử dụng hàm của bạn để tạo ID ngẫu nhiên
         random_code = generate_random_code(data["tổ"])
         confirmation_id = str(uuid.uuid4())
-        add_confirmation(
+
+        # 🟢 Lưu kế hoạch phân bổ để nút YES ghi thẳng, không tính lại
+        plan = build_plan(
+            team=data["tổ"],
+            group_name=data["tên nhóm"],
+            note=data["nội dung"],
+            total=budget_value,
+            hd_counts=hd_counts,
+            original_codes=original_codes,
+            current_budgets=family_budgets,
+        )
+        await add_confirmation(
             id=confirmation_id,
-            data=json.dumps(data),
-            code=random_code,
-            created_at=datetime.now().isoformat()
+            plan=plan,
+            code=random_code
         )
         confirmation_message = (
             f"📋 <b>Xác nhận ghi dữ liệu ngân sách:</b>\n\n"
@@ -212,32 +166,29 @@ async def handle_ngansach(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Đếm số lần xuất hiện của mỗi mã HD khi duyệt (theo thứ tự)
         hd_sequence_count = {}
 
-        for code, count in hd_counts.items():
+        # 🔹 Lấy limit của tất cả mã trong một lần tra cứu
+        limits = await budget_manager.get_limits_async(list(hd_counts.keys()))
+
+        for allocation in plan.allocations:
+            code, count = allocation.contract_code, allocation.count
             hd_sequence_count[code] = hd_sequence_count.get(code, 0) + 1
 
-            budget_share = round(budget_value * count / total_occurrences)
+            budget_share = allocation.amount
 
             # 🔹 Log mã code hiện tại
             logger.info(f"🟢 Đang xử lý code: {code}")
 
             # 🔹 Nếu code bắt đầu bằng F và kết thúc là 1 hoặc 9 → lấy limit tương ứng
-            limit_info = QuanLyABCVIP().get_limit_by_key(code)
+            limit_info = limits.get(code)
             if limit_info:
                 logger.info(
-                    f"🔸 Giới hạn ngân sách ({key}): {limit_info['limit']} VND (Cập nhật: {limit_info['updated_at']})"
+                    f"🔸 Giới hạn ngân sách ({code}): {limit_info['limit']} VND (Cập nhật: {limit_info['updated_at']})"
                 )
             else:
-                logger.warning(f"⚠️ Không tìm thấy limit cho key: {key}")
-
-            # 🔹 Tính ngân sách hiện tại theo logic
-            if code.endswith("11"):
-                base_code = code[:-2]
-                current_budget_show = current_budgets.get(code, 0) + current_budgets.get(base_code, 0)
-            elif not re.search(r'\d+$', code):  # không có số ở cuối
-                code_11 = code + "11"
-                current_budget_show = current_budgets.get(code, 0) + current_budgets.get(code_11, 0)
-            else:
-                current_budget_show = current_budgets.get(code, 0)
+                logger.warning(f"⚠️ Không tìm thấy limit cho key: {code}")
+
+            # 🔹 Ngân sách hiện tại của cả họ mã (giống nút YES)
+            current_budget_show = allocation.current
 
             total_predicted = budget_share + current_budget_show
 
@@ -324,7 +275,10 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         data_parts = query.data.split('|')
         if len(data_parts) != 2:
-            await query.edit_message_text(
+            await safe_edit_message(
+                context.bot,
+                chat_id=query.message.chat.id,
+                message_id=query.message.message_id,
                 text="❗ **Lỗi:** Dữ liệu không hợp lệ.",
                 parse_mode='Markdown'
             )
@@ -334,123 +288,89 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         action, confirmation_id = data_parts
         logger.info(f"🔍 Đang kiểm tra confirmation_id: {confirmation_id}")
 
-        record = get_confirmation(confirmation_id)
+        # 🔒 Nhận và xóa dữ liệu xác nhận trong một lệnh → chỉ một lần bấm được xử lý
+        record = await claim_confirmation(confirmation_id)
         logger.info(f"📩 Dữ liệu lấy từ DB: {record}")
 
         if not record:
-            await query.edit_message_text(
+            await safe_edit_message(
+                context.bot,
+                chat_id=query.message.chat.id,
+                message_id=query.message.message_id,
                 text="⚠️ **Lỗi:** Yêu cầu đã hết hạn hoặc không tồn tại.",
                 parse_mode='Markdown'
             )
             logger.warning(f"⚠️ confirmation_id '{confirmation_id}' không tồn tại hoặc đã hết hạn.")
             return
 
-        # Giải mã dữ liệu JSON
-        try:
-            data = json.loads(record["data"])
-            logger.info(f"📜 Dữ liệu JSON sau khi giải mã: {data}")
-        except Exception as e:
-            logger.error(f"❌ Lỗi khi giải mã JSON: {e}")
-            return
-
         random_code = record["code"]
-
-        if "mã hd" not in data:
-            logger.error(f"❌ Không tìm thấy 'mã hd' trong dữ liệu: {data}")
-            return
-        
-        hd_codes = data["mã hd"].split(',')
-        ignored_codes = QuanLyABCVIP().get_ignored_contracts_by_key("ABCVIP") or []
-        ignored_codes = [code.strip().upper() for code in ignored_codes]
-        processed_hd_codes = []
-        original_to_processed = {}
-
-        for code in hd_codes:
-            original_code = code.strip().upper()
-
-            if original_code in ignored_codes:
-                processed_code = original_code
-            else:
-                processed_code = original_code[:5]
-
-            processed_hd_codes.append(processed_code)
-            original_to_processed[processed_code] = original_code
-                
-        hd_counts = {code: processed_hd_codes.count(code) for code in set(processed_hd_codes)}
-        total_occurrences = sum(hd_counts.values())
+        # Kế hoạch phân bổ đã tính ở bước xem trước (BudgetPlan)
+        plan = record["data"]
 
         # 🟢 Xử lý hành động YES
         if action == "YES":
+            saved = False
             try:
-                total_budget_by_hd = {}
-
-                all_contract_codes = set(hd_counts.keys())
-
-                for code in list(hd_counts.keys()):
-                    # 🔄 Nếu có mã đuôi "11", thêm mã gốc vào
-                    if code.endswith("11") and len(code) > 2:
-                        all_contract_codes.add(code[:-2])  # FD3N11 ➝ FD3N
-
-                    # 🔄 Nếu mã KHÔNG có số ở cuối (VD: FD3N), thêm mã + "11"
-                    elif not code[-1].isdigit():
-                        all_contract_codes.add(code + "11")  # FD3N ➝ FD3N11
-
-                # 🟢 Lấy ngân sách hiện tại từ MongoDB
                 chat_id = update.effective_chat.id
-                current_budgets = budget_manager.get_current_budget(list(all_contract_codes), data["tổ"],chat_id)
-
-                # 🟢 Lưu từng mã HD vào MongoDB
-                for code, count in hd_counts.items():
-                    budget_share = round(data["ngân sách"] * count / total_occurrences)
-
-                    # 🟢 Lấy ngân sách hiện tại của mã hợp đồng
-                    current_budget = current_budgets.get(code, 0) if current_budgets else 0
-
-                    # 🟢 Tổng ngân sách sau khi cộng thêm đề xuất
-                    projected_budget = current_budget + budget_share
-
-                    # 🟢 Cập nhật tổng ngân sách theo mã HD
-                    total_budget_by_hd[code] = projected_budget
-                    custom_timestamp = get_custom_today_epoch()
-
-                    original_code = original_to_processed.get(code, code)
-                    # 🟢 Lưu vào MongoDB
-                    budget_manager.add_budget(
-                        budget_id=random_code,
-                        team=data["tổ"],
-                        contract_code=code,
-                        original_contract_code=original_code,
-                        group_name=data["tên nhóm"],
-                        chat_id=chat_id,
-                        amount=budget_share,
-                        status="pending",
-                        timestamp=custom_timestamp,
-                        assistant=full_name,
-                        note=data["nội dung"]
+
+                # 🟢 Ghi toàn bộ phân bổ bằng một lần insert_many (`_id` cố định nên bấm lại không ghi trùng)
+                result = await budget_manager.add_budgets_bulk_async(
+                    budget_id=random_code,
+                    team=plan.team,
+                    allocations=plan_allocations(plan),
+                    group_name=plan.group_name,
+                    chat_id=chat_id,
+                    status="pending",
+                    timestamp=get_custom_today_epoch(),
+                    assistant=full_name,
+                    note=plan.note
+                )
+                status = result["status"]
+                if status in (BULK_FAILED, BULK_PARTIAL):
+                    # ↩️ Chưa ghi đủ → trả lại dữ liệu xác nhận để bấm lại ghi tiếp phần còn thiếu
+                    await add_confirmation(confirmation_id, plan, random_code)
+                    await safe_edit_message(
+                        context.bot,
+                        chat_id=query.message.chat.id,
+                        message_id=query.message.message_id,
+                        text="❗ Lỗi khi lưu ngân sách vào hệ thống. Vui lòng thử lại sau.",
+                        parse_mode='Markdown'
+                    )
+                    return
+                # Từ đây dữ liệu có thể đã được ghi → không trả lại xác nhận nữa
+                saved = True
+                if status == BULK_UNKNOWN:
+                    await safe_edit_message(
+                        context.bot,
+                        chat_id=query.message.chat.id,
+                        message_id=query.message.message_id,
+                        text=(
+                            f"⚠️ Không xác định được ngân sách `{random_code}` đã được lưu hay chưa "
+                            f"do lỗi kết nối. Vui lòng kiểm tra bằng /check trước khi tạo lại."
+                        ),
+                        parse_mode='Markdown'
                     )
+                    return
 
-                    logger.info(f"✅ Đã lưu ngân sách vào MongoDB cho MÃ DL: {code}, số tiền: {budget_share}")
+                logger.info(f"✅ Đã lưu {len(result['inserted_ids'])} mã ngân sách vào MongoDB cho ID: {random_code}")
 
                 # 🟢 Gửi thông báo thành công
                 message = (
                     f"✅ **Dữ liệu đã được lưu thành công**\n\n"
                     f"**ID:** `{random_code}`\n"
-                    f"**TỔ:** `{data['tổ']}`\n"
+                    f"**TỔ:** `{plan.team}`\n"
                 )
 
-                for code, count in hd_counts.items():
-                    current_budget = current_budgets.get(code, 0) if current_budgets else 0
-                    budget_share = round(data["ngân sách"] * count / total_occurrences)
-                    
-                    current_budget_show = current_budgets.get(code, 0)
+                for allocation in plan.allocations:
+                    current_budget_show = allocation.current
+                    budget_share = allocation.amount
 
-                
                     message += (
-                        f"**MÃ DL:** `{code} - {count}`\n"
+                        f"**MÃ DL:** `{allocation.contract_code} - {allocation.count}`\n"
                         f"  - **Ngân sách hiện tại:** `{format_number(current_budget_show)} VND`\n"
                         f"  - **Đề xuất:** `{format_number(budget_share)} VND`\n"
                         f"  - **Tổng sau khi cộng:** `{format_number(current_budget_show + budget_share)} VND`\n\n"
-                        f"NỘI DUNG: {data['nội dung']}\n\n"
+                        f"NỘI DUNG: {plan.note}\n\n"
                     )
 
                 await safe_edit_message(
@@ -461,13 +381,14 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     parse_mode='Markdown'
                 )
 
-                # 🗑️ Xóa dữ liệu xác nhận
-                delete_confirmation(confirmation_id)
-                logger.info(f"🗑️ Đã xóa confirmation_id '{confirmation_id}' sau khi xử lý.")
-
             except Exception as e:
                 logger.error(f"❌ Lỗi khi xử lý YES: {e}")
-                await query.edit_message_text(
+                if not saved:
+                    await add_confirmation(confirmation_id, plan, random_code)
+                await safe_edit_message(
+                    context.bot,
+                    chat_id=query.message.chat.id,
+                    message_id=query.message.message_id,
                     text="❗ Lỗi trong quá trình xử lý. Vui lòng thử lại sau.",
                     parse_mode='Markdown'
                 )
@@ -483,11 +404,14 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 text="❌ **Dữ liệu đã bị hủy bỏ.**",
                 parse_mode='Markdown'
             )
-            delete_confirmation(confirmation_id)
-            logger.info(f"🗑️ Đã xóa confirmation_id '{confirmation_id}' sau khi xử lý.")
+            logger.info(f"🗑️ Đã hủy confirmation_id '{confirmation_id}'.")
 
         else:
-            await query.edit_message_text(
+            await add_confirmation(confirmation_id, plan, random_code)
+            await safe_edit_message(
+                context.bot,
+                chat_id=query.message.chat.id,
+                message_id=query.message.message_id,
                 text="❗ **Lỗi:** Hành động không hợp lệ.",
                 parse_mode='Markdown'
             )
@@ -495,11 +419,10 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     except Exception as e:
         logger.error(f"❌ Lỗi trong xử lý button_callback: {e}")
-        await safe_send_message(
+        notify_admins(
             context.bot,
-            chat_id=ADMIN_IDS,
-            text=f"❗ **Lỗi:** {e}",
-            parse_mode='Markdown'
+            query.message.chat_id if query.message else user_id,
+            html.escape(f"Lỗi trong xử lý button_callback: {e} (Người dùng: {full_name}, Username: {username})")
         )
 
 @allowed_room
@@ -520,7 +443,8 @@ async def handle_done_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             context.bot,
             chat_id=update.effective_chat.id,
             text="⚙️ **Đang xử lý yêu cầu của bạn. Vui lòng chờ...**",
-            parse_mode="Markdown"
+            parse_mode="Markdown",
+            priority=PRIORITY_STATUS
         )
 
         budget_id = context.args[0].strip().upper()  # ID ngân sách
@@ -539,8 +463,12 @@ async def handle_done_command(update: Update, context: ContextTypes.DEFAULT_TYPE
                 )
                 return
 
-        # 🟢 Sử dụng hàm mới để lấy danh sách bản ghi `pending`
-        pending_records = budget_manager.get_pending_budgets_by_id(budget_id)
+        # 🟢 Chốt toàn bộ bản ghi `pending` (kèm cập nhật số tiền nếu có) trong một lần bulk_write
+        result = await budget_manager.complete_budgets_async(budget_id, amount)
+        if result is None:
+            raise RuntimeError(f"Không thể chốt ngân sách {budget_id}")
+
+        pending_records = result["pending"]
         logger.info(f"🟢 Danh sách bản ghi `pending` với ID `{budget_id}`: {pending_records}")
         if not pending_records:
             await safe_send_message(
@@ -551,24 +479,19 @@ async def handle_done_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             )
             return
 
-        # 🟢 Nếu có số tiền, cập nhật lại `amount`
-        if amount is not None:
-            for record in pending_records:
-                budget_manager.update_budget(record["_id"], {"amount": amount})
-
-        # 🟢 Cập nhật trạng thái `pending` thành `done`
-        updated_count = budget_manager.update_budget_status(budget_id)
+        updated_count = result["done"]
 
         # 🟢 Tính tổng ngân sách đã chi theo từng `contract_code`
         contract_codes = {record["contract_code"] for record in pending_records}
 
-        total_budget_by_hd = budget_manager.get_current_budget(list(contract_codes),pending_records[0]["team"],chat_id)
+        total_budget_by_hd = await budget_manager.get_current_budget_async(list(contract_codes), pending_records[0]["team"], chat_id)
         amount_done = amount if amount is not None else pending_records[0].get("amount", 0)
         
         success_message = (
             f"✅ **Cập nhật thành công!**\n"
             f"**ID:** `{budget_id}`\n"
-            f"**Số tiền đã DONE:** `{format_number(amount_done)} VND`\n\n"
+            f"**Số tiền đã DONE:** `{format_number(amount_done)} VND`\n"
+            f"**Số bản ghi đã DONE:** `{updated_count}/{len(pending_records)}`\n\n"
         )
         
         for code, total in total_budget_by_hd.items():
@@ -626,7 +549,7 @@ async def handle_rf_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         contract_code = context.args[1].strip().upper()
         original_contract_code = contract_code
         # Dùng hàm mới để chuẩn hóa mã hợp đồng
-        contract_code = QuanLyABCVIP.convert_to_contract_code(contract_code)
+        contract_code = await budget_manager.convert_to_contract_code_async(contract_code)
 
         amount_str = context.args[2]
         modifier = context.args[3] if len(context.args) == 4 else None
@@ -668,7 +591,7 @@ async def handle_rf_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         random_code = generate_random_code(organization)
 
         # Ghi dữ liệu vào MongoDB
-        inserted_id = budget_manager.add_budget(
+        inserted_id = await budget_manager.add_budget_async(
             budget_id=random_code,
             team=organization,
             contract_code=contract_code,  # ✅ Gán mã hợp đồng vào đây
@@ -695,7 +618,7 @@ async def handle_rf_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
         # ✅ Lấy tổng chi của contract_code (đúng format danh sách)
-        contract_budget = budget_manager.get_current_budget([contract_code],organization,chat_id, False, current_timestamp)  # Đảm bảo là danh sách
+        contract_budget = await budget_manager.get_current_budget_async([contract_code], organization, chat_id, False, current_timestamp)  # Đảm bảo là danh sách
         
         # Lấy tổng chi từ MongoDB
         total_chi = contract_budget.get(contract_code, 0)  # Trả về 0 nếu không có dữ liệu
@@ -773,7 +696,7 @@ async def handle_check_command(update: Update, context: ContextTypes.DEFAULT_TYP
         logger.info(f"   - original_contract_code: {mhd_list[0]}")
 
 
-        current_budgets = budget_manager.get_current_budget(mhd_list, organization,chat_id , original_contract_code=mhd_list[0]) or {}
+        current_budgets = await budget_manager.get_current_budget_async(mhd_list, organization, chat_id, original_contract_code=mhd_list[0]) or {}
 
         # 🟢 Lấy giá trị từ dictionary, mặc định là 0 nếu không có
         total_expenses = current_budgets.get(mhd, 0)
@@ -820,6 +743,150 @@ async def handle_check_command(update: Update, context: ContextTypes.DEFAULT_TYP
         )
 
 
+def _format_tiktok_line(uid, info):
+    if not info.get("userInfo"):
+        # không có thông tin user => chắc chắn không tồn tại trên TikTok
+        return f"• <b>{uid}</b>: {info.get('message', 'Không tìm thấy trên TikTok')}"
+    ui = info["userInfo"]
+    line = (
+        f"• <b>{ui['username']}</b> (ID: <code>{ui['user_id']}</code>)\n"
+        f"    Nickname: {ui.get('nickname','–')}, Status: {ui.get('status','–')}"
+    )
+    if info.get("exists"):   # tồn tại trong hệ thống
+        line += "\n    ❌ <b>Đã tồn tại trong hệ thống</b>"
+    else:                    # mới, chưa có trong hệ thống
+        line += "\n    ✅ <b>Chưa có trong hệ thống</b>"
+    return line
+
+
+def _format_facebook_line(uid, info):
+    # 🧩 Nếu userInfo None thì hiển thị lỗi cụ thể
+    if not info.get("userInfo"):
+        return f"• <b>{uid}</b>: {info.get('message', 'Không tìm thấy thông tin.')}"
+    ui = info["userInfo"]
+    line = (
+        f"• <b>{ui.get('username','(không có username)')}</b> "
+        f"(ID: <code>{ui.get('user_id','–')}</code>)\n"
+        f"    Nickname: {ui.get('nickname','–')}, "
+        f"Type: {ui.get('type','–')}, Status: {ui.get('status','–')}"
+    )
+    if info.get("exists"):   # tồn tại trong hệ thống
+        line += "\n    ❌ <b>Đã tồn tại trong hệ thống</b>"
+    else:                    # mới, chưa có trong hệ thống
+        line += "\n    ✅ <b>Chưa có trong hệ thống</b>"
+    return line
+
+
+def _saved_uids(uids, data):
+    """UID đã nhập và username của các tài khoản mới vừa được bulk-save."""
+    saved = []
+    for uid, info in zip(uids, data):
+        if info and not info.get("exists") and info.get("userInfo") is not None:
+            saved.append(uid)
+            if info["userInfo"].get("username"):
+                saved.append(info["userInfo"]["username"])
+    return saved
+
+
+async def _tiktok_check_batch(batch):
+    resp = await api_client.tiktok_bulk_check(batch)
+    logger.info(f"API_BULK_CHECK raw response: {resp.data}")
+    return response_items(resp, batch)
+
+
+async def _facebook_check_batch(batch):
+    resp = await api_client.facebook_bulk_check(batch)
+    logger.info(f"API_FACEBOOK_BULK_CHECK raw response: {resp.data}")
+    return response_items(resp, batch)
+
+
+async def _bulk_check_with_progress(context, chat_id, uids, platform, cache_platform, check_batch, format_line):
+    """
+    Gửi tin nhắn tiến độ rồi kiểm tra `uids`: lấy từ cache trước, chỉ gửi UID chưa có lên backend theo lô,
+    sửa tin nhắn khi có kết quả mới.
+    """
+    results, misses = user_check_cache.lookup(cache_platform, uids)
+    done_cached = len(uids) - results.count(None)
+    logger.info(f"🔎 Kiểm tra {platform}: {done_cached}/{len(uids)} UID lấy từ cache, gửi {len(misses)} UID lên backend.")
+
+    sent = await safe_send_message(
+        context.bot, chat_id,
+        f"🔄 Đang kiểm tra {len(uids)} user trên {platform}...",
+        priority=PRIORITY_STATUS
+    )
+    progress = ThrottledProgress(context.bot, chat_id, sent[0].message_id) if sent else None
+
+    # Vị trí của từng UID cần hỏi backend (một UID có thể xuất hiện nhiều lần trong danh sách)
+    positions = {}
+    for index, (uid, info) in enumerate(zip(uids, results)):
+        if info is None:
+            positions.setdefault(normalize_uid(uid), []).append(index)
+
+    def fill(miss_results):
+        for uid, info in zip(misses, miss_results):
+            if info is not None:
+                for index in positions[normalize_uid(uid)]:
+                    results[index] = info
+
+    async def on_progress(miss_results, done):
+        if not progress:
+            return
+        fill(miss_results)
+        lines = [format_line(uid, info) for uid, info in zip(uids, results) if info is not None]
+        await progress.update(
+            f"🔄 Đã kiểm tra {len(uids) - results.count(None)}/{len(uids)} user trên {platform}...\n\n" + "\n".join(lines),
+            parse_mode="HTML"
+        )
+
+    if misses:
+        miss_results = await check_in_batches(check_batch, misses, on_progress)
+        user_check_cache.store(cache_platform, misses, miss_results)
+        fill(miss_results)
+    return results, progress
+
+
+def _bulk_check_failed_text(platform):
+    """Thông báo khi mọi lô đều lỗi: nói rõ nếu backend đang bị ngắt."""
+    breaker = api_client.breaker.snapshot()
+    if breaker["state"] != STATE_CLOSED:
+        return CircuitOpenError(breaker["name"], breaker["retry_after"]).user_message()
+    return f"❌ Lỗi kết nối tới server kiểm tra {platform}. Vui lòng thử lại sau."
+
+
+async def _finish_bulk_check(context, chat_id, progress, text, **kwargs):
+    """Sửa tin nhắn tiến độ thành kết quả cuối; quá dài thì gửi tin nhắn mới (tự chia nhỏ)."""
+    if progress and len(text) <= MAX_MESSAGE_LENGTH:
+        return await progress.finish(text, parse_mode="HTML", **kwargs)
+    if progress:
+        await progress.finish("✅ Đã kiểm tra xong, kết quả ở tin nhắn bên dưới.")
+    return await safe_send_message(context.bot, chat_id, text, parse_mode="HTML", **kwargs)
+
+
+BULK_KIND_TIKTOK = "tiktok_bulk"
+BULK_KIND_FACEBOOK = "facebook_bulk"
+
+
+async def _bulk_check_expired(context, query):
+    """Token không còn (hết hạn, đã xử lý, hoặc tin nhắn cũ không có token)."""
+    old_text = query.message.text or ""
+    clean_text = old_text.split("\n\nBạn có muốn")[0].strip()
+    return await safe_edit_message(
+        context.bot,
+        chat_id=query.message.chat.id,
+        message_id=query.message.message_id,
+        text=f"{clean_text}\n\n⌛ Kết quả kiểm tra đã hết hạn hoặc đã được xử lý, vui lòng chạy lại lệnh."
+    )
+
+
+async def _bulk_save(save, to_save, kind, token, pending):
+    """Gọi bulk-save; lỗi mạng / backend bị ngắt thì trả dữ liệu về token để bấm lại."""
+    try:
+        return await save(to_save)
+    except Exception:
+        callback_store.put(kind, pending, token=token)
+        raise
+
+
 @allowed_room
 @troly_only
 async def handle_tiktok_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -844,58 +911,19 @@ async def handle_tiktok_command(update: Update, context: ContextTypes.DEFAULT_TY
                 "❗ Không tìm thấy UID hợp lệ nào trong input."
             )
 
-        # 2) gọi API bulk-check
-        await safe_send_message(
-            context.bot, chat_id,
-            f"🔄 Đang kiểm tra {len(uids)} user trên TikTok..."
+        # 2) gọi API bulk-check theo lô, kết quả hiện dần trên tin nhắn tiến độ
+        data, progress = await _bulk_check_with_progress(
+            context, chat_id, uids, "TikTok", PLATFORM_TIKTOK, _tiktok_check_batch, _format_tiktok_line
         )
 
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(API_BULK_CHECK, json={"uids": uids}, timeout=20) as resp:
-                    result = await resp.json()
-                    # 👇 log toàn bộ response để debug
-                    logger.info(f"API_BULK_CHECK raw response: {result}")
-        except aiohttp.ClientError as ce:
-            logger.error(f"Lỗi mạng khi gọi API_BULK_CHECK: {ce}", exc_info=True)
-            return await safe_send_message(
-                context.bot, chat_id,
-                "❌ Lỗi kết nối tới server kiểm tra TikTok. Vui lòng thử lại sau."
-            )
-            
-        except Exception as je:
-            logger.error(f"Lỗi khi parse JSON từ API_BULK_CHECK: {je}", exc_info=True)
-            return await safe_send_message(
-                context.bot, chat_id,
-                "❌ Lỗi xử lý dữ liệu trả về từ server TikTok."
-            )
-
-        data = result.get("data", [])
+        if all(info.get("error") for info in data):
+            return await _finish_bulk_check(context, chat_id, progress, _bulk_check_failed_text("TikTok"))
 
-        # lưu tạm để callback dùng tiếp
-        context.user_data["tiktok_bulk_data"] = data
+        # lưu tạm theo token riêng của tin nhắn này để callback dùng tiếp
+        token = callback_store.put(BULK_KIND_TIKTOK, {"data": data, "uids": uids})
 
         # 3) build message
-        lines = []
-        for idx, info in enumerate(data):
-            uid = uids[idx]
-            logger.info(f"Xử lý UID={uid}, info={info}")
-
-            if not info or not info.get("userInfo"):
-                # không có thông tin user => chắc chắn không tồn tại trên TikTok
-                msg = info.get("message", "Không tìm thấy trên TikTok")
-                lines.append(f"• <b>{uid}</b>: {msg}")
-            else:
-                ui = info["userInfo"]
-                let = (
-                    f"• <b>{ui['username']}</b> (ID: <code>{ui['user_id']}</code>)\n"
-                    f"    Nickname: {ui.get('nickname','–')}, Status: {ui.get('status','–')}"
-                )
-                if info.get("exists"):   # tồn tại trong hệ thống
-                    let += "\n    ❌ <b>Đã tồn tại trong hệ thống</b>"
-                else:                    # mới, chưa có trong hệ thống
-                    let += "\n    ✅ <b>Chưa có trong hệ thống</b>"
-                lines.append(let)
+        lines = [_format_tiktok_line(uid, info) for uid, info in zip(uids, data)]
 
         text = (
             "🔍 <b>Kết quả kiểm tra:</b>\n"
@@ -906,14 +934,11 @@ async def handle_tiktok_command(update: Update, context: ContextTypes.DEFAULT_TY
         # inline keyboard Yes / No
         kb = InlineKeyboardMarkup([
             [
-                InlineKeyboardButton("✅ Có",    callback_data="tiktok_bulk_yes"),
-                InlineKeyboardButton("❌ Không", callback_data="tiktok_bulk_no")
+                InlineKeyboardButton("✅ Có",    callback_data=f"tiktok_bulk_yes|{token}"),
+                InlineKeyboardButton("❌ Không", callback_data=f"tiktok_bulk_no|{token}")
             ]
         ])
-        await safe_send_message(
-            context.bot, chat_id,
-            text, parse_mode="HTML", reply_markup=kb
-        )
+        await _finish_bulk_check(context, chat_id, progress, text, reply_markup=kb)
 
     except Exception as e:
         logger.error(f"Lỗi trong xử lý lệnh /tiktok bulk-check: {e}", exc_info=True)
@@ -925,12 +950,17 @@ async def handle_tiktok_command(update: Update, context: ContextTypes.DEFAULT_TY
 
 
 
+@backend_guard
 async def handle_tiktok_bulk_yes(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Xử lý khi user bấm 'Có'"""
     query = update.callback_query
     await query.answer()
 
-    data = context.user_data.get("tiktok_bulk_data", [])
+    token = callback_token(query.data)
+    pending = callback_store.claim(BULK_KIND_TIKTOK, token)
+    if pending is None:
+        return await _bulk_check_expired(context, query)
+    data = pending["data"]
     user = update.effective_user
     group_name = update.effective_chat.title or f"{user.first_name or ''} {user.last_name or ''}".strip()
     assistant = user.username or "unknown"
@@ -953,23 +983,43 @@ async def handle_tiktok_bulk_yes(update: Update, context: ContextTypes.DEFAULT_T
     
     
     if not to_save:
-        return await query.edit_message_text(f"{clean_text}\n\n❗ Không có tài khoản mới để lưu.")
+        return await safe_edit_message(
+            context.bot,
+            chat_id=query.message.chat.id,
+            message_id=query.message.message_id,
+            text=f"{clean_text}\n\n❗ Không có tài khoản mới để lưu."
+        )
 
     # Gọi API bulk-save với mảng userInfo của các tài khoản mới
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            API_BULK_SAVE,
-            json=to_save,
-            headers={'Content-Type': 'application/json'}
-        ) as resp:
-            res = await resp.json()
+    resp = await _bulk_save(api_client.tiktok_bulk_save, to_save, BULK_KIND_TIKTOK, token, pending)
+    res = resp.data
 
     if resp.status in (200, 201):
+        # Trạng thái "exists" của các UID vừa lưu đã đổi → bỏ khỏi cache kiểm tra
+        user_check_cache.invalidate(PLATFORM_TIKTOK, _saved_uids(pending["uids"], data))
         new_text = f"{clean_text}\n\n✅ Đã lưu thành công các tài khoản mới vào hệ thống!"
     else:
-        new_text = f"{clean_text}\n\n❌ Lưu thất bại: {res.get('message','Không rõ lỗi')}"
+        # Giữ dữ liệu và nút bấm để thử lưu lại
+        callback_store.put(BULK_KIND_TIKTOK, pending, token=token)
+        message = res.get('message', 'Không rõ lỗi') if isinstance(res, dict) else 'Không rõ lỗi'
+        return await safe_edit_message(
+            context.bot,
+            chat_id=query.message.chat.id,
+            message_id=query.message.message_id,
+            text=(
+                f"{clean_text}\n\nBạn có muốn lưu (hoặc cập nhật) những tài khoản này không?"
+                f"\n❌ Lưu thất bại: {message}"
+            ),
+            parse_mode="HTML", reply_markup=query.message.reply_markup
+        )
 
-    await query.edit_message_text(new_text, parse_mode="HTML")
+    await safe_edit_message(
+        context.bot,
+        chat_id=query.message.chat.id,
+        message_id=query.message.message_id,
+        text=new_text,
+        parse_mode="HTML"
+    )
 
 
 
@@ -977,9 +1027,15 @@ async def handle_tiktok_bulk_no(update: Update, context: ContextTypes.DEFAULT_TY
     """Xử lý khi user bấm 'Không'"""
     query = update.callback_query
     await query.answer()
+    callback_store.discard(callback_token(query.data))
     old_text = query.message.text or ""
     clean_text = old_text.split("\n\nBạn có muốn")[0].strip()
-    await query.edit_message_text(f"{clean_text}\n\n❌ Đã hủy thao tác lưu tài khoản.")
+    await safe_edit_message(
+        context.bot,
+        chat_id=query.message.chat.id,
+        message_id=query.message.message_id,
+        text=f"{clean_text}\n\n❌ Đã hủy thao tác lưu tài khoản."
+    )
 
 @allowed_room
 @troly_only
@@ -1001,52 +1057,16 @@ async def handle_facebook_command(update: Update, context: ContextTypes.DEFAULT_
             "❗ Không tìm thấy username hợp lệ nào."
         )
 
-    # 2) gọi API bulk-check
-    await safe_send_message(
-        context.bot, chat_id,
-        f"🔄 Đang kiểm tra {len(uids)} user trên Facebook..."
+    # 2) gọi API bulk-check theo lô, kết quả hiện dần trên tin nhắn tiến độ
+    data, progress = await _bulk_check_with_progress(
+        context, chat_id, uids, "Facebook", PLATFORM_FACEBOOK, _facebook_check_batch, _format_facebook_line
     )
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(API_FACEBOOK_BULK_CHECK, json={"uids": uids}) as resp:
-            result = await resp.json()
-            logger.info(f"API_FACEBOOK_BULK_CHECK raw response: {result}")
-
-    data = result.get("data", [])
-
-    # lưu tạm để callback dùng tiếp
-    context.user_data["facebook_bulk_data"] = data
+    if all(info.get("error") for info in data):
+        return await _finish_bulk_check(context, chat_id, progress, _bulk_check_failed_text("Facebook"))
 
     # 3) build message kết quả
-    lines = []
-    for idx, info in enumerate(data):
-        uid = uids[idx]
-
-        # 🧩 Nếu info None hoặc userInfo None thì hiển thị lỗi cụ thể
-        if not info or not info.get("userInfo"):
-            msg = info.get("message", "Không tìm thấy thông tin.")
-            lines.append(f"• <b>{uid}</b>: {msg}")
-            continue  # bỏ qua phần dưới
-
-        # ✅ Nếu có userInfo thì xử lý bình thường
-        ui = info["userInfo"]
-        let = (
-            f"• <b>{ui.get('username','(không có username)')}</b> "
-            f"(ID: <code>{ui.get('user_id','–')}</code>)\n"
-            f"    Nickname: {ui.get('nickname','–')}, "
-            f"Type: {ui.get('type','–')}, Status: {ui.get('status','–')}"
-        )
-
-        if info.get("exists"):   # tồn tại trong hệ thống
-            let += "\n    ❌ <b>Đã tồn tại trong hệ thống</b>"
-        else:                    # mới, chưa có trong hệ thống
-            let += "\n    ✅ <b>Chưa có trong hệ thống</b>"
-
-        lines.append(let)
-
-    # Nếu không có user hợp lệ nào thì dừng luôn
-    if not lines:
-        return await safe_send_message(context.bot, chat_id, "❗ Không có dữ liệu hợp lệ để hiển thị.")
+    lines = [_format_facebook_line(uid, info) for uid, info in zip(uids, data)]
 
     text = (
         "🔍 <b>Kết quả kiểm tra Facebook users:</b>\n"
@@ -1057,29 +1077,32 @@ async def handle_facebook_command(update: Update, context: ContextTypes.DEFAULT_
     # 🧩 Kiểm tra: nếu không có user mới (exists == False) thì không hiện nút
     has_new_user = any(info.get("userInfo") and not info.get("exists") for info in data)
     if not has_new_user:
-        return await safe_send_message(context.bot, chat_id, text, parse_mode="HTML")
+        return await _finish_bulk_check(context, chat_id, progress, text)
 
-    # Nếu có user mới → hiện Yes/No
+    # Nếu có user mới → lưu tạm theo token riêng của tin nhắn này và hiện Yes/No
+    token = callback_store.put(BULK_KIND_FACEBOOK, {"data": data, "uids": uids})
     kb = InlineKeyboardMarkup([
         [
-            InlineKeyboardButton("✅ Có", callback_data="facebook_bulk_yes"),
-            InlineKeyboardButton("❌ Không", callback_data="facebook_bulk_no")
+            InlineKeyboardButton("✅ Có", callback_data=f"facebook_bulk_yes|{token}"),
+            InlineKeyboardButton("❌ Không", callback_data=f"facebook_bulk_no|{token}")
         ]
     ])
 
-    await safe_send_message(
-        context.bot, chat_id,
-        text, parse_mode="HTML", reply_markup=kb
-    )
+    await _finish_bulk_check(context, chat_id, progress, text, reply_markup=kb)
 
 
 
+@backend_guard
 async def handle_facebook_bulk_yes(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Xử lý khi user bấm 'Có' cho Facebook"""
     query = update.callback_query
     await query.answer()
 
-    data = context.user_data.get("facebook_bulk_data", [])
+    token = callback_token(query.data)
+    pending = callback_store.claim(BULK_KIND_FACEBOOK, token)
+    if pending is None:
+        return await _bulk_check_expired(context, query)
+    data = pending["data"]
     # chỉ lấy những record exists=False và có userInfo
     user = update.effective_user
     group_name = update.effective_chat.title or f"{user.first_name or ''} {user.last_name or ''}".strip()
@@ -1102,33 +1125,58 @@ async def handle_facebook_bulk_yes(update: Update, context: ContextTypes.DEFAULT
     clean_text = old_text.split("\n\nBạn có muốn")[0].strip()
     
     if not to_save:
-        return await query.edit_message_text(f"{clean_text}\n\n❗ Không có tài khoản mới để lưu.")
+        return await safe_edit_message(
+            context.bot,
+            chat_id=query.message.chat.id,
+            message_id=query.message.message_id,
+            text=f"{clean_text}\n\n❗ Không có tài khoản mới để lưu."
+        )
 
     # gọi API bulk-save
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            API_FACEBOOK_BULK_SAVE,
-            json=to_save,
-            headers={'Content-Type': 'application/json'}
-        ) as resp:
-            res = await resp.json()
+    resp = await _bulk_save(api_client.facebook_bulk_save, to_save, BULK_KIND_FACEBOOK, token, pending)
+    res = resp.data
 
-    
     if resp.status in (200, 201):
+        # Trạng thái "exists" của các UID vừa lưu đã đổi → bỏ khỏi cache kiểm tra
+        user_check_cache.invalidate(PLATFORM_FACEBOOK, _saved_uids(pending["uids"], data))
         new_text = f"{clean_text}\n\n✅ Đã lưu thành công các tài khoản mới vào hệ thống!"
     else:
-        new_text = f"{clean_text}\n\n❌ Lưu thất bại: {res.get('message','Không rõ lỗi')}"
+        # Giữ dữ liệu và nút bấm để thử lưu lại
+        callback_store.put(BULK_KIND_FACEBOOK, pending, token=token)
+        message = res.get('message', 'Không rõ lỗi') if isinstance(res, dict) else 'Không rõ lỗi'
+        return await safe_edit_message(
+            context.bot,
+            chat_id=query.message.chat.id,
+            message_id=query.message.message_id,
+            text=(
+                f"{clean_text}\n\nBạn có muốn lưu (hoặc cập nhật) những tài khoản này không?"
+                f"\n❌ Lưu thất bại: {message}"
+            ),
+            parse_mode="HTML", reply_markup=query.message.reply_markup
+        )
 
-    await query.edit_message_text(new_text, parse_mode="HTML")
+    await safe_edit_message(
+        context.bot,
+        chat_id=query.message.chat.id,
+        message_id=query.message.message_id,
+        text=new_text,
+        parse_mode="HTML"
+    )
 
 
 async def handle_facebook_bulk_no(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Xử lý khi user bấm 'Không' cho Facebook"""
     query = update.callback_query
     await query.answer()
+    callback_store.discard(callback_token(query.data))
     old_text = query.message.text or ""
     clean_text = old_text.split("\n\nBạn có muốn")[0].strip()
-    await query.edit_message_text(f"{clean_text}\n\n❌ Đã hủy thao tác lưu Facebook user.")
+    await safe_edit_message(
+        context.bot,
+        chat_id=query.message.chat.id,
+        message_id=query.message.message_id,
+        text=f"{clean_text}\n\n❌ Đã hủy thao tác lưu Facebook user."
+    )
 
 
 @allowed_room
@@ -1188,7 +1236,7 @@ async def handle_note_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         chat_title = update.effective_chat.title or "Không rõ tên nhóm"
 
         # Lưu ghi chú vào MongoDB
-        inserted_id = note_manager.add_note(
+        inserted_id = await note_manager.add_note_async(
             chat_title=chat_title,
             note_type=valid_types[note_type],
             timestamp=current_time,
@@ -1223,16 +1271,10 @@ async def handle_note_command(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     except Exception as e:
         logger.error(f"Lỗi trong xử lý lệnh /note: {e}", exc_info=True)
-        error_message = (
-            f"❗ **Lỗi:** {e}\n\n"
-            f"**Người dùng:** {full_name} (Username: {username})"
-        )
-
-        await safe_send_message(
+        notify_admins(
             context.bot,
-            chat_id=ADMIN_IDS,
-            text=error_message,
-            parse_mode='Markdown'
+            chat_id,
+            html.escape(f"Lỗi trong xử lý lệnh /note: {e} (Người dùng: {full_name}, Username: {username})")
         )
         await safe_send_message(
             context.bot,
@@ -1244,6 +1286,7 @@ async def handle_note_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         
 @allowed_room
 @troly_only
+@backend_guard
 async def handle_tiktok_bulk(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     /tiktok_bulk nick1,nick2,nick3
@@ -1260,14 +1303,12 @@ async def handle_tiktok_bulk(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     raw = " ".join(context.args)
     usernames = [u.strip() for u in raw.split(",") if u.strip()]
-    payload = {
-        "usernames": usernames,
-        "groupName": update.effective_chat.title or "Private",
-        "assistant": update.effective_user.username or update.effective_user.full_name
-    }
-    async with aiohttp.ClientSession() as session:
-        async with session.post(API_BULK_URL, json=payload) as resp:
-            data = await resp.json()
+    resp = await api_client.tiktok_bulk_create(
+        usernames,
+        group_name=update.effective_chat.title or "Private",
+        assistant=update.effective_user.username or update.effective_user.full_name
+    )
+    data = resp.data
 
     if resp.status not in (200, 207):
         return await safe_send_message(
@@ -1276,6 +1317,9 @@ async def handle_tiktok_bulk(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
 
     # giả sử API trả về {"results":[{username,status,message,...},...]}
+    user_check_cache.invalidate(
+        PLATFORM_TIKTOK, [r["username"] for r in data.get("results", []) if r.get("status") == "created"]
+    )
     lines = []
     for r in data.get("results", []):
         lines.append(f"{'✅' if r['status']=='created' else '❌'} {r['username']}: {r['message']}")
@@ -1288,6 +1332,7 @@ async def handle_tiktok_bulk(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 @allowed_room
 @troly_only
+@backend_guard
 async def handle_tiktok_check(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     /tiktok_check nick
@@ -1302,9 +1347,8 @@ async def handle_tiktok_check(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
 
     username = context.args[0].strip()
-    async with aiohttp.ClientSession() as session:
-        async with session.post(API_CHECK_URL, json={"username": username}) as resp:
-            data = await resp.json()
+    resp = await api_client.tiktok_check_username(username)
+    data = resp.data
 
     if resp.status != 200:
         return await safe_send_message(
@@ -1349,33 +1393,29 @@ async def handle_xn_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # Kiểm tra quyền trợ lý hoặc admin
         user_id = user.id
-        troly_ids = cache_data(context, 'troly_ids', assistant_manager.load_troly_ids)
+        troly_ids = await cache_data_async(context, 'troly_ids', assistant_manager.load_troly_ids_async)
         is_troly_or_admin = user_id in troly_ids or user_id in ADMIN_IDS
 
-        # Payload gửi API
-        payload = {
-            "agent": agent,
-            "employeeType": "nhân viên offline",
-            "inputBudgets": input_budgets,
-            "ratioBudgetToKpi": 0,
-            "ratioDepositToBudget": 0,
-            "ratioWagerToDeposit": 0,
-            "dryRun": not is_troly_or_admin,   # chỉ ghi DB nếu là trợ lý hoặc admin
-            "createdBy": assistant              # truyền username người gửi
-        }
-
         await safe_send_message(
             context.bot, chat_id,
             f"🔄 Đang tính HQQC cho đại lý <b>{agent}</b>...",
-            parse_mode="HTML"
+            parse_mode="HTML",
+            priority=PRIORITY_STATUS
         )
 
         # 2️⃣ Gọi API
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(API_AGENCY_KPI, json=payload, timeout=30) as resp:
-                    result = await resp.json()
-                    logger.info(f"API_AGENCY_KPI raw response: {result}")
+            # dryRun: các /xn giống nhau dùng chung request và cache ngắn; ghi DB luôn gọi thẳng backend
+            result = (await kpi_lookup.lookup(
+                agent,
+                input_budgets,
+                dry_run=not is_troly_or_admin,  # chỉ ghi DB nếu là trợ lý hoặc admin
+                created_by=assistant            # truyền username người gửi
+            )).data
+            logger.info(f"API_AGENCY_KPI raw response: {result}")
+        except CircuitOpenError as coe:
+            logger.warning(f"⛔ /xn bị từ chối: {coe}")
+            return await safe_send_message(context.bot, chat_id, coe.user_message())
         except aiohttp.ClientError as ce:
             logger.error(f"Lỗi mạng khi gọi API_AGENCY_KPI: {ce}", exc_info=True)
             return await safe_send_message(
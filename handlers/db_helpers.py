@@ -1,262 +1,496 @@
 import sqlite3
+import asyncio
 import logging
-from datetime import datetime, timedelta
-import json
+import queue
+import threading
+import time
+from datetime import datetime
+import config
+from handlers import pending_codec
 
 logger = logging.getLogger(__name__)
 
-# Khởi tạo cơ sở dữ liệu
-def init_db(db_path="bot_data.db"):
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS confirmation_data (
-            id TEXT PRIMARY KEY,
-            data TEXT NOT NULL,
-            code TEXT NOT NULL,
-            created_at TEXT NOT NULL
-        )
-        """)
-        # Bảng pending_rp_data
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS pending_rp_data (
-            id TEXT PRIMARY KEY,
-            data TEXT NOT NULL,
-            created_at TEXT NOT NULL
-        )
-        """)
-        # Bảng pending_hold_data
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS pending_hold_data (
-            id TEXT PRIMARY KEY,
-            data TEXT NOT NULL,
-            created_at TEXT NOT NULL
-        )
-        """)
-        # Bảng pending_naptien_data
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS pending_naptien_data (
-            id TEXT PRIMARY KEY,
-            data TEXT NOT NULL,
-            created_at TEXT NOT NULL
+DB_PATH = "bot_data.db"
+# Số thao tác tối đa gom vào một transaction (một lần fsync)
+MAX_GROUP_SIZE = 64
+# Số dòng hết hạn tối đa xóa trong một transaction khi dọn dẹp
+CLEANUP_BATCH_SIZE = 500
+
+_STOP = object()
+
+KIND_CONFIRMATION = "confirmation"
+KIND_RP = "rp"
+KIND_HOLD = "hold"
+KIND_NAPTIEN = "naptien"
+
+# Thời gian sống (giây) của từng loại dữ liệu chờ xác nhận
+PENDING_TTL = {
+    KIND_CONFIRMATION: config.EXPIRATION_TIME,
+    KIND_RP: config.EXPIRATION_TIME,
+    KIND_HOLD: config.EXPIRATION_TIME,
+    KIND_NAPTIEN: config.EXPIRATION_TIME,
+}
+
+# Một bảng duy nhất cho mọi loại, khóa (kind, id); expires_at là epoch (giây) và có index
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS pending (
+        kind TEXT NOT NULL,
+        id TEXT NOT NULL,
+        data TEXT NOT NULL,
+        code TEXT,
+        created_at REAL NOT NULL,
+        expires_at REAL NOT NULL,
+        PRIMARY KEY (kind, id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_pending_expires_at ON pending (expires_at)",
+]
+
+# Bảng cũ (mỗi loại một bảng) → kind tương ứng, dùng khi chuyển dữ liệu sang bảng `pending`
+LEGACY_TABLES = {
+    "confirmation_data": KIND_CONFIRMATION,
+    "pending_rp_data": KIND_RP,
+    "pending_hold_data": KIND_HOLD,
+    "pending_naptien_data": KIND_NAPTIEN,
+}
+
+
+def _to_epoch(value):
+    """created_at cũ có thể là chuỗi ISO (budget) hoặc số epoch (rp/hold/naptien)."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+def _migrate_legacy_tables(conn):
+    legacy = [
+        row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ({})".format(
+                ",".join("?" * len(LEGACY_TABLES))
+            ),
+            tuple(LEGACY_TABLES),
         )
-        """)
-        conn.commit()
-        logger.info("Cơ sở dữ liệu đã được khởi tạo.")
-
-# Thêm confirmation_id
-def add_confirmation(id, data, code, created_at, db_path="bot_data.db"):
-    data_json = json.dumps(data)
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-        INSERT INTO confirmation_data (id, data, code, created_at)
-        VALUES (?, ?, ?, ?)
-        """, (id, data_json, code, created_at))
-        conn.commit()
-        logger.info(f"Đã thêm confirmation_id: {id}")
-
-# Lấy confirmation_id
-def get_confirmation(id, db_path="bot_data.db"):
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-        SELECT id, data, code, created_at FROM confirmation_data WHERE id = ?
-        """, (id,))
-        result = cursor.fetchone()
-        if result:
-            return {
-                "id": result[0],
-                "data": json.loads(result[1]),
-                "code": result[2],
-                "created_at": result[3]
-            }
-        return None
+    ]
+    if not legacy:
+        return
 
-# Xóa confirmation_id
-def delete_confirmation(id, db_path="bot_data.db"):
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-        DELETE FROM confirmation_data WHERE id = ?
-        """, (id,))
-        conn.commit()
-        logger.info(f"Đã xóa confirmation_id: {id}")
-
-# Xóa các confirmation_id đã hết hạn
-def cleanup_expired_confirmations(expiration_seconds=86400, db_path="bot_data.db"):
+    conn.execute("BEGIN")
     try:
-        expiration_time = (datetime.now() - timedelta(seconds=expiration_seconds)).isoformat()
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                DELETE FROM confirmation_data WHERE created_at < ?
-            """, (expiration_time,))
-            rows_deleted = cursor.rowcount
-            conn.commit()
-            logger.info(f"Đã xóa {rows_deleted} confirmation_id hết hạn.")
+        for table in legacy:
+            kind = LEGACY_TABLES[table]
+            columns = "id, data, code, created_at" if kind == KIND_CONFIRMATION else "id, data, NULL, created_at"
+            rows = conn.execute(f"SELECT {columns} FROM {table}").fetchall()
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO pending (kind, id, data, code, created_at, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (kind, id, data, code, _to_epoch(created_at), _to_epoch(created_at) + PENDING_TTL[kind])
+                    for id, data, code, created_at in rows
+                ],
+            )
+            conn.execute(f"DROP TABLE {table}")
+            logger.info(f"Đã chuyển {len(rows)} dòng từ {table} sang bảng pending.")
+        conn.execute("COMMIT")
     except Exception as e:
-        logger.error(f"Lỗi khi dọn dẹp confirmation_id: {e}", exc_info=True)
-
-def add_pending_rp(id, data, created_at, db_path="bot_data.db"):
-    data_json = json.dumps(data)
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-        INSERT OR REPLACE INTO pending_rp_data (id, data, created_at)
-        VALUES (?, ?, ?)
-        """, (id, data_json, created_at))
-        conn.commit()
-        logger.info(f"Đã thêm pending_rp: {id}")
-
-def get_pending_rp(id, db_path="bot_data.db"):
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT data FROM pending_rp_data WHERE id = ?", (id,))
-        result = cursor.fetchone()
-        if result:
-            data = json.loads(result[0])
-            # 🔹 Chỉ giữ các field hợp lệ
-            return {
-                "ad_ids": data.get("ad_ids"),
-                "spend": data.get("spend"),
-                "ad_type": data.get("ad_type"),
-                "note": data.get("note"),
-                "group_name": data.get("group_name"),
-                "group_id": data.get("group_id"),
-                "sender": data.get("sender"),
-                "ad_date": data.get("ad_date"),
-                "hold": data.get("hold"),
-                "mess_num": data.get("mess_num"),
-                "id_bc": data.get("id_bc"),
-            }
-        return None
+        # Không để kết nối kẹt trong transaction dở (mọi lần commit sau sẽ lỗi); bảng cũ giữ nguyên,
+        # lần khởi động sau sẽ chuyển lại
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        logger.error(f"❌ Lỗi khi chuyển dữ liệu từ bảng cũ, đã rollback: {e}", exc_info=True)
+
+
+def _resolve(future, result, error):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class PendingStore:
+    """
+    Kho lưu dữ liệu chờ xác nhận (SQLite) dùng một kết nối duy nhất ở chế độ WAL.
+    - Mọi thao tác chạy trên một thread riêng nên không chặn event loop.
+    - Các thao tác đến cùng lúc được gom vào một transaction (group commit) → ít fsync hơn.
+    - Câu lệnh SQL cố định nên được sqlite3 cache (prepared statement) trên kết nối này.
+    """
+    _instance = None  # Singleton instance
+
+    def __new__(cls, db_path=DB_PATH):
+        if cls._instance is None:
+            cls._instance = super(PendingStore, cls).__new__(cls)
+            cls._instance._init_store(db_path)
+        return cls._instance
+
+    def _init_store(self, db_path):
+        self.db_path = db_path
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        # Lỗi làm thread xử lý dừng hẳn (vd không mở được DB); khóa này giữ cho việc đưa thao tác vào hàng đợi
+        # và việc trả lỗi cho các thao tác còn trong hàng đợi không xen vào nhau
+        self._error = None
+        self._submit_lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, isolation_level=None, cached_statements=64)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            for statement in SCHEMA:
+                conn.execute(statement)
+            _migrate_legacy_tables(conn)
+        except Exception:
+            conn.close()
+            raise
+        logger.info("Cơ sở dữ liệu đã được khởi tạo (WAL).")
+        return conn
+
+    def start(self):
+        """Khởi động thread xử lý (gọi nhiều lần không sao; không khởi động lại sau lỗi không phục hồi được)."""
+        with self._start_lock:
+            if self._error is None and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, name="pending-store", daemon=True)
+                self._thread.start()
+
+    def close(self):
+        """Dừng thread sau khi xử lý hết các thao tác đang chờ, rồi đóng kết nối."""
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                self._queue.put(_STOP)
+                self._thread.join()
+            self._thread = None
+
+    def _fail_pending(self, error):
+        """Thread xử lý dừng vì lỗi: trả lỗi cho mọi thao tác đang chờ, các lần gọi sau sẽ báo lỗi ngay."""
+        with self._submit_lock:
+            self._error = error
+            jobs = []
+            while True:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not _STOP:
+                    jobs.append(job)
+        for _, future, loop, _ in jobs:
+            try:
+                loop.call_soon_threadsafe(_resolve, future, None, error)
+            except RuntimeError:
+                pass  # event loop đã đóng
+
+    def _run(self):
+        try:
+            conn = self._connect()
+        except Exception as e:
+            logger.error(f"❌ Không mở được cơ sở dữ liệu {self.db_path}: {e}", exc_info=True)
+            self._fail_pending(e)
+            return
+        try:
+            self._loop(conn)
+        except Exception as e:
+            logger.error(f"❌ Thread xử lý dữ liệu chờ dừng vì lỗi: {e}", exc_info=True)
+            self._fail_pending(e)
+        finally:
+            conn.close()
+        logger.info("Đã đóng kết nối SQLite.")
+
+    def _loop(self, conn):
+        stopping = False
+        while not stopping:
+            job = self._queue.get()
+            if job is _STOP:
+                break
+            group = []
+            # Gom các thao tác đang xếp hàng vào cùng một transaction
+            while True:
+                if job[3]:
+                    group.append(job)
+                else:
+                    # Thao tác không chạy được trong transaction (VACUUM, checkpoint) → chạy riêng
+                    self._run_group(conn, group)
+                    group = []
+                    self._run_standalone(conn, job)
+                if len(group) >= MAX_GROUP_SIZE:
+                    break
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is _STOP:
+                    stopping = True
+                    break
+            self._run_group(conn, group)
+
+    @staticmethod
+    def _run_standalone(conn, job):
+        operation, future, loop, _ = job
+        try:
+            result, error = operation(conn), None
+        except Exception as e:
+            result, error = None, e
+        loop.call_soon_threadsafe(_resolve, future, result, error)
+
+    @staticmethod
+    def _run_group(conn, group):
+        if not group:
+            return
+        results = []
+        try:
+            conn.execute("BEGIN")
+        except Exception as e:
+            logger.error(f"Lỗi khi mở transaction: {e}", exc_info=True)
+            for _, future, loop, _ in group:
+                loop.call_soon_threadsafe(_resolve, future, None, e)
+            return
+        for operation, future, loop, _ in group:
+            try:
+                results.append((future, loop, operation(conn), None))
+            except Exception as e:
+                results.append((future, loop, None, e))
+        try:
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"Lỗi khi commit nhóm {len(group)} thao tác: {e}", exc_info=True)
+            try:
+                conn.execute("ROLLBACK")
+            except Exception as rollback_error:
+                # Không để lỗi rollback làm chết luồng ghi; nơi gọi vẫn nhận lỗi commit gốc
+                logger.error(f"Lỗi khi rollback: {rollback_error}", exc_info=True)
+            results = [(future, loop, None, e) for future, loop, _, _ in results]
+
+        # Chỉ trả kết quả sau khi đã commit xong
+        for future, loop, result, error in results:
+            loop.call_soon_threadsafe(_resolve, future, result, error)
+
+    async def execute(self, operation, transactional=True):
+        """
+        Đưa `operation(conn)` vào hàng đợi và chờ kết quả (sau commit).
+        :param transactional: False với lệnh không chạy được trong transaction (VACUUM, wal_checkpoint)
+        """
+        self.start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._submit_lock:
+            if self._error is not None:
+                raise RuntimeError(f"Kho dữ liệu chờ không khả dụng: {self._error}") from self._error
+            self._queue.put((operation, future, loop, transactional))
+        return await future
 
-def delete_pending_rp(id, db_path="bot_data.db"):
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM pending_rp_data WHERE id = ?", (id,))
-        conn.commit()
-        logger.info(f"Đã xóa pending_rp: {id}")
+
+pending_store = PendingStore()
 
 
 # =========================
-# pending_hold_data
+# Thao tác chung trên bảng pending
 # =========================
-def add_pending_hold(id, data, created_at, db_path="bot_data.db"):
-    data_json = json.dumps(data)
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-        INSERT OR REPLACE INTO pending_hold_data (id, data, created_at)
-        VALUES (?, ?, ?)
-        """, (id, data_json, created_at))
-        conn.commit()
-        logger.info(f"Đã thêm pending_hold: {id}")
-
-def get_pending_hold(id, db_path="bot_data.db"):
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT data FROM pending_hold_data WHERE id = ?", (id,))
-        result = cursor.fetchone()
-        if result:
-            data = json.loads(result[0])
-            return {
-                "id_bc": data.get("id_bc"),
-                "hold": data.get("hold"),
-                "ten_tele": data.get("ten_tele"),  
-                # 👆 chỉ lưu tên tele ở bước này
-                # KHÔNG có nguoi_hanh_dong ở đây
-            }
+async def _put(kind, id, record, code=None, created_at=None):
+    """:param created_at: truyền lại created_at cũ khi trả dữ liệu về sau khi lưu lỗi, để giữ nguyên hạn"""
+    data_json = pending_codec.encode(kind, record)
+    if created_at is None:
+        created_at = time.time()
+    expires_at = created_at + PENDING_TTL[kind]
+    await pending_store.execute(lambda conn: conn.execute("""
+        INSERT OR REPLACE INTO pending (kind, id, data, code, created_at, expires_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """, (kind, id, data_json, code, created_at, expires_at)))
+    logger.info(f"Đã thêm pending {kind}: {id}")
+
+def _decode(kind, id, row):
+    """row = (data, code, created_at) → (bản ghi có kiểu, code, created_at); payload hỏng coi như hết hạn."""
+    try:
+        return pending_codec.decode(kind, row[0]), row[1], row[2]
+    except ValueError as e:
+        logger.warning(f"⚠️ Bỏ qua pending {kind} '{id}': {e}")
         return None
 
-def delete_pending_hold(id, db_path="bot_data.db"):
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM pending_hold_data WHERE id = ?", (id,))
-        conn.commit()
-        logger.info(f"Đã xóa pending_hold: {id}")
+async def _get(kind, id):
+    """Trả về (data, code, created_at) nếu còn hạn, ngược lại None."""
+    now = time.time()
+    result = await pending_store.execute(lambda conn: conn.execute("""
+        SELECT data, code, created_at FROM pending WHERE kind = ? AND id = ? AND expires_at > ?
+        """, (kind, id, now)).fetchone())
+    if result:
+        return _decode(kind, id, result)
+    return None
+
+async def _claim(kind, id):
+    """
+    Lấy và xóa dữ liệu chờ trong MỘT thao tác (SELECT rồi DELETE trong cùng transaction của luồng ghi).
+    Hai người bấm cùng lúc thì chỉ một người nhận được dữ liệu, người còn lại nhận None.
+    (Không dùng DELETE ... RETURNING vì cần SQLite >= 3.35.)
+    """
+    now = time.time()
+
+    def claim(conn):
+        row = conn.execute("""
+            SELECT data, code, created_at FROM pending WHERE kind = ? AND id = ? AND expires_at > ?
+            """, (kind, id, now)).fetchone()
+        if row:
+            conn.execute("DELETE FROM pending WHERE kind = ? AND id = ?", (kind, id))
+        return row
+
+    row = await pending_store.execute(claim)
+    if row:
+        logger.info(f"Đã nhận pending {kind}: {id}")
+        return _decode(kind, id, row)
+    return None
+
+async def _delete(kind, id):
+    await pending_store.execute(
+        lambda conn: conn.execute("DELETE FROM pending WHERE kind = ? AND id = ?", (kind, id))
+    )
+    logger.info(f"Đã xóa pending {kind}: {id}")
+
+async def _get_record(kind, id):
+    result = await _get(kind, id)
+    return result[0] if result else None
+
+async def _claim_record(kind, id):
+    result = await _claim(kind, id)
+    return result[0] if result else None
 
 
 # =========================
-# pending_naptien_data
+# confirmation (/ns)
 # =========================
-def add_pending_naptien(id, data, created_at, db_path="bot_data.db"):
-    data_json = json.dumps(data)
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-        INSERT OR REPLACE INTO pending_naptien_data (id, data, created_at)
-        VALUES (?, ?, ?)
-        """, (id, data_json, created_at))
-        conn.commit()
-        logger.info(f"Đã thêm pending_naptien: {id}")
-
-def get_pending_naptien(id, db_path="bot_data.db"):
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT data FROM pending_naptien_data WHERE id = ?", (id,))
-        result = cursor.fetchone()
-        if result:
-            data = json.loads(result[0])
-            return {
-                "id_bc": data.get("id_bc"),
-                "so_tien_nap": data.get("so_tien_nap"),
-                "ten_tele": data.get("ten_tele"),
-                "ads": data.get("ads"),  # dùng để kiểm tra người confirm
-            }
-        return None
+async def add_confirmation(id, plan, code):
+    """:param plan: `BudgetPlan` tính ở bước xem trước /ns"""
+    await _put(KIND_CONFIRMATION, id, plan, code)
+
+async def get_confirmation(id):
+    result = await _get(KIND_CONFIRMATION, id)
+    if result:
+        data, code, created_at = result
+        return {
+            "id": id,
+            "data": data,
+            "code": code,
+            "created_at": created_at
+        }
+    return None
+
+async def claim_confirmation(id):
+    """Nhận (và xóa) confirmation; nếu ghi thất bại thì trả lại bằng `add_confirmation`."""
+    result = await _claim(KIND_CONFIRMATION, id)
+    if result:
+        data, code, created_at = result
+        return {
+            "id": id,
+            "data": data,
+            "code": code,
+            "created_at": created_at
+        }
+    return None
+
+async def delete_confirmation(id):
+    await _delete(KIND_CONFIRMATION, id)
+
+
+# =========================
+# pending rp / hold / naptien
+# =========================
+async def add_pending_rp(id, record):
+    await _put(KIND_RP, id, record)
+
+async def get_pending_rp(id):
+    return await _get_record(KIND_RP, id)
+
+async def claim_pending_rp(id):
+    return await _claim_record(KIND_RP, id)
+
+async def delete_pending_rp(id):
+    await _delete(KIND_RP, id)
+
+async def add_pending_hold(id, record):
+    await _put(KIND_HOLD, id, record)
+
+async def get_pending_hold(id):
+    return await _get_record(KIND_HOLD, id)
+
+async def claim_pending_hold(id):
+    return await _claim_record(KIND_HOLD, id)
+
+async def delete_pending_hold(id):
+    await _delete(KIND_HOLD, id)
 
-def delete_pending_naptien(id, db_path="bot_data.db"):
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM pending_naptien_data WHERE id = ?", (id,))
-        conn.commit()
-        logger.info(f"Đã xóa pending_naptien: {id}")
-        
-# Xóa các pending_rp_data hết hạn
-def cleanup_expired_rp(expiration_seconds=86400, db_path="bot_data.db"):
+async def add_pending_naptien(id, record, created_at=None):
+    await _put(KIND_NAPTIEN, id, record, created_at=created_at)
+
+async def get_pending_naptien(id):
+    return await _get_record(KIND_NAPTIEN, id)
+
+async def claim_pending_naptien(id):
+    """:return: (NaptienRecord, created_at) — created_at dùng để trả lại dữ liệu với hạn cũ; None nếu hết hạn"""
+    result = await _claim(KIND_NAPTIEN, id)
+    return (result[0], result[2]) if result else None
+
+async def delete_pending_naptien(id):
+    await _delete(KIND_NAPTIEN, id)
+
+
+# Xóa mọi dữ liệu chờ đã hết hạn theo từng lô (dùng index expires_at)
+async def cleanup_expired(kind=None, batch_size=CLEANUP_BATCH_SIZE):
+    """
+    Mỗi lô là một transaction riêng để không giữ khóa ghi lâu, các thao tác khác vẫn chen vào được.
+    :return: tổng số dòng đã xóa
+    """
+    now = time.time()
+    if kind:
+        query = """
+            DELETE FROM pending WHERE rowid IN (
+                SELECT rowid FROM pending WHERE expires_at <= ? AND kind = ? LIMIT ?
+            )
+        """
+        params = (now, kind, batch_size)
+    else:
+        query = """
+            DELETE FROM pending WHERE rowid IN (
+                SELECT rowid FROM pending WHERE expires_at <= ? LIMIT ?
+            )
+        """
+        params = (now, batch_size)
+
+    total_deleted = 0
     try:
-        expiration_time = (datetime.now() - timedelta(seconds=expiration_seconds)).isoformat()
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                DELETE FROM pending_rp_data WHERE created_at < ?
-            """, (expiration_time,))
-            rows_deleted = cursor.rowcount
-            conn.commit()
-            logger.info(f"Đã xóa {rows_deleted} pending_rp_data hết hạn.")
+        while True:
+            rows_deleted = await pending_store.execute(lambda conn: conn.execute(query, params).rowcount)
+            total_deleted += rows_deleted
+            if rows_deleted < batch_size:
+                break
+        logger.info(f"Đã xóa {total_deleted} dữ liệu chờ hết hạn.")
     except Exception as e:
-        logger.error(f"Lỗi khi dọn dẹp pending_rp_data: {e}", exc_info=True)
+        logger.error(f"Lỗi khi dọn dẹp dữ liệu chờ: {e}", exc_info=True)
+    return total_deleted
 
 
-# Xóa các pending_hold_data hết hạn
-def cleanup_expired_hold(expiration_seconds=86400, db_path="bot_data.db"):
+async def checkpoint_store():
+    """Gộp WAL vào file chính và cắt WAL về 0."""
     try:
-        expiration_time = (datetime.now() - timedelta(seconds=expiration_seconds)).isoformat()
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                DELETE FROM pending_hold_data WHERE created_at < ?
-            """, (expiration_time,))
-            rows_deleted = cursor.rowcount
-            conn.commit()
-            logger.info(f"Đã xóa {rows_deleted} pending_hold_data hết hạn.")
+        return await pending_store.execute(
+            lambda conn: conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone(), transactional=False
+        )
     except Exception as e:
-        logger.error(f"Lỗi khi dọn dẹp pending_hold_data: {e}", exc_info=True)
+        logger.error(f"Lỗi khi checkpoint SQLite: {e}", exc_info=True)
+        return None
 
 
-# Xóa các pending_naptien_data hết hạn
-def cleanup_expired_naptien(expiration_seconds=86400, db_path="bot_data.db"):
+async def vacuum_store():
+    """Thu gọn file SQLite sau khi đã xóa nhiều dòng."""
     try:
-        expiration_time = (datetime.now() - timedelta(seconds=expiration_seconds)).isoformat()
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                DELETE FROM pending_naptien_data WHERE created_at < ?
-            """, (expiration_time,))
-            rows_deleted = cursor.rowcount
-            conn.commit()
-            logger.info(f"Đã xóa {rows_deleted} pending_naptien_data hết hạn.")
+        await pending_store.execute(lambda conn: conn.execute("VACUUM"), transactional=False)
+        logger.info("Đã VACUUM bot_data.db.")
+        return True
     except Exception as e:
-        logger.error(f"Lỗi khi dọn dẹp pending_naptien_data: {e}", exc_info=True)
+        logger.error(f"Lỗi khi VACUUM SQLite: {e}", exc_info=True)
+        return False
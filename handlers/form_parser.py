@@ -0,0 +1,190 @@
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Tuple
+
+# Ký tự đầu dòng được bỏ qua trước khóa (+, -, •, *)
+_BULLETS = " \t+-•*"
+_NON_DIGIT = re.compile(r"\D")
+
+
+@lru_cache(maxsize=512)
+def fold_key(text):
+    """Chuẩn hóa khóa: bỏ dấu (kể cả đ → d), chữ thường, gộp khoảng trắng."""
+    text = text.replace("đ", "d").replace("Đ", "D")
+    text = unicodedata.normalize("NFD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(text.lower().split())
+
+
+# ===== Kiểu giá trị (raise ValueError nếu không hợp lệ) =====
+
+def as_text(value):
+    return value
+
+
+def as_int(value):
+    digits = _NON_DIGIT.sub("", value)
+    if not digits:
+        raise ValueError("không phải số")
+    return int(digits)
+
+
+def as_amount(value):
+    amount = as_int(value)
+    if amount <= 0:
+        raise ValueError("phải lớn hơn 0")
+    return amount
+
+
+def as_ids(value):
+    ids = [id_.strip() for id_ in value.split(",") if id_.strip().isdigit()]
+    if not ids:
+        raise ValueError("không có ID hợp lệ")
+    return ids
+
+
+def as_token(value):
+    return value.split()[0]
+
+
+def as_username(value):
+    username = as_token(value).lstrip("@")
+    if not username:
+        raise ValueError("thiếu username")
+    return username
+
+
+_MAX_SEEN_KEYS = 1024
+_IGNORED = object()  # đánh dấu khóa nằm trong ignored_keys
+
+
+@dataclass(frozen=True)
+class Field:
+    name: str
+    label: str
+    aliases: Tuple[str, ...] = ()
+    parse: Callable[[str], Any] = as_text
+    required: bool = False
+    default: Any = None
+    lenient: bool = False  # giá trị không đọc được → giữ giá trị mặc định, không báo lỗi cả form
+
+
+@dataclass
+class ParseResult:
+    values: Dict[str, Any]
+    missing: List[str] = field(default_factory=list)  # nhãn các trường bắt buộc bị thiếu
+    invalid: List[Tuple[str, str, str]] = field(default_factory=list)  # (nhãn, giá trị gốc, lý do)
+    unknown: List[str] = field(default_factory=list)  # khóa không có trong schema
+
+    @property
+    def ok(self):
+        return not self.missing and not self.invalid
+
+
+class FormSchema:
+    """
+    Schema form khai báo một lần: alias của khóa (có dấu/không dấu), kiểu giá trị, trường bắt buộc.
+    `parse` duyệt tin nhắn đúng một lượt, mỗi dòng một lần tra dict.
+    """
+
+    def __init__(self, fields, ignored_keys=()):
+        self.fields = tuple(fields)
+        self._index = {}
+        for form_field in self.fields:
+            for alias in (form_field.name, form_field.label) + form_field.aliases:
+                self._index[fold_key(alias)] = form_field
+        self._ignored = frozenset(fold_key(key) for key in ignored_keys)
+        self._defaults = {f.name: f.default for f in self.fields}
+        self._required = tuple(f for f in self.fields if f.required)
+        # Khóa thô đã gặp -> Field (None nếu không thuộc schema), tránh chuẩn hóa lại mỗi lần
+        self._seen_keys = {}
+
+    def _resolve(self, key):
+        try:
+            return self._seen_keys[key]
+        except KeyError:
+            pass
+        folded = fold_key(key)
+        form_field = self._index.get(folded)
+        if form_field is None and folded in self._ignored:
+            form_field = _IGNORED
+        if len(self._seen_keys) < _MAX_SEEN_KEYS:
+            self._seen_keys[key] = form_field
+        return form_field
+
+    def parse(self, text) -> ParseResult:
+        values = dict(self._defaults)
+        seen = set()
+        errors = {}
+        unknown = []
+
+        text = (text or "").strip()
+        if text.startswith("/"):
+            # Bỏ lệnh ở đầu tin nhắn ("/rp", "/rp@ten_bot"), giữ phần còn lại của dòng đầu
+            first_line, _, rest = text.partition("\n")
+            tail = first_line.partition(" ")[2]
+            text = f"{tail}\n{rest}" if tail else rest
+
+        for line in text.splitlines():
+            key, sep, raw = line.partition(":")
+            if not sep:
+                continue
+            key = key.strip(_BULLETS)
+            form_field = self._resolve(key)
+            if form_field is None:
+                if key:
+                    unknown.append(key)
+                continue
+            if form_field is _IGNORED:
+                continue
+            raw = raw.strip()
+            if not raw:
+                continue
+            try:
+                values[form_field.name] = form_field.parse(raw)
+                seen.add(form_field.name)
+                errors.pop(form_field.name, None)
+            except ValueError as e:
+                if form_field.lenient:
+                    continue
+                errors[form_field.name] = (form_field.label, raw, str(e))
+
+        missing = [f.label for f in self._required if f.name not in seen and f.name not in errors]
+        return ParseResult(values, missing, list(errors.values()), unknown)
+
+
+# ===== Schema của các lệnh =====
+
+NS_FORM = FormSchema(
+    [
+        Field("tên nhóm", "Tên nhóm", aliases=("nhóm",), default=""),
+        Field("tổ", "Tổ", required=True, default=""),
+        Field("mã hd", "Mã hd", aliases=("mã hậu đài",), required=True, default=""),
+        Field("ngân sách", "Ngân sách", aliases=("ngân sách xin", "ns"), parse=as_int, required=True, default=""),
+        Field("nội dung", "Nội dung", default=""),
+    ],
+    ignored_keys=("form ngân sách",),
+)
+
+RP_FORM = FormSchema([
+    Field("ad_ids", "ID Quảng Cáo", aliases=("id", "id qc", "ad id"), parse=as_ids, required=True, default=[]),
+    Field("spend", "Chi Tiêu", aliases=("chi tiêu", "spend"), parse=as_amount, required=True),
+    # Như trước đây: hold / số mess không phải số thì bỏ qua (hold = 0, số mess = None)
+    Field("hold", "Hold", parse=as_int, default=0, lenient=True),
+    Field("mess_num", "Số mess", parse=as_int, lenient=True),
+    Field("id_bc", "ID BC", parse=as_token),
+    Field("note", "Note", aliases=("ghi chú",)),
+])
+
+HOLD_FORM = FormSchema([
+    Field("id_bc", "ID BC", parse=as_token, required=True),
+    Field("hold", "Số tiền", aliases=("hold",), parse=as_amount, required=True),
+])
+
+NAPTIEN_FORM = FormSchema([
+    Field("id_bc", "ID BC", parse=as_token, required=True),
+    Field("so_tien_nap", "Số tiền nạp", aliases=("số tiền",), parse=as_amount, required=True),
+    Field("ads", "ADS", parse=as_username, required=True),
+])
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import time
+import config
+from handlers.api_client import api_client
+
+logger = logging.getLogger(__name__)
+
+MAX_CACHED = 256
+
+
+def _agent_key(agent):
+    return str(agent).strip().upper()
+
+
+def _last_modified(resp):
+    """Phiên bản dữ liệu của đại lý theo backend: các `lastModified` trong reports."""
+    reports = resp.data.get("reports") or [] if isinstance(resp.data, dict) else []
+    return tuple(str(report.get("lastModified")) for report in reports)
+
+
+class KpiLookup:
+    """
+    Lớp tra cứu HQQC (/xn) đứng trước API agency KPI:
+    - dryRun: các lệnh /xn cùng (đại lý, inputBudgets) đang chạy dùng chung một request (singleflight),
+      kết quả được cache KPI_CACHE_TTL giây và chỉ dùng lại khi `lastModified` vẫn là bản mới nhất đã thấy.
+    - Không dryRun (ghi DB): luôn gọi thẳng backend và xóa cache của đại lý đó.
+    """
+    _instance = None  # Singleton instance
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(KpiLookup, cls).__new__(cls)
+            cls._instance._init_state()
+        return cls._instance
+
+    def _init_state(self):
+        self._inflight = {}
+        self._cache = {}     # (agent, budgets) -> (expires_at, last_modified, resp)
+        self._versions = {}  # agent -> last_modified mới nhất đã thấy
+        self._stats = {"hits": 0, "coalesced": 0, "requests": 0, "writes": 0}
+
+    def _invalidate_agent(self, agent):
+        for key in [key for key in self._cache if key[0] == agent]:
+            del self._cache[key]
+        self._versions.pop(agent, None)
+
+    def _cached(self, key):
+        entry = self._cache.get(key)
+        if not entry:
+            return None
+        expires_at, last_modified, resp = entry
+        if expires_at <= time.monotonic() or self._versions.get(key[0]) != last_modified:
+            del self._cache[key]
+            return None
+        return resp
+
+    async def _request(self, key, agent, input_budgets, created_by):
+        self._stats["requests"] += 1
+        resp = await api_client.agency_kpi(agent, input_budgets, dry_run=True, created_by=created_by)
+        if resp.ok:
+            if len(self._cache) >= MAX_CACHED:
+                now = time.monotonic()
+                self._cache = {k: entry for k, entry in self._cache.items() if entry[0] > now}
+            last_modified = _last_modified(resp)
+            self._versions[key[0]] = last_modified
+            self._cache[key] = (time.monotonic() + config.KPI_CACHE_TTL, last_modified, resp)
+        return resp
+
+    async def lookup(self, agent, input_budgets, dry_run, created_by):
+        """:return: ApiResponse của agency KPI (lỗi mạng raise như gọi trực tiếp)."""
+        agent_key = _agent_key(agent)
+        if not dry_run:
+            self._stats["writes"] += 1
+            resp = await api_client.agency_kpi(agent, input_budgets, dry_run=False, created_by=created_by)
+            self._invalidate_agent(agent_key)
+            return resp
+
+        key = (agent_key, tuple(input_budgets))
+        resp = self._cached(key)
+        if resp is not None:
+            self._stats["hits"] += 1
+            logger.info(f"♻️ /xn {agent}: dùng kết quả trong cache.")
+            return resp
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._request(key, agent, input_budgets, created_by))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self._stats["coalesced"] += 1
+            logger.info(f"🔗 /xn {agent}: dùng chung request đang chạy.")
+        # shield: một lệnh bị hủy không hủy request mà các lệnh khác đang chờ
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {**self._stats, "cached": len(self._cache), "inflight": len(self._inflight)}
+
+
+kpi_lookup = KpiLookup()
@@ -0,0 +1,140 @@
+import json
+import logging
+from dataclasses import dataclass, asdict, fields
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# orjson nhanh và gọn hơn nếu có cài; không có thì dùng json chuẩn (không escape unicode)
+try:
+    import orjson
+
+    def _dumps(obj):
+        return orjson.dumps(obj).decode("utf-8")
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    _loads = json.loads
+
+
+class PayloadVersionError(ValueError):
+    """Dữ liệu chờ không giải mã được theo schema hiện tại."""
+
+
+# =========================
+# Bản ghi dữ liệu chờ theo từng loại
+# =========================
+@dataclass
+class Allocation:
+    contract_code: str
+    original_contract_code: str
+    count: int
+    amount: int
+    current: int
+
+
+@dataclass
+class BudgetPlan:
+    """Kế hoạch phân bổ ngân sách tính ở bước xem trước /ns."""
+    team: str
+    group_name: str
+    note: str
+    total: int
+    allocations: List[Allocation]
+
+
+@dataclass
+class RpRecord:
+    ad_ids: Optional[list]
+    spend: Optional[int]
+    ad_type: Optional[str]
+    note: Optional[str]
+    group_name: Optional[str]
+    group_id: Optional[int]
+    sender: Optional[str]
+    ad_date: Optional[str]
+    hold: Optional[int]
+    mess_num: Optional[str]
+    id_bc: Optional[str]
+
+
+@dataclass
+class HoldRecord:
+    id_bc: Optional[str]
+    hold: Optional[int]
+    ten_tele: Optional[str]  # chỉ lưu tên tele ở bước này, KHÔNG có nguoi_hanh_dong
+
+
+@dataclass
+class NaptienRecord:
+    id_bc: Optional[str]
+    so_tien_nap: Optional[int]
+    ten_tele: Optional[str]
+    ads: Optional[str]  # dùng để kiểm tra người confirm
+
+
+def _from_fields(record_type, body):
+    # Bỏ qua field lạ, field thiếu nhận None (giống cách đọc field-by-field trước đây)
+    return record_type(**{field.name: body.get(field.name) for field in fields(record_type)})
+
+
+def _plan_from_dict(body):
+    return BudgetPlan(
+        team=body["team"],
+        group_name=body["group_name"],
+        note=body["note"],
+        total=body["total"],
+        allocations=[Allocation(**allocation) for allocation in body["allocations"]],
+    )
+
+
+def _legacy_plan(body):
+    # Payload /ns cũ chỉ có form thô, không có kế hoạch phân bổ → không thể áp dụng lại
+    raise PayloadVersionError("Payload /ns cũ không có kế hoạch phân bổ")
+
+
+# kind -> {version: decoder}; version lớn nhất là version dùng khi ghi
+SCHEMAS = {
+    "confirmation": {0: _legacy_plan, 1: _plan_from_dict},
+    "rp": {0: lambda body: _from_fields(RpRecord, body), 1: lambda body: _from_fields(RpRecord, body)},
+    "hold": {0: lambda body: _from_fields(HoldRecord, body), 1: lambda body: _from_fields(HoldRecord, body)},
+    "naptien": {0: lambda body: _from_fields(NaptienRecord, body), 1: lambda body: _from_fields(NaptienRecord, body)},
+}
+
+
+def current_version(kind):
+    return max(SCHEMAS[kind])
+
+
+def encode(kind, record):
+    """Mã hóa bản ghi MỘT lần thành chuỗi {"v": version, "d": {...}}."""
+    return _dumps({"v": current_version(kind), "d": asdict(record)})
+
+
+def decode(kind, text):
+    """
+    Giải mã chuỗi đã lưu thành bản ghi có kiểu.
+    - Payload cũ (không có "v") được coi là version 0.
+    - Payload cũ bị json.dumps hai lần (chuỗi JSON nằm trong JSON) cũng được giải mã.
+    """
+    payload = _loads(text)
+    if isinstance(payload, str):
+        payload = _loads(payload)
+    if not isinstance(payload, dict):
+        raise PayloadVersionError(f"Payload {kind} không phải object")
+
+    if "v" in payload and "d" in payload:
+        version, body = payload["v"], payload["d"]
+    else:
+        version, body = 0, payload
+
+    decoder = SCHEMAS[kind].get(version)
+    if decoder is None:
+        raise PayloadVersionError(f"Không hỗ trợ payload {kind} version {version}")
+    try:
+        return decoder(body)
+    except (KeyError, TypeError) as e:
+        raise PayloadVersionError(f"Payload {kind} version {version} thiếu trường: {e}")
@@ -0,0 +1,297 @@
+import asyncio
+import itertools
+import logging
+import random
+import time
+from collections import deque
+from telegram.error import RetryAfter, TimedOut, NetworkError
+import config
+
+logger = logging.getLogger(__name__)
+
+# Số nhỏ gửi trước
+PRIORITY_CONFIRM = 0   # xác nhận, nút bấm, sửa tin nhắn kết quả
+PRIORITY_NORMAL = 1    # trả lời lệnh thông thường
+PRIORITY_ADMIN = 2     # cảnh báo gửi admin
+PRIORITY_STATUS = 3    # tin nhắn trạng thái / tiến độ
+
+MAX_RETRY_AFTER = 5  # số lần tối đa chờ theo RetryAfter cho một tin nhắn
+
+
+def retry_after_seconds(error):
+    """RetryAfter.retry_after là số giây (PTB 21) hoặc timedelta (PTB 22)."""
+    value = error.retry_after
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+def _valid_chat_id(chat_id):
+    """chat_id là số (không phải bool) hoặc chuỗi không rỗng như "@channel"."""
+    if isinstance(chat_id, bool):
+        return False
+    return isinstance(chat_id, int) or (isinstance(chat_id, str) and bool(chat_id))
+
+
+class _TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Số giây đến khi có 1 lượt gửi (0 nếu gửi được ngay)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ("chat_id", "call", "priority", "seq", "future", "not_before", "attempts", "waits")
+
+    def __init__(self, chat_id, call, priority, seq, future):
+        self.chat_id = chat_id
+        self.call = call
+        self.priority = priority
+        self.seq = seq
+        self.future = future
+        self.not_before = 0.0
+        self.attempts = 0
+        self.waits = 0
+
+
+class SendScheduler:
+    """
+    Hàng đợi gửi tin nhắn Telegram dùng chung cho cả bot:
+    - Giới hạn tốc độ toàn cục (SEND_GLOBAL_PER_SECOND) và theo chat (nhóm: SEND_GROUP_PER_MINUTE,
+      chat riêng: SEND_CHAT_PER_SECOND), cho phép dồn tối đa SEND_CHAT_BURST tin.
+    - Trong một chat luôn gửi đúng thứ tự gọi, mỗi chat chỉ một tin đang gửi. PRIORITY_* chỉ dùng để
+      chọn chat nào gửi tiếp (so tin đầu hàng của các chat; cùng mức thì tin gọi trước đi trước).
+    - RetryAfter: tạm dừng chat đó đúng `retry_after` giây rồi gửi lại.
+    - TimedOut / NetworkError: thử lại tối đa SEND_RETRIES lần (backoff có jitter).
+    Lỗi khác (BadRequest, Forbidden...) được trả về cho nơi gọi.
+    """
+    _instance = None  # Singleton instance
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(SendScheduler, cls).__new__(cls)
+            cls._instance._init_state()
+        return cls._instance
+
+    def _init_state(self):
+        self._chats = {}  # chat_id -> deque các tin chờ gửi, theo thứ tự gọi
+        self._seq = itertools.count()
+        self._chat_buckets = {}
+        self._blocked_until = {}  # chat_id -> thời điểm hết RetryAfter
+        self._inflight = set()
+        self._global = _TokenBucket(config.SEND_GLOBAL_PER_SECOND, config.SEND_GLOBAL_PER_SECOND)
+        self._worker = None
+        self._wakeup = None
+        self._slots = None
+        self._stats = {"sent": 0, "retry_after": 0, "retried": 0, "failed": 0}
+
+    # ===== Vòng đời =====
+
+    def _ensure_started(self):
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(config.SEND_CONCURRENCY)
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self, timeout=10):
+        """Chờ gửi hết hàng đợi (tối đa `timeout` giây) rồi dừng."""
+        if self._worker is None:
+            return
+        deadline = time.monotonic() + timeout
+        while (self._chats or self._inflight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._chats:
+            logger.warning(f"⚠️ Dừng hàng đợi gửi khi còn {self._queued()} tin chưa gửi.")
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    # ===== Gửi =====
+
+    def schedule(self, chat_id, call, priority=PRIORITY_NORMAL):
+        """
+        :param call: hàm không tham số trả về coroutine gọi Bot API (gọi lại được khi thử lại)
+        :return: Future nhận kết quả của lần gọi thành công (hoặc lỗi cuối cùng)
+        """
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        if not _valid_chat_id(chat_id):
+            # vd truyền nhầm cả tập ADMIN_IDS: báo lỗi cho nơi gọi, không đưa vào hàng đợi
+            self._stats["failed"] += 1
+            future.set_exception(ValueError(f"chat_id không hợp lệ: {chat_id!r}"))
+            return future
+        job = _Job(chat_id, call, priority, next(self._seq), future)
+        self._chats.setdefault(chat_id, deque()).append(job)
+        self._wakeup.set()
+        return future
+
+    async def send(self, chat_id, call, priority=PRIORITY_NORMAL):
+        return await self.schedule(chat_id, call, priority)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 1000:
+                now = time.monotonic()
+                self._chat_buckets = {
+                    key: value for key, value in self._chat_buckets.items() if not value.idle(now)
+                }
+            # chat_id âm (hoặc @username của kênh) là nhóm / siêu nhóm / kênh
+            is_group = not isinstance(chat_id, int) or chat_id < 0
+            rate = config.SEND_GROUP_PER_MINUTE / 60 if is_group else config.SEND_CHAT_PER_SECOND
+            bucket = self._chat_buckets[chat_id] = _TokenBucket(rate, config.SEND_CHAT_BURST)
+        return bucket
+
+    def _next_ready(self):
+        """:return: (job, None) nếu có tin gửi được ngay, ngược lại (None, số giây cần chờ hoặc None)"""
+        now = time.monotonic()
+        global_delay = self._global.delay(now)
+        if global_delay > 0:
+            return None, global_delay
+
+        wait = None
+        found = None
+        # Chỉ xét tin đầu hàng của từng chat: tin sau không bao giờ vượt tin trước trong cùng chat
+        for chat_id, jobs in list(self._chats.items()):
+            while jobs and jobs[0].future.done():  # nơi gọi đã hủy
+                jobs.popleft()
+            if not jobs:
+                del self._chats[chat_id]
+                continue
+            if chat_id in self._inflight:
+                continue
+            job = jobs[0]
+            try:
+                delay = max(
+                    job.not_before - now,
+                    self._blocked_until.get(chat_id, 0.0) - now,
+                    self._chat_bucket(chat_id).delay(now),
+                )
+            except Exception as e:
+                logger.error(f"❌ Lỗi khi xếp lịch tin nhắn tới chat {chat_id}: {e}", exc_info=True)
+                self._pop(chat_id)
+                self._fail(job, e)
+                continue
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+            elif found is None or (job.priority, job.seq) < (found.priority, found.seq):
+                found = job
+        if found is not None:
+            self._pop(found.chat_id)
+        return found, wait
+
+    def _pop(self, chat_id):
+        jobs = self._chats[chat_id]
+        jobs.popleft()
+        if not jobs:
+            del self._chats[chat_id]
+
+    def _queued(self):
+        return sum(len(jobs) for jobs in self._chats.values())
+
+    async def _run(self):
+        while True:
+            job = None
+            acquired = False
+            try:
+                job, wait = self._next_ready()
+                if job is None:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._slots.acquire()
+                acquired = True
+                self._global.take()
+                self._chat_bucket(job.chat_id).take()
+                self._inflight.add(job.chat_id)
+                asyncio.create_task(self._send(job))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Lỗi bất ngờ chỉ làm hỏng tin đang xử lý, không làm dừng cả hàng đợi
+                logger.error(f"❌ Lỗi trong vòng lặp hàng đợi gửi: {e}", exc_info=True)
+                if job is not None:
+                    self._inflight.discard(job.chat_id)
+                    self._fail(job, e)
+                if acquired:
+                    self._slots.release()
+                await asyncio.sleep(0.1)
+
+    def _requeue(self, job):
+        # Tin gửi lại về đầu hàng của chat, vẫn đứng trước các tin gọi sau nó
+        self._chats.setdefault(job.chat_id, deque()).appendleft(job)
+
+    async def _send(self, job):
+        try:
+            result = await job.call()
+        except RetryAfter as e:
+            seconds = retry_after_seconds(e)
+            self._stats["retry_after"] += 1
+            now = time.monotonic()
+            if len(self._blocked_until) > 1000:
+                self._blocked_until = {key: until for key, until in self._blocked_until.items() if until > now}
+            self._blocked_until[job.chat_id] = now + seconds
+            job.waits += 1
+            if job.waits > MAX_RETRY_AFTER:
+                self._fail(job, e)
+            else:
+                logger.warning(f"⏳ Telegram yêu cầu chờ {seconds:.0f}s trước khi gửi tiếp tới chat {job.chat_id}.")
+                self._requeue(job)
+        except (TimedOut, NetworkError) as e:
+            job.attempts += 1
+            if job.attempts > config.SEND_RETRIES:
+                self._fail(job, e)
+            else:
+                self._stats["retried"] += 1
+                delay = random.uniform(0, min(10, 2 ** job.attempts))
+                logger.warning(f"⚠️ Gửi tới chat {job.chat_id} lỗi ({e}), thử lại lần {job.attempts} sau {delay:.1f}s.")
+                job.not_before = time.monotonic() + delay
+                self._requeue(job)
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            self._stats["sent"] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._inflight.discard(job.chat_id)
+            self._slots.release()
+            self._wakeup.set()
+
+    def _fail(self, job, error):
+        self._stats["failed"] += 1
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            **self._stats,
+            "queued": self._queued(),
+            "inflight": len(self._inflight),
+            "blocked_chats": sum(1 for until in self._blocked_until.values() if until > now),
+        }
+
+
+send_scheduler = SendScheduler()
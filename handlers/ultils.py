@@ -6,12 +6,12 @@ import unicodedata
 import time
 import calendar
 from datetime import datetime
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type ,RetryError
 from telegram.error import TimedOut, NetworkError, RetryAfter , Forbidden , BadRequest
 from telegram.ext import ContextTypes
 from telegram import Update
 from config import ADMIN_IDS
 from telegram.helpers import escape_markdown
+from handlers.send_scheduler import send_scheduler, PRIORITY_CONFIRM, PRIORITY_NORMAL, PRIORITY_ADMIN
 # Thiết lập logging
 logger = logging.getLogger(__name__)
 
@@ -92,12 +92,11 @@ def get_custom_today_epoch():
     #     return time.time()
     return time.time()
 
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=2, max=10),
-    retry=retry_if_exception_type((TimedOut, NetworkError, RetryAfter))
-)
-async def safe_send_message(bot, chat_id, text, **kwargs):
+async def safe_send_message(bot, chat_id, text, priority=None, **kwargs):
+    """
+    Gửi tin nhắn qua hàng đợi gửi chung (giới hạn tốc độ, ưu tiên, tự chờ RetryAfter và thử lại lỗi mạng).
+    Mặc định tin có nút bấm được ưu tiên PRIORITY_CONFIRM, còn lại PRIORITY_NORMAL.
+    """
     try:
         # Kiểm tra và chuẩn hóa tham số
         if not text or not isinstance(text, str):
@@ -110,40 +109,51 @@ async def safe_send_message(bot, chat_id, text, **kwargs):
             elif isinstance(value, dict):
                 kwargs[key] = {k: list(v) if isinstance(v, set) else v for k, v in value.items()}
 
+        if priority is None:
+            priority = PRIORITY_CONFIRM if kwargs.get("reply_markup") is not None else PRIORITY_NORMAL
+
         # Chia nhỏ tin nhắn nếu quá dài
         max_length = 4096
         chunks = [text[i:i + max_length] for i in range(0, len(text), max_length)]
 
-        # Gửi từng phần tin nhắn
+        # Gửi từng phần tin nhắn (cùng chat nên giữ đúng thứ tự)
         results = []
         for chunk in chunks:
-            result = await bot.send_message(chat_id=chat_id, text=chunk, **kwargs)
+            result = await send_scheduler.send(
+                chat_id, lambda chunk=chunk: bot.send_message(chat_id=chat_id, text=chunk, **kwargs), priority
+            )
             results.append(result)
 
         return results
 
-    except RetryError as e:
-        logger.error(f"Gửi tin nhắn thất bại sau khi retry: {e}")
-        await notify_admins(bot, chat_id, f"Lỗi gửi tin nhắn: {e}")
-
     except (BadRequest, Forbidden) as e:
         logger.error(f"Lỗi Telegram API (BadRequest hoặc Forbidden): {e}")
-        await notify_admins(bot, chat_id, f"Lỗi Telegram API: {e}")
+        notify_admins(bot, chat_id, f"Lỗi Telegram API: {e}")
+
+    except (TimedOut, NetworkError, RetryAfter) as e:
+        logger.error(f"Gửi tin nhắn thất bại sau khi retry: {e}")
+        notify_admins(bot, chat_id, f"Lỗi gửi tin nhắn: {e}")
 
     except Exception as e:
         logger.critical(f"Lỗi không xác định khi gửi tin nhắn tới {chat_id}: {e}")
         logger.debug(f"Dữ liệu bị lỗi: text={text}, kwargs={kwargs}")
-        await notify_admins(bot, chat_id, f"Lỗi không xác định: {e}")
+        notify_admins(bot, chat_id, f"Lỗi không xác định: {e}")
+
 
 
+async def safe_reply(bot, message, text, priority=None, **kwargs):
+    """
+    Trả lời `message` qua hàng đợi gửi chung (thay cho message.reply_text):
+    trong nhóm trích dẫn tin nhắn gốc như reply_text mặc định, tin gốc đã bị xóa thì vẫn gửi.
+    """
+    if message.chat.type != "private":
+        kwargs.setdefault("reply_to_message_id", message.message_id)
+        kwargs.setdefault("allow_sending_without_reply", True)
+    return await safe_send_message(bot, message.chat_id, text, priority, **kwargs)
+
 
-# Hàm trợ giúp chỉnh sửa tin nhắn với retry
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=2, max=10),
-    retry=retry_if_exception_type((TimedOut, NetworkError, RetryAfter))
-)
-async def safe_edit_message(bot, chat_id, message_id, text, **kwargs):
+# Hàm trợ giúp chỉnh sửa tin nhắn qua hàng đợi gửi chung
+async def safe_edit_message(bot, chat_id, message_id, text, priority=PRIORITY_CONFIRM, **kwargs):
     try:
         # Kiểm tra và chuẩn hóa tham số
         if not text or not isinstance(text, str):
@@ -155,37 +165,50 @@ async def safe_edit_message(bot, chat_id, message_id, text, **kwargs):
                 kwargs[key] = list(value)
 
         # Chỉnh sửa tin nhắn
-        return await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, **kwargs)
-
-    except RetryError as e:
-        logger.error(f"Chỉnh sửa tin nhắn thất bại sau khi retry: {e}")
-        await notify_admins(bot, chat_id, f"Lỗi chỉnh sửa tin nhắn: {e}")
+        return await send_scheduler.send(
+            chat_id,
+            lambda: bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, **kwargs),
+            priority,
+        )
 
     except (BadRequest, Forbidden) as e:
+        if "message is not modified" in str(e).lower():
+            # Bấm lại nút / sửa cùng nội dung: không phải lỗi
+            logger.info(f"Tin nhắn {message_id} tại chat {chat_id} không đổi nội dung, bỏ qua.")
+            return None
         logger.error(f"Lỗi Telegram API (BadRequest hoặc Forbidden): {e}")
-        await notify_admins(bot, chat_id, f"Lỗi Telegram API: {e}")
+        notify_admins(bot, chat_id, f"Lỗi Telegram API: {e}")
+
+    except (TimedOut, NetworkError, RetryAfter) as e:
+        logger.error(f"Chỉnh sửa tin nhắn thất bại sau khi retry: {e}")
+        notify_admins(bot, chat_id, f"Lỗi chỉnh sửa tin nhắn: {e}")
 
     except Exception as e:
         logger.critical(f"Lỗi không xác định khi chỉnh sửa tin nhắn tại chat_id {chat_id}, message_id {message_id}: {e}")
-        await notify_admins(bot, chat_id, f"Lỗi không xác định: {e}")
+        notify_admins(bot, chat_id, f"Lỗi không xác định: {e}")
+
+
+def _log_admin_alert_result(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"Không thể gửi thông báo lỗi tới admin: {future.exception()}")
 
 
-async def notify_admins(bot, chat_id, error_message): 
+def notify_admins(bot, chat_id, error_message):
+    """Xếp thông báo lỗi gửi admin vào hàng đợi (ưu tiên thấp, không chờ gửi xong)."""
     if "ADMIN_IDS" in globals() and ADMIN_IDS:
-        error_list = []
-        for admin_id in ADMIN_IDS:
-            error_list.append(f"<b>Lỗi gửi tới Chat ID:</b> {chat_id}\n<b>Chi tiết:</b> {error_message}")
-        error_message_html = "\n\n".join(error_list)  # Dùng \n để xuống dòng
+        error_message_html = f"<b>Lỗi gửi tới Chat ID:</b> {chat_id}\n<b>Chi tiết:</b> {error_message}"
         logger.error(f"Thông báo lỗi tới admin: {error_message_html}")
-        try:
-            for admin_id in ADMIN_IDS:
-                await bot.send_message(
+        for admin_id in ADMIN_IDS:
+            future = send_scheduler.schedule(
+                admin_id,
+                lambda admin_id=admin_id: bot.send_message(
                     chat_id=admin_id,
                     text=f"<b>Các lỗi xảy ra:</b>\n{error_message_html}",
                     parse_mode="HTML"
-                )
-        except Exception as admin_error:
-            logger.warning(f"Không thể gửi thông báo lỗi tới admin: {admin_error}")
+                ),
+                PRIORITY_ADMIN,
+            )
+            future.add_done_callback(_log_admin_alert_result)
 
 async def handle_info_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Xử lý lệnh /info để trả về thông tin người dùng."""
@@ -207,10 +230,10 @@ async def handle_info_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             f"🌐 *Ngôn ngữ:* {language_code}"
         )
 
-        await update.message.reply_text(info_message, parse_mode="MarkdownV2")
+        await safe_reply(context.bot, update.message, info_message, parse_mode="MarkdownV2")
     except Exception as e:
         logger.error(f"Lỗi trong xử lý lệnh /info: {e}")
-        await update.message.reply_text("❗ *Lỗi:* Không thể lấy thông tin. Vui lòng thử lại sau.", parse_mode="MarkdownV2")
+        await safe_reply(context.bot, update.message, "❗ *Lỗi:* Không thể lấy thông tin. Vui lòng thử lại sau.", parse_mode="MarkdownV2")
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Hiển thị danh sách các lệnh bot hỗ trợ."""
@@ -229,7 +252,12 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "   - **/addtroly <id>** - Thêm trợ lý mới.\n"
         "   - **/removetroly <id>** - Xóa trợ lý.\n"
         "   - **/lstroly** - Liệt kê danh sách trợ lý.\n"
+        "   - **/indexes** - Kiểm tra index của các truy vấn chính.\n"
+        "   - **/rebuildrollup** - Tính lại bảng tổng hợp ngân sách theo tháng khi tổng bị lệch (nên chạy lúc ít giao dịch).\n"
+        "   - **/reloadref** - Nạp lại giới hạn ngân sách và danh sách mã bỏ qua.\n"
+        "   - **/checkcache** - Thống kê cache kiểm tra TikTok/Facebook và /xn (`/checkcache clear` để xóa cache TikTok/Facebook).\n"
+        "   - **/breaker** - Trạng thái kết nối backend API và hàng đợi gửi tin (`/breaker reset` để mở lại ngay).\n"
         "Hãy nhập lệnh theo đúng định dạng để sử dụng bot hiệu quả!"
     )
-    await update.message.reply_text(help_text, parse_mode="Markdown")
+    await safe_reply(context.bot, update.message, help_text, parse_mode="Markdown")
 
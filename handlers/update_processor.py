@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+HANDLER_CLASS_DEFAULT = "default"
+HANDLER_CLASS_BACKEND = "backend"
+
+# Lệnh / nút bấm gọi backend TikTok/Facebook/agency KPI (có thể chậm vài chục giây)
+BACKEND_COMMANDS = {"xn", "tiktok", "tiktok_bulk", "tiktok_check", "facebook"}
+BACKEND_CALLBACKS = {"tiktok_bulk_yes", "facebook_bulk_yes"}
+
+
+def classify_update(update):
+    """Nhóm handler của update, dùng để giới hạn số update cùng nhóm chạy song song."""
+    if not isinstance(update, Update):
+        return HANDLER_CLASS_DEFAULT
+    if update.callback_query:
+        action = (update.callback_query.data or "").split("|", 1)[0]
+        return HANDLER_CLASS_BACKEND if action in BACKEND_CALLBACKS else HANDLER_CLASS_DEFAULT
+    message = update.effective_message
+    text = message.text if message and message.text else ""
+    if text.startswith("/"):
+        command = text.split(maxsplit=1)[0][1:].split("@", 1)[0].lower()
+        if command in BACKEND_COMMANDS:
+            return HANDLER_CLASS_BACKEND
+    return HANDLER_CLASS_DEFAULT
+
+
+def _chat_id(update):
+    if isinstance(update, Update) and update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Xử lý update của các chat khác nhau song song, update trong cùng một chat theo đúng thứ tự nhận
+    (xác nhận ngân sách và /done trong một phòng không bao giờ chạy đè nhau).
+    - `max_concurrent_updates`: tổng số update chạy cùng lúc.
+    - `class_limits`: {nhóm handler: số update tối đa} theo `classify_update`, vd giới hạn các lệnh gọi backend.
+    Thứ tự khóa: chat → nhóm → toàn cục; update đang chờ chat của nó không giữ suất chạy toàn cục.
+    """
+
+    def __init__(self, max_concurrent_updates, class_limits=None, classify=classify_update):
+        super().__init__(max_concurrent_updates)
+        self.class_limits = dict(class_limits or {})
+        self.classify = classify
+        self._class_semaphores = {}
+        self._chats = {}  # chat_id -> [lock, số update đang giữ/chờ]
+
+    async def process_update(self, update, coroutine):
+        # Ghi đè thứ tự của lớp cha (giữ semaphore toàn cục trước): phải xếp hàng theo chat trước,
+        # nếu không một phòng dồn nhiều update sẽ chiếm hết suất chạy của các phòng khác.
+        # Task của Application được tạo theo thứ tự nhận update và asyncio.Lock đánh thức theo FIFO,
+        # nên thứ tự trong từng chat được giữ nguyên.
+        chat_id = _chat_id(update)
+        if chat_id is None:
+            return await self._run_limited(update, coroutine)
+
+        entry = self._chats.get(chat_id)
+        if entry is None:
+            entry = self._chats[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run_limited(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chats[chat_id]
+
+    async def _run_limited(self, update, coroutine):
+        handler_class = self.classify(update)
+        limit = self.class_limits.get(handler_class)
+        if not limit:
+            async with self._semaphore:
+                return await self.do_process_update(update, coroutine)
+        semaphore = self._class_semaphores.get(handler_class)
+        if semaphore is None:
+            semaphore = self._class_semaphores[handler_class] = asyncio.Semaphore(limit)
+        async with semaphore, self._semaphore:
+            return await self.do_process_update(update, coroutine)
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
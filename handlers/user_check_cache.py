@@ -0,0 +1,115 @@
+import logging
+import time
+from collections import OrderedDict
+import config
+
+logger = logging.getLogger(__name__)
+
+PLATFORM_TIKTOK = "tiktok"
+PLATFORM_FACEBOOK = "facebook"
+
+
+def normalize_uid(uid):
+    """Khóa cache: bỏ khoảng trắng, bỏ @ đầu, chữ thường."""
+    return str(uid).strip().lstrip("@").lower()
+
+
+class UserCheckCache:
+    """
+    Cache kết quả bulk-check (userInfo / exists) theo từng nền tảng, khóa là UID đã chuẩn hóa.
+    - Có userInfo → sống USER_CHECK_TTL_FOUND giây; không tìm thấy → USER_CHECK_TTL_NOT_FOUND giây.
+    - Kết quả lỗi không được cache.
+    - Giới hạn USER_CHECK_CACHE_SIZE mục mỗi nền tảng, bỏ mục dùng lâu nhất khi đầy.
+    """
+    _instance = None  # Singleton instance
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(UserCheckCache, cls).__new__(cls)
+            cls._instance._init_cache()
+        return cls._instance
+
+    def _init_cache(self):
+        self.max_size = config.USER_CHECK_CACHE_SIZE
+        self._entries = {}
+        self._stats = {}
+
+    def _platform(self, platform):
+        if platform not in self._entries:
+            self._entries[platform] = OrderedDict()
+            self._stats[platform] = {"hits": 0, "misses": 0, "invalidated": 0}
+        return self._entries[platform], self._stats[platform]
+
+    def lookup(self, platform, uids):
+        """
+        :return: (cached, misses)
+            - cached: list cùng thứ tự `uids`, kết quả đã cache hoặc None
+            - misses: list UID (không trùng theo khóa chuẩn hóa) cần hỏi backend
+        """
+        entries, stats = self._platform(platform)
+        now = time.monotonic()
+        cached = []
+        misses = []
+        pending = set()
+        for uid in uids:
+            key = normalize_uid(uid)
+            entry = entries.get(key)
+            if entry and entry[0] > now:
+                entries.move_to_end(key)
+                stats["hits"] += 1
+                cached.append(entry[1])
+                continue
+            if entry:
+                del entries[key]
+            stats["misses"] += 1
+            cached.append(None)
+            if key not in pending:
+                pending.add(key)
+                misses.append(uid)
+        return cached, misses
+
+    def store(self, platform, uids, infos):
+        entries, _ = self._platform(platform)
+        now = time.monotonic()
+        for uid, info in zip(uids, infos):
+            if not info or info.get("error"):
+                continue
+            ttl = config.USER_CHECK_TTL_FOUND if info.get("userInfo") else config.USER_CHECK_TTL_NOT_FOUND
+            key = normalize_uid(uid)
+            entries[key] = (now + ttl, info)
+            entries.move_to_end(key)
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+
+    def invalidate(self, platform, uids):
+        """Xóa các UID khỏi cache (sau khi bulk-save / bulk-create thành công)."""
+        entries, stats = self._platform(platform)
+        removed = 0
+        for uid in uids:
+            if entries.pop(normalize_uid(uid), None) is not None:
+                removed += 1
+        stats["invalidated"] += removed
+        if removed:
+            logger.info(f"♻️ Đã xóa {removed} UID {platform} khỏi cache kiểm tra.")
+        return removed
+
+    def clear(self):
+        self._entries = {}
+        self._stats = {}
+        logger.info("♻️ Đã xóa toàn bộ cache kiểm tra TikTok/Facebook.")
+
+    def stats(self):
+        """:return: dict nền tảng -> {size, hits, misses, invalidated, hit_rate}"""
+        report = {}
+        for platform, entries in self._entries.items():
+            stats = self._stats[platform]
+            total = stats["hits"] + stats["misses"]
+            report[platform] = {
+                "size": len(entries),
+                **stats,
+                "hit_rate": stats["hits"] / total if total else 0.0,
+            }
+        return report
+
+
+user_check_cache = UserCheckCache()
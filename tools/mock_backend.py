@@ -0,0 +1,233 @@
+"""
+Backend giả lập cho các API TikTok / Facebook / agency KPI mà bot gọi (xem handlers/api_client.py).
+Dùng để chạy thử /tiktok, /facebook, /xn, bulk-save, bulk-create và đo tải trên máy cá nhân, không cần mạng.
+
+Chạy:
+    python -m tools.mock_backend --port 8088 --latency lognormal:80:0.6 --error-rate 0.02
+rồi đặt cho bot:
+    API_BASE_URL=http://127.0.0.1:8088/
+
+Kết quả cho mỗi UID là cố định (theo hash) để cache và chia lô cho kết quả lặp lại được;
+độ trễ và lỗi thì ngẫu nhiên theo tham số. GET /__stats trả về số request theo endpoint.
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import math
+import random
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "/api/v1"
+KPI_EPOCH = 1735689600  # 2025-01-01T00:00:00Z
+
+
+def _fraction(*parts):
+    """Số cố định trong [0, 1) theo nội dung `parts`."""
+    digest = hashlib.sha1("|".join(map(str, parts)).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+def parse_latency(spec):
+    """
+    "fixed:50" | "uniform:20:200" | "normal:100:30" | "exp:100" | "lognormal:<trung vị ms>:<sigma>"
+    :return: hàm (rng) -> độ trễ (giây)
+    """
+    kind, *args = spec.split(":")
+    values = [float(arg) for arg in args]
+    if kind == "fixed":
+        return lambda rng: values[0] / 1000
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1])) / 1000
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1 / values[0]) / 1000
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1]) / 1000
+    raise argparse.ArgumentTypeError(f"Không hỗ trợ phân phối độ trễ: {spec}")
+
+
+class MockBackend:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.latency = parse_latency(args.latency)
+        self.saved = {"tiktok": set(), "facebook": set()}
+        self.kpi_versions = Counter()
+        self.stats = Counter()
+        self.started = time.time()
+
+    # ===== Giả lập độ trễ / lỗi =====
+
+    async def _simulate(self, endpoint, uids=()):
+        self.stats[endpoint] += 1
+        delay = self.latency(self.rng)
+        # UID "chậm" cố định: một handle chậm làm chậm cả lô chứa nó
+        slow = [uid for uid in uids if _fraction("slow", uid) < self.args.slow_uid_rate]
+        if slow:
+            delay += self.args.slow_uid_ms / 1000
+        if self.rng.random() < self.args.hang_rate:
+            self.stats[f"{endpoint}:hang"] += 1
+            delay += self.args.hang_seconds
+        await asyncio.sleep(delay)
+        if self.rng.random() < self.args.error_rate:
+            self.stats[f"{endpoint}:500"] += 1
+            raise web.HTTPInternalServerError(
+                text='{"message": "mock: lỗi giả lập"}', content_type="application/json"
+            )
+
+    def _padding(self):
+        return "x" * self.args.payload_pad if self.args.payload_pad else None
+
+    # ===== TikTok / Facebook =====
+
+    def _user_info(self, platform, uid):
+        if _fraction("notfound", platform, uid) < self.args.not_found_rate:
+            return None
+        info = {
+            "username": uid.lstrip("@").lower(),
+            "user_id": str(int(_fraction("id", platform, uid) * 10 ** 18)),
+            "nickname": f"Mock {uid}",
+            "status": "active",
+        }
+        if platform == "facebook":
+            info["type"] = "profile"
+        if self.args.payload_pad:
+            info["bio"] = self._padding()
+        return info
+
+    def _exists(self, platform, uid):
+        key = uid.lstrip("@").lower()
+        return key in self.saved[platform] or _fraction("exists", platform, uid) < self.args.exists_rate
+
+    def _check_item(self, platform, uid):
+        info = self._user_info(platform, uid)
+        if info is None:
+            return {"userInfo": None, "exists": False, "message": "Không tìm thấy user (mock)"}
+        return {"userInfo": info, "exists": self._exists(platform, uid)}
+
+    def bulk_check(self, platform):
+        async def handler(request):
+            body = await request.json()
+            uids = body.get("uids") or []
+            await self._simulate(f"{platform}/bulk-check", uids)
+            return web.json_response({"data": [self._check_item(platform, uid) for uid in uids]})
+        return handler
+
+    def bulk_save(self, platform):
+        async def handler(request):
+            users = await request.json()
+            await self._simulate(f"{platform}/bulk-save")
+            for user in users:
+                self.saved[platform].add(str(user.get("username", "")).lower())
+            return web.json_response({"message": f"Đã lưu {len(users)} user (mock)", "saved": len(users)}, status=201)
+        return handler
+
+    async def tiktok_create(self, request):
+        user = await request.json()
+        await self._simulate("tiktok/create")
+        self.saved["tiktok"].add(str(user.get("username", "")).lower())
+        return web.json_response({"message": "Đã tạo user (mock)", "data": user}, status=201)
+
+    async def tiktok_bulk_create(self, request):
+        body = await request.json()
+        usernames = body.get("usernames") or []
+        await self._simulate("tiktok/bulk-create", usernames)
+        results = []
+        for username in usernames:
+            if self._user_info("tiktok", username) is None:
+                results.append({"username": username, "status": "failed", "message": "Không tìm thấy trên TikTok"})
+            elif self._exists("tiktok", username):
+                results.append({"username": username, "status": "exists", "message": "Đã tồn tại"})
+            else:
+                self.saved["tiktok"].add(username.lstrip("@").lower())
+                results.append({"username": username, "status": "created", "message": "Đã tạo"})
+        status = 200 if all(r["status"] == "created" for r in results) else 207
+        return web.json_response({"results": results}, status=status)
+
+    async def tiktok_check_username(self, request):
+        body = await request.json()
+        username = body.get("username", "")
+        await self._simulate("tiktok/check-exists-username", [username])
+        return web.json_response({"exists": self._exists("tiktok", username)})
+
+    # ===== Agency KPI =====
+
+    async def agency_kpi(self, request):
+        body = await request.json()
+        agent = str(body.get("agent", "")).upper()
+        await self._simulate("agency-kpi", [agent])
+        if _fraction("agent", agent) < self.args.not_found_rate:
+            return web.json_response({"message": f"Không có dữ liệu cho đại lý {agent} (mock)", "reports": []})
+        if not body.get("dryRun"):
+            self.kpi_versions[agent] += 1
+        base = _fraction("fee", agent)
+        fee = int(base * 500_000_000) + sum(body.get("inputBudgets") or [])
+        report = {
+            "agency": agent,
+            "advertisingFee": fee,
+            "kpiScore": int(fee * 0.8),
+            "kpiTarget": 1.5 + base,
+            "depositToAdFeeRatio": 2 * base + 0.5,
+            "wageringMultiplier": 3 * base + 1,
+            "approvedCondition1": "ĐẠT" if base > 0.3 else "KHÔNG ĐẠT",
+            "approvedCondition2": "ĐẠT" if base > 0.5 else "KHÔNG ĐẠT",
+            "actualProfit": int(base * 100_000),
+            # mỗi lần ghi (không dryRun) tăng lastModified 1 giây
+            "lastModified": datetime.fromtimestamp(KPI_EPOCH + self.kpi_versions[agent], timezone.utc).isoformat(),
+        }
+        return web.json_response({"message": "OK (mock)", "reports": [report]})
+
+    async def stats_handler(self, request):
+        return web.json_response({
+            "uptime": round(time.time() - self.started, 1),
+            "requests": dict(self.stats),
+            "saved": {platform: len(users) for platform, users in self.saved.items()},
+        })
+
+    def build_app(self):
+        app = web.Application()
+        app.add_routes([
+            web.post(f"{PREFIX}/tiktok-user/create", self.tiktok_create),
+            web.post(f"{PREFIX}/tiktok-user/bulk-create", self.tiktok_bulk_create),
+            web.post(f"{PREFIX}/tiktok-user/check-exists-username", self.tiktok_check_username),
+            web.post(f"{PREFIX}/tiktok-user/bulk-check", self.bulk_check("tiktok")),
+            web.post(f"{PREFIX}/tiktok-user/bulk-save", self.bulk_save("tiktok")),
+            web.post(f"{PREFIX}/facebook-user/bulk-check", self.bulk_check("facebook")),
+            web.post(f"{PREFIX}/facebook-user/bulk-save", self.bulk_save("facebook")),
+            web.post(f"{PREFIX}/agency-kpi", self.agency_kpi),
+            web.get("/__stats", self.stats_handler),
+        ])
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend giả lập TikTok/Facebook/agency KPI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--latency", default="fixed:50",
+                        help="fixed:ms | uniform:min:max | normal:mean:sd | exp:mean | lognormal:median:sigma")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Tỷ lệ request trả HTTP 500")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Tỷ lệ request bị treo thêm --hang-seconds")
+    parser.add_argument("--hang-seconds", type=float, default=30.0)
+    parser.add_argument("--slow-uid-rate", type=float, default=0.0, help="Tỷ lệ UID luôn chậm (cố định theo UID)")
+    parser.add_argument("--slow-uid-ms", type=float, default=5000.0)
+    parser.add_argument("--not-found-rate", type=float, default=0.1, help="Tỷ lệ UID/đại lý không tìm thấy")
+    parser.add_argument("--exists-rate", type=float, default=0.3, help="Tỷ lệ UID đã có trong hệ thống")
+    parser.add_argument("--payload-pad", type=int, default=0, help="Thêm N byte vào mỗi userInfo")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logger.info(f"🧪 Backend giả lập tại http://{args.host}:{args.port}/ (đặt API_BASE_URL=http://{args.host}:{args.port}/)")
+    web.run_app(MockBackend(args).build_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()